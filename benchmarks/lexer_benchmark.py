@@ -0,0 +1,317 @@
+"""
+Benchmark of the command dispatch and parsing.
+
+It builds the real MainLogic.commands table with stubbed handlers (so
+nothing goes to VK or to the database) and runs a generated corpus of
+commands through MainLogic.handle_command and Command.convert_command_to_args.
+For every kind of commands it prints commands per second, p50 and p99
+latency and the memory, which is allocated during one parse (measured with
+tracemalloc in a separate pass, so it doesn't slow down the timing pass).
+
+Run it from the project's root directory:
+
+    python -m benchmarks.lexer_benchmark [--repeat N] [--seed N] [--cache]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import random
+import statistics
+import time
+import tracemalloc
+from typing import (
+    Dict, List, Tuple, Callable, Awaitable, Any, AsyncIterator
+)
+
+import lexer.exceptions
+import lexer.generators
+import lexer.matching
+from handlers.dataclasses import HandlingResult
+from handlers.handler_helpers import HandlerHelpers
+from main_logic import MainLogic
+from vk.vk_config import VkConfig, make_vk_config_from_files
+from vk.vk_related_classes import Notification
+
+EMPLOYEES_CHAT_PEER_ID = 2000000001
+CLIENT_PEER_ID = 123
+
+
+class StubHandlers:
+    """
+    Has every handler, which the commands need, but handlers do nothing, so
+    only dispatch and parsing are measured.
+    """
+
+    def __init__(self, vk_config: VkConfig):
+        # noinspection PyTypeChecker
+        # because helpers aren't used with the database here
+        self.helpers = HandlerHelpers(None, vk_config)
+
+    def __getattr__(self, name: str) -> Callable[..., Awaitable[Any]]:
+        async def handler(*_args, **_kwargs) -> HandlingResult:
+            return HandlingResult(Notification(), commit_needed=False)
+        handler.__name__ = name
+        return handler
+
+
+class StubManagersContainer:
+    """
+    Has units of work, which don't start anything in the database.
+    """
+
+    @contextlib.asynccontextmanager
+    async def unit_of_work(self) -> AsyncIterator[None]:
+        yield
+
+
+def make_offline_vk_config() -> VkConfig:
+    """
+    Reads the real constants, but the secrets are fake, because nothing is
+    sent to VK.
+    """
+    fake_secrets = io.StringIO(
+        f"token = benchmark\n"
+        f"group_id = 1\n"
+        f"employees_chat_peer_id = {EMPLOYEES_CHAT_PEER_ID}\n"
+    )
+    with open(
+        "vk/config/vk_constants.ini", "r", encoding="utf-8"
+    ) as file_with_constants, open(
+        "vk/config/memo_for_users.txt", "r", encoding="utf-8"
+    ) as file_with_memo:
+        return make_vk_config_from_files(
+            files_with_config=[file_with_constants, fake_secrets],
+            file_with_memo=file_with_memo
+        )
+
+
+def make_main_logic(use_parsing_cache: bool) -> MainLogic:
+    vk_config = make_offline_vk_config()
+    # noinspection PyTypeChecker
+    # because stubs are given instead of the managers, VK worker and handlers
+    return MainLogic(
+        managers_container=StubManagersContainer(),
+        vk_worker=None,
+        handlers=StubHandlers(vk_config),
+        vk_config=vk_config,
+        commands_generator=lexer.generators.CommandsGenerator(vk_config),
+        commit_changes=False,
+        use_parsing_cache=use_parsing_cache
+    )
+
+
+def make_corpus(seed: int) -> Dict[str, List[str]]:
+    """
+    Makes commands, which are grouped by their kind.
+
+    Returns:
+        Dict[kind of the commands, texts of the commands]
+    """
+    random_ = random.Random(seed)
+    words = (
+        "сделать", "презентацию", "по", "истории", "на", "слайдов", "реферат",
+        "физике", "и", "срочно", "до", "пятницы", "с", "картинками", "Word"
+    )
+
+    def get_text(words_amount: int) -> str:
+        return " ".join(random_.choice(words) for _ in range(words_amount))
+
+    def get_ids(amount: int) -> str:
+        return ", ".join(
+            str(random_.randint(1, 100_000)) for _ in range(amount)
+        )
+
+    return {
+        "common": [
+            "заказы", "активные", "в ожидании", "взятые", "help", "памятка",
+            "месячное", "доход", "оплаченные 5", "все заказы",
+            f"взять {random_.randint(1, 1000)}",
+            f"инфо {get_ids(2)}",
+            f"оплачено {random_.randint(1, 1000)} 500",
+            f"отменить {random_.randint(1, 1000)} {get_text(3)}",
+            f"заказ {get_text(8)}",
+            "monthly 2026 10", "help заказ, взять", "taken", "earnings 7"
+        ],
+        "long texts": [
+            f"заказ {get_text(300)}",
+            f"заказ {get_text(300)}, {get_text(300)}",
+            f"отменить {get_ids(3)} {get_text(300)}",
+            f"оффлайн id{random_.randint(1, 10 ** 9)} {get_text(300)}"
+        ],
+        "500 IDs": [
+            f"взять {get_ids(500)}",
+            f"инфо {get_ids(500)}",
+            f"оплачено {get_ids(500)} 1000",
+            f"отменить {get_ids(500)} {get_text(5)}",
+            "взять " + ", ".join(
+                f"{start}-{start + random_.randint(1, 50)}"
+                for start in random_.sample(range(1, 100_000, 100), 500)
+            )
+        ],
+        "typos": [
+            "зкаазы", "взть 5", "памятк", "актвные", "оплчено 5 100",
+            "help", "hlep", "доход 2026 13", "monthly 13", "взять", "x",
+            "отменить", "отменить 5", "оплачено 5", "заказы -1"
+        ],
+        "adversarial": [
+            "отменить " + "1," * 3000 + "x",
+            "оплачено " + "1, " * 2000 + "x",
+            "взять " + "1 " * 2000,
+            "команды " + "a, " * 1000 + ",",
+            "help " + ", ," * 1000,
+            "месячное " + "1" * 5000,
+            "заказ " + " " * 5000,
+            "взять " + "1-" * 2000 + "1 x"
+        ]
+    }
+
+
+def get_percentile(sorted_values: List[float], percentile: float) -> float:
+    index = min(
+        len(sorted_values) - 1, int(len(sorted_values) * percentile / 100)
+    )
+    return sorted_values[index]
+
+
+def convert_with_every_candidate(main_logic: MainLogic, text: str) -> None:
+    """
+    Gives the text to Command.convert_command_to_args of every command, which
+    name matches, until one of them converts it (like
+    MainLogic.parse_command, but without the cache).
+    """
+    text_to_match = lexer.matching.TextToMatch(text)
+    for command in main_logic.commands_index.get_candidates(text):
+        try:
+            command.convert_command_to_args(text_to_match)
+        except lexer.exceptions.ParsingError:
+            pass
+        else:
+            break
+    text_to_match.forget_match_ends()
+
+
+def measure(
+        corpus: Dict[str, List[str]], repeat: int,
+        run: Callable[[str], None]) -> List[Tuple[str, int, List[float]]]:
+    """
+    Returns:
+        (kind of the commands, amount of runs, latencies in microseconds)
+    """
+    results = []
+    for kind, texts in corpus.items():
+        latencies = []
+        for _ in range(repeat):
+            for text in texts:
+                start = time.perf_counter()
+                run(text)
+                latencies.append((time.perf_counter() - start) * 1_000_000)
+        results.append((kind, len(latencies), latencies))
+    return results
+
+
+def measure_allocations(
+        corpus: Dict[str, List[str]],
+        run: Callable[[str], None]) -> Dict[str, Tuple[float, float]]:
+    """
+    Returns:
+        Dict[kind of the commands, (mean size of the memory blocks, which are
+        allocated during one run and are alive at its end, in bytes; mean
+        peak of the allocated memory in bytes)]
+    """
+    allocations = {}
+    tracemalloc.start()
+    try:
+        for kind, texts in corpus.items():
+            kept_sizes = []
+            peak_sizes = []
+            for text in texts:
+                tracemalloc.reset_peak()
+                size_before, _peak = tracemalloc.get_traced_memory()
+                run(text)
+                size_after, peak = tracemalloc.get_traced_memory()
+                kept_sizes.append(size_after - size_before)
+                peak_sizes.append(peak - size_before)
+            allocations[kind] = (
+                statistics.mean(kept_sizes), statistics.mean(peak_sizes)
+            )
+    finally:
+        tracemalloc.stop()
+    return allocations
+
+
+def print_results(
+        title: str, results: List[Tuple[str, int, List[float]]],
+        allocations: Dict[str, Tuple[float, float]]) -> None:
+    print(title)
+    print(
+        f"{'kind':<13}{'runs':>7}{'cmd/s':>11}{'p50, us':>10}{'p99, us':>10}"
+        f"{'kept, B':>10}{'peak, B':>11}"
+    )
+    for kind, runs, latencies in results:
+        sorted_latencies = sorted(latencies)
+        kept_size, peak_size = allocations[kind]
+        print(
+            f"{kind:<13}{runs:>7}"
+            f"{runs / (sum(latencies) / 1_000_000):>11.0f}"
+            f"{get_percentile(sorted_latencies, 50):>10.1f}"
+            f"{get_percentile(sorted_latencies, 99):>10.1f}"
+            f"{kept_size:>10.0f}{peak_size:>11.0f}"
+        )
+    print()
+
+
+def main() -> None:
+    arguments_parser = argparse.ArgumentParser(
+        description="Benchmark of the command dispatch and parsing"
+    )
+    arguments_parser.add_argument(
+        "--repeat", type=int, default=20,
+        help="how many times every command is run (default 20)"
+    )
+    arguments_parser.add_argument(
+        "--seed", type=int, default=0,
+        help="seed of the generated corpus (default 0)"
+    )
+    arguments_parser.add_argument(
+        "--cache", action="store_true",
+        help="use the cache of the parsed commands in handle_command"
+    )
+    arguments = arguments_parser.parse_args()
+    corpus = make_corpus(arguments.seed)
+    main_logic = make_main_logic(use_parsing_cache=arguments.cache)
+    event_loop = asyncio.new_event_loop()
+
+    def handle_command(text: str) -> None:
+        # Texts from the clients, so employee-only commands are stopped
+        # after the parsing, like the real ones
+        event_loop.run_until_complete(main_logic.handle_command(
+            CLIENT_PEER_ID, text,
+            {"peer_id": CLIENT_PEER_ID, "from_id": CLIENT_PEER_ID}
+        ))
+
+    def convert_command_to_args(text: str) -> None:
+        convert_with_every_candidate(main_logic, text)
+
+    try:
+        for title, run in (
+            (
+                "MainLogic.handle_command" + (
+                    " (with the cache)" if arguments.cache else ""
+                ),
+                handle_command
+            ),
+            ("Command.convert_command_to_args", convert_command_to_args)
+        ):
+            # Allocations are measured first, so the cache (if it is used)
+            # is filled before the timing
+            allocations = measure_allocations(corpus, run)
+            print_results(
+                title, measure(corpus, arguments.repeat, run), allocations
+            )
+    finally:
+        event_loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""
+Benchmark of the queries, which are run on almost every command.
+
+It makes a temporary SQLite database with the real config (only the URL is
+changed), fills it with the generated orders (the closed ones are moved to
+the archive, like in the bot) and the cached users, and runs the listings,
+the lookups by the IDs and the lookups of the users through the real
+managers. Every kind of queries is run with the cache of the queries (like
+in the bot) and without it (the cache is cleared before every run, so the
+queries are built and compiled every time), and p50 and p99 latency is
+printed for both.
+
+Run it from the project's root directory:
+
+    python -m benchmarks.orm_benchmark [--orders N] [--repeat N] [--seed N]
+"""
+import argparse
+import asyncio
+import datetime
+import io
+import os
+import random
+import tempfile
+import time
+from typing import Dict, List, Tuple, Callable, Awaitable, Any
+
+from sqlalchemy.orm import Session
+
+from enums import GrammaticalCases
+from interval_set import IntervalSet
+from orm import db_apis, models, orders_filters
+from orm.db_config import DbConfig, make_db_config_from_files
+from orm.db_executor import DatabaseExecutor
+from orm.enums import OrderStatuses
+from vk.enums import Sex
+
+CLIENTS_AMOUNT = 500
+EMPLOYEES_AMOUNT = 10
+PAGE_SIZE = 20
+
+
+def make_db_config(database_path: str) -> DbConfig:
+    """
+    Reads the real config, but the database is in the given file.
+    """
+    url_file = io.StringIO(f"url = sqlite:///{database_path}\n")
+    with open(
+        "orm/config/db_config.ini", "r", encoding="utf-8"
+    ) as file_with_config:
+        return make_db_config_from_files([file_with_config, url_file])
+
+
+def make_rows(orders_amount: int, seed: int) -> List[Any]:
+    """
+    Returns:
+        orders (most of them are closed long ago, like in the real database)
+        and the cached users (clients and employees) with their names
+    """
+    random_ = random.Random(seed)
+    words = (
+        "сделать", "презентацию", "по", "истории", "на", "слайдов", "реферат",
+        "физике", "и", "срочно", "до", "пятницы", "с", "картинками", "Word"
+    )
+    today = datetime.date.today()
+    rows: List[Any] = []
+    for order_number in range(orders_amount):
+        order = models.Order(
+            creator_vk_id=random_.randint(1, CLIENTS_AMOUNT),
+            text=" ".join(random_.choice(words) for _ in range(10))
+        )
+        # The newest orders are still active
+        if order_number < orders_amount * 0.9:
+            closing_date = today - datetime.timedelta(
+                days=random_.randint(0, 1000)
+            )
+            taker_vk_id = CLIENTS_AMOUNT + random_.randint(1, EMPLOYEES_AMOUNT)
+            order.status = OrderStatuses.TAKEN
+            order.taker_vk_id = taker_vk_id
+            if random_.random() < 0.8:
+                order.status = OrderStatuses.PAID
+                order.earnings = random_.randint(1, 20) * 100
+                order.earning_date = closing_date
+            else:
+                order.status = OrderStatuses.CANCELED
+                order.canceler_vk_id = taker_vk_id
+                order.cancellation_reason = "не успели"
+            order.closing_date = closing_date
+        elif random_.random() < 0.5:
+            order.status = OrderStatuses.TAKEN
+            order.taker_vk_id = (
+                CLIENTS_AMOUNT + random_.randint(1, EMPLOYEES_AMOUNT)
+            )
+        rows.append(order)
+    for vk_id in range(1, CLIENTS_AMOUNT + EMPLOYEES_AMOUNT + 1):
+        rows.append(models.CachedVKUser(
+            vk_id=vk_id, sex=random_.choice((Sex.MALE, Sex.FEMALE)),
+            names=[models.UserNameAndSurname(
+                case=GrammaticalCases.NOMINATIVE,
+                name=f"Имя{vk_id}", surname=f"Фамилия{vk_id}"
+            )]
+        ))
+    return rows
+
+
+async def fill_database(
+        db_executor: DatabaseExecutor,
+        orders_manager: db_apis.OrdersManager, db_config: DbConfig,
+        orders_amount: int, seed: int) -> None:
+    def add_rows(session: Session, rows: List[Any]) -> None:
+        session.add_all(rows)
+
+    await db_executor.write(add_rows, make_rows(orders_amount, seed))
+    archived_orders_amount = await orders_manager.archive_closed_orders(
+        closed_before=(
+            datetime.date.today()
+            - datetime.timedelta(days=db_config.ARCHIVE_ORDERS_AFTER_DAYS)
+        ),
+        batch_size=db_config.ARCHIVING_BATCH_SIZE,
+        vacuum_batch_size=db_config.VACUUM_BATCH_SIZE
+    )
+    print(f"{orders_amount} orders, {archived_orders_amount} are archived")
+    print()
+
+
+def make_queries(
+        managers_container: db_apis.ManagersContainer, orders_amount: int,
+        seed: int) -> Dict[str, Callable[[], Awaitable[Any]]]:
+    """
+    Returns:
+        Dict[kind of the queries, function, which runs the query with the
+        random parameters]
+    """
+    random_ = random.Random(seed)
+    orders_manager = managers_container.orders_manager
+    users_manager = managers_container.users_manager
+
+    def get_random_ranges() -> IntervalSet:
+        starts = random_.sample(range(1, orders_amount, 100), 3)
+        return IntervalSet([(start, start + 10) for start in starts])
+
+    return {
+        "active of client": lambda: orders_manager.get_orders(
+            orders_filters.ACTIVE,
+            orders_filters.created_by(random_.randint(1, CLIENTS_AMOUNT)),
+            limit=PAGE_SIZE + 1
+        ),
+        "next page": lambda: orders_manager.get_orders(
+            limit=PAGE_SIZE + 1,
+            before_id=random_.randint(PAGE_SIZE, orders_amount)
+        ),
+        "paid": lambda: orders_manager.get_orders(
+            orders_filters.PAID, limit=PAGE_SIZE + 1
+        ),
+        "by ID": lambda: orders_manager.get_orders_by_ids(
+            IntervalSet([(random_.randint(1, orders_amount),) * 2])
+        ),
+        "by 3 ranges": lambda: orders_manager.get_orders_by_ids(
+            get_random_ranges()
+        ),
+        "user": lambda: users_manager.get_user_info_by_vk_id(
+            random_.randint(1, CLIENTS_AMOUNT + EMPLOYEES_AMOUNT)
+        ),
+    }
+
+
+def get_percentile(sorted_values: List[float], percentile: float) -> float:
+    index = min(
+        len(sorted_values) - 1, int(len(sorted_values) * percentile / 100)
+    )
+    return sorted_values[index]
+
+
+async def measure(
+        queries: Dict[str, Callable[[], Awaitable[Any]]], repeat: int,
+        with_cache: bool) -> List[Tuple[str, List[float]]]:
+    """
+    Returns:
+        (kind of the queries, latencies in microseconds)
+    """
+    results = []
+    for kind, run_query in queries.items():
+        # The first run fills the cache
+        await run_query()
+        latencies = []
+        for _ in range(repeat):
+            if not with_cache:
+                db_apis.QUERIES_BAKERY.cache.clear()
+            start = time.perf_counter()
+            await run_query()
+            latencies.append((time.perf_counter() - start) * 1_000_000)
+        results.append((kind, latencies))
+    return results
+
+
+def print_results(
+        cached_results: List[Tuple[str, List[float]]],
+        uncached_results: List[Tuple[str, List[float]]]) -> None:
+    print(
+        f"{'kind':<18}{'runs':>7}"
+        f"{'p50, us':>10}{'p99, us':>10}"
+        f"{'p50 uncached':>14}{'p99 uncached':>14}"
+    )
+    for (kind, latencies), (_kind, uncached_latencies) in zip(
+        cached_results, uncached_results
+    ):
+        sorted_latencies = sorted(latencies)
+        sorted_uncached_latencies = sorted(uncached_latencies)
+        print(
+            f"{kind:<18}{len(latencies):>7}"
+            f"{get_percentile(sorted_latencies, 50):>10.1f}"
+            f"{get_percentile(sorted_latencies, 99):>10.1f}"
+            f"{get_percentile(sorted_uncached_latencies, 50):>14.1f}"
+            f"{get_percentile(sorted_uncached_latencies, 99):>14.1f}"
+        )
+    print()
+
+
+async def run_benchmark(
+        database_path: str, orders_amount: int, repeat: int,
+        seed: int) -> None:
+    db_config = make_db_config(database_path)
+    db_executor = db_apis.get_db_executor(db_config)
+    # noinspection PyTypeChecker
+    # because the users are cached, so the VK worker isn't used
+    managers_container = db_apis.ManagersContainer(
+        db_apis.OrdersManager(db_executor),
+        db_apis.CachedVKUsersManager(db_executor, vk_worker=None)
+    )
+    try:
+        await fill_database(
+            db_executor, managers_container.orders_manager, db_config,
+            orders_amount, seed
+        )
+        queries = make_queries(managers_container, orders_amount, seed)
+        cached_results = await measure(queries, repeat, with_cache=True)
+        uncached_results = await measure(queries, repeat, with_cache=False)
+        print_results(cached_results, uncached_results)
+    finally:
+        await db_executor.shutdown()
+
+
+def main() -> None:
+    arguments_parser = argparse.ArgumentParser(
+        description="Benchmark of the queries of the orders and the users"
+    )
+    arguments_parser.add_argument(
+        "--orders", type=int, default=10_000,
+        help="how many orders are generated (default 10000)"
+    )
+    arguments_parser.add_argument(
+        "--repeat", type=int, default=500,
+        help="how many times every query is run (default 500)"
+    )
+    arguments_parser.add_argument(
+        "--seed", type=int, default=0,
+        help="seed of the generated orders and queries (default 0)"
+    )
+    arguments = arguments_parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        asyncio.run(run_benchmark(
+            os.path.join(directory, "benchmark.db"), arguments.orders,
+            arguments.repeat, arguments.seed
+        ))
+
+
+if __name__ == "__main__":
+    main()
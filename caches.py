@@ -0,0 +1,41 @@
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class LRUCache:
+    """
+    Cache with the limited size, which throws away the least recently used
+    values, when there is no space for the new ones. Counts hits and misses, so
+    it can be seen if the cache is useful.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._values: "OrderedDict[Hashable, Any]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        try:
+            value = self._values[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._values.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        self._values[key] = value
+        self._values.move_to_end(key)
+        if len(self._values) > self.max_size:
+            self._values.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        return self._values.pop(key, default)
+
+    def clear(self) -> None:
+        self._values.clear()
@@ -1,19 +1,45 @@
+import datetime
 from dataclasses import dataclass
-from typing import List, Optional
-
-from sqlalchemy import extract
+from typing import List, Optional, Union, Sequence, Tuple
 
+from caches import LRUCache
 from enums import GrammaticalCases
 from handlers.dataclasses import HandlingResult
-from orm import models, db_apis
+from interval_set import IntervalSet
+from orm import models, db_apis, orders_filters
+from orm.orders_filters import OrdersFilter
 from vk.vk_config import VkConfig
-from vk.vk_related_classes import VKUserInfo, Notification
+from vk.enums import ButtonColors
+from vk.vk_related_classes import (
+    VKUserInfo, Notification, Keyboard, CommandButton
+)
 
 
 @dataclass
 class ResultSection:
     beginning: str
-    row_ids: List[int]
+    # IntervalSet is written with ranges ("100-400, 512")
+    row_ids: Union[List[int], IntervalSet]
+
+
+@dataclass
+class OrdersListing:
+    """
+    Listing of the orders, which isn't shown completely, so it can be
+    continued from the last shown order.
+    """
+    filters: Tuple[OrdersFilter, ...]
+    page_size: int
+    include_creator_info: bool
+    with_take_buttons: bool
+    # If it is specified, orders are found by it (see
+    # OrdersManager.search_orders)
+    search_text: Optional[str] = None
+    # ID of the last shown order (orders are listed in descending order)
+    last_order_id: Optional[int] = None
+    # Found orders are sorted by the relevance, not by the ID, so their
+    # listing is continued after the amount of the shown orders
+    shown_orders_amount: int = 0
 
 
 class HandlerHelpers:
@@ -23,6 +49,8 @@ class HandlerHelpers:
             vk_config: VkConfig):
         self.managers_container = managers_container
         self.vk_config = vk_config
+        # Dict[peer ID, listing], which was shown there last
+        self.orders_listings = LRUCache(vk_config.ORDER_LISTINGS_CACHE_SIZE)
 
     @staticmethod
     def get_tag_from_vk_user_dataclass(user_info: VKUserInfo) -> str:
@@ -121,32 +149,126 @@ class HandlerHelpers:
             )
         return Notification(text_for_client="\n\n".join(orders_as_strings))
 
-    def get_monthly_paid_orders_by_month_and_year(
+    @staticmethod
+    def get_take_orders_buttons(
+            order_ids: Sequence[int]) -> List[CommandButton]:
+        """
+        Makes callback buttons, which take the orders (only for the first
+        orders, because the amount of the buttons is limited).
+        """
+        return [
+            CommandButton(
+                f"Взять {order_id}", "взять", (str(order_id),),
+                callback=True, color=ButtonColors.POSITIVE
+            )
+            for order_id in order_ids[:Keyboard.MAX_INLINE_BUTTONS_AMOUNT]
+        ]
+
+    def get_take_orders_keyboard(
+            self, order_ids: Sequence[int]) -> Optional[Keyboard]:
+        """
+        Args:
+            order_ids: IDs of the orders, which can be taken
+
+        Returns:
+            keyboard with get_take_orders_buttons or None, if there are no
+            orders
+        """
+        if not order_ids:
+            return None
+        return Keyboard.from_buttons(self.get_take_orders_buttons(order_ids))
+
+    @staticmethod
+    def get_common_commands_keyboard(for_employees: bool) -> Keyboard:
+        """
+        Makes buttons with the most used commands, so they aren't typed (and
+        parsed) every time.
+        """
+        if for_employees:
+            return Keyboard.from_buttons([
+                CommandButton("В ожидании", "в ожидании"),
+                CommandButton("Взятые", "взятые"),
+                CommandButton("Месячное", "месячное"),
+                CommandButton("Доход", "доход")
+            ])
+        return Keyboard.from_buttons([
+            CommandButton("Активные заказы", "активные"),
+            CommandButton("Все заказы", "заказы"),
+            CommandButton("Памятка", "памятка"),
+            CommandButton("Команды", "команды")
+        ])
+
+    @staticmethod
+    def get_month_dates(
+            year: int, month: int) -> Tuple[datetime.date, datetime.date]:
+        """
+        Returns:
+            first day of the month and first day of the next month (so the
+            dates of the month are the dates from the first one and less than
+            the second one)
+        """
+        if month == 12:
+            return datetime.date(year, 12, 1), datetime.date(year + 1, 1, 1)
+        return (
+            datetime.date(year, month, 1), datetime.date(year, month + 1, 1)
+        )
+
+    async def get_monthly_paid_orders_by_month_and_year(
             self, month: int, year: int) -> List[models.Order]:
-        return self.managers_container.orders_manager.get_orders(
-            extract("month", models.Order.earning_date) == month,
-            extract("year", models.Order.earning_date) == year,
-            models.Order.is_paid
+        month_start, next_month_start = self.get_month_dates(year, month)
+        # Only paid orders have the earning date. The range is compared with
+        # the column itself (not with the month and the year extracted from
+        # it), so the index of the earning dates is used
+        return await self.managers_container.orders_manager.get_orders(
+            orders_filters.earned_between(month_start, next_month_start)
         )
 
     async def request_orders_as_notification(
             self, client_vk_id: int, current_chat_peer_id: int,
-            filters: tuple, no_orders_found_client_error: str,
+            filters: Tuple[OrdersFilter, ...],
+            no_orders_found_client_error: str,
             no_orders_found_employees_error: str,
-            limit: Optional[int] = None) -> HandlingResult:
+            limit: Optional[int] = None,
+            with_take_buttons: bool = False,
+            search_text: Optional[str] = None) -> HandlingResult:
+        """
+        Shows the first page of the orders. If there are more orders, the
+        listing is remembered for the peer, so the next page is shown by
+        request_next_orders_page.
+
+        Args:
+            limit:
+                size of the pages (if it isn't specified, pages have the
+                default size and the limit isn't written in the header)
+            search_text:
+                if it is specified, only orders, which are found by it, are
+                shown (from the most relevant ones)
+        """
         request_is_from_employee = (
             current_chat_peer_id == self.vk_config.EMPLOYEES_CHAT_PEER_ID
         )
         filters = (
             filters
             if request_is_from_employee else
-            (*filters, models.Order.creator_vk_id == client_vk_id)
+            (*filters, orders_filters.created_by(client_vk_id))
         )  # Old filters isn't needed anymore
-        orders = self.managers_container.orders_manager.get_orders(
-            *filters,
-            limit=limit
+        listing = OrdersListing(
+            filters,
+            page_size=(
+                self.vk_config.DEFAULT_BIG_ORDER_SEQUENCES_LIMIT
+                if limit is None else
+                limit
+            ),
+            # If client requested the orders - creator info isn't needed,
+            # because client is the creator
+            include_creator_info=request_is_from_employee,
+            with_take_buttons=with_take_buttons and request_is_from_employee,
+            search_text=search_text
         )
-        if not orders:
+        notification_with_orders = await self._get_next_orders_page(
+            current_chat_peer_id, listing, limit_for_header=limit
+        )
+        if notification_with_orders is None:
             return HandlingResult(
                 Notification(
                     # Here text_for_client will be sent to employees if orders
@@ -159,21 +281,95 @@ class HandlerHelpers:
                 ),
                 commit_needed=False
             )
+        return HandlingResult(notification_with_orders, commit_needed=True)
+
+    async def request_next_orders_page(
+            self, current_chat_peer_id: int) -> HandlingResult:
+        listing: Optional[OrdersListing] = (
+            self.orders_listings.get(current_chat_peer_id)
+        )
         notification_with_orders = (
-            await self.get_notification_with_orders(
-                orders,
-                # If client requested the orders - creator info isn't needed,
-                # because client is the creator
-                include_creator_info=request_is_from_employee,
-                limit_for_header=limit
-            )
+            None
+            if listing is None else
+            await self._get_next_orders_page(current_chat_peer_id, listing)
         )
+        if notification_with_orders is None:
+            return HandlingResult(
+                Notification(
+                    text_for_client=(
+                        "Больше нечего показывать! Сначала запроси заказы "
+                        "(например, /все заказы)."
+                    )
+                ),
+                commit_needed=False
+            )
         return HandlingResult(notification_with_orders, commit_needed=True)
 
+    async def _get_next_orders_page(
+            self, current_chat_peer_id: int, listing: OrdersListing,
+            limit_for_header: Optional[int] = None
+            ) -> Optional[Notification]:
+        """
+        Finds the orders after the last shown order of the listing (one order
+        more than the page size, so it is known, if there are more orders)
+        and remembers (or forgets) the listing for the peer.
+
+        Returns:
+            notification with the orders or None, if there are no more orders
+        """
+        orders_manager = self.managers_container.orders_manager
+        if listing.search_text is None:
+            orders = await orders_manager.get_orders(
+                *listing.filters,
+                limit=listing.page_size + 1,
+                before_id=listing.last_order_id
+            )
+        else:
+            orders = await orders_manager.search_orders(
+                listing.search_text, *listing.filters,
+                limit=listing.page_size + 1,
+                offset=listing.shown_orders_amount
+            )
+        has_next_page = len(orders) > listing.page_size
+        orders = orders[:listing.page_size]
+        if has_next_page:
+            listing.last_order_id = orders[-1].id
+            listing.shown_orders_amount += len(orders)
+            self.orders_listings.put(current_chat_peer_id, listing)
+        else:
+            self.orders_listings.pop(current_chat_peer_id)
+        if not orders:
+            return None
+        notification_with_orders = await self.get_notification_with_orders(
+            orders, include_creator_info=listing.include_creator_info,
+            limit_for_header=limit_for_header
+        )
+        buttons = (
+            self.get_take_orders_buttons([order.id for order in orders])
+            if listing.with_take_buttons else
+            []
+        )
+        if has_next_page:
+            notification_with_orders.text_for_client += (
+                "\n\nЭто не все заказы, следующие - по команде /дальше."
+            )
+            buttons = buttons[:Keyboard.MAX_INLINE_BUTTONS_AMOUNT - 1]
+            buttons.append(
+                CommandButton("Дальше", "дальше", color=ButtonColors.PRIMARY)
+            )
+        if buttons:
+            # Text for employees is in the text_for_client here too
+            notification_with_orders.keyboard_for_client = (
+                Keyboard.from_buttons(buttons)
+            )
+        return notification_with_orders
+
     @staticmethod
     def get_order_manipulation_results_as_list(
             *sections: ResultSection) -> List[str]:
         return [
+            f"{section.beginning}: {section.row_ids}"
+            if isinstance(section.row_ids, IntervalSet) else
             f"{section.beginning}: {', '.join(map(str, section.row_ids))}"
             for section in sections
             if section.row_ids
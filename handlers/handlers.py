@@ -1,15 +1,17 @@
 import datetime
-from typing import Tuple, List, Dict, Callable
+from typing import Tuple, List, Dict
 
 import simple_avk
-from sqlalchemy import not_
 
+import lexer.lexer_classes
 import orm.exceptions
+import orm.slow_statements
 from enums import GrammaticalCases
 from handlers.dataclasses import HandlingResult
 from handlers.handler_helpers import HandlerHelpers, ResultSection
+from interval_set import IntervalSet
 from orm import db_apis
-from orm import models
+from orm import models, orders_filters
 from vk.enums import Sex
 from vk.vk_config import VkConfig
 from vk.vk_related_classes import Notification, UserCallbackMessages, Message
@@ -32,13 +34,15 @@ class Handlers:
             self, current_chat_peer_id: int,
             client_vk_id: int, text: str) -> HandlingResult:
         order = models.Order(creator_vk_id=client_vk_id, text=text)
-        self.managers_container.orders_manager.add(order)
-        self.managers_container.orders_manager.flush()
         if current_chat_peer_id != self.vk_config.EMPLOYEES_CHAT_PEER_ID:
+            # The user is got before the first write, because the commands
+            # can't write, while this one waits for VK
             client_info = (await (
                 self.managers_container.users_manager
                 .get_user_info_by_vk_id(client_vk_id)
             ))  # This looks ugly and not pythonic :(
+            # The order gets its ID here
+            await self.managers_container.orders_manager.add(order)
             made_word = "сделал" if client_info.sex is Sex.MALE else "сделала"
             client_tag = self.helpers.get_tag_from_vk_user_dataclass(
                 client_info
@@ -49,31 +53,65 @@ class Handlers:
                     text_for_employees=(
                         f"Клиент {client_tag} {made_word} заказ с ID "
                         f"{order.id}: \"{order.text}\"."
+                    ),
+                    keyboard_for_employees=(
+                        self.helpers.get_take_orders_keyboard([order.id])
                     )
                 ), commit_needed=True
             )
+        await self.managers_container.orders_manager.add(order)
         return HandlingResult(
-            Notification(text_for_employees=f"Заказ с ID {order.id} создан!"),
+            Notification(
+                text_for_employees=f"Заказ с ID {order.id} создан!",
+                keyboard_for_employees=(
+                    self.helpers.get_take_orders_keyboard([order.id])
+                )
+            ),
             commit_needed=True
         )
 
     async def cancel_orders(
             self, client_vk_id: int, current_chat_peer_id: int,
-            order_ids: Tuple[int],
+            order_ids: IntervalSet,
             cancellation_reason: str) -> HandlingResult:
         employees_callback: List[str] = []
         client_callback_messages = UserCallbackMessages()
-        found_orders = (
-            self.managers_container.orders_manager.get_orders_by_ids(order_ids)
+        request_is_from_client = (
+            current_chat_peer_id != self.vk_config.EMPLOYEES_CHAT_PEER_ID
+        )
+        # The user is got before the first write, because the commands can't
+        # write, while this one waits for VK
+        sender_info = (
+            await self.managers_container.users_manager.get_user_info_by_vk_id(
+                client_vk_id
+            )
+        )
+        canceled_orders = await (
+            self.managers_container.orders_manager.cancel_orders(
+                order_ids, client_vk_id, cancellation_reason,
+                only_own_orders=request_is_from_client
+            )
+        )
+        canceled_order_ids = []
+        for order in canceled_orders:
+            canceled_order_ids.append(order.id)
+            callback_str = f"ID {order.id} (\"{order.text}\")"
+            if request_is_from_client:
+                employees_callback.append(callback_str)
+            else:
+                client_callback_messages.add_message(
+                    order.creator_vk_id, callback_str
+                )
+        # Orders, which weren't canceled, are found to tell, why they weren't
+        found_orders = await (
+            self.managers_container.orders_manager.get_orders_by_ids(
+                order_ids.difference(canceled_order_ids)
+            )
         )
         not_owned_by_user_order_ids = []
         paid_order_ids = []
         already_canceled_order_ids = []
         taken_by_other_employee_order_ids = []
-        canceled_order_ids = []
-        request_is_from_client = (
-            current_chat_peer_id != self.vk_config.EMPLOYEES_CHAT_PEER_ID
-        )
         for order in found_orders.successful_rows:
             if request_is_from_client and order.creator_vk_id != client_vk_id:
                 not_owned_by_user_order_ids.append(order.id)
@@ -81,22 +119,8 @@ class Handlers:
                 paid_order_ids.append(order.id)
             elif order.is_canceled:
                 already_canceled_order_ids.append(order.id)
-            elif (
-                order.is_taken and order.taker_vk_id != client_vk_id
-                and order.creator_vk_id != client_vk_id
-            ):
-                taken_by_other_employee_order_ids.append(order.id)
             else:
-                order.canceler_vk_id = client_vk_id
-                order.cancellation_reason = cancellation_reason
-                canceled_order_ids.append(order.id)
-                callback_str = f"ID {order.id} (\"{order.text}\")"
-                if request_is_from_client:
-                    employees_callback.append(callback_str)
-                else:
-                    client_callback_messages.add_message(
-                        order.creator_vk_id, callback_str
-                    )
+                taken_by_other_employee_order_ids.append(order.id)
         user_output = self.helpers.get_order_manipulation_results_as_list(
             ResultSection(
                 "ID заказов, которых просто нет", found_orders.failed_ids
@@ -123,11 +147,6 @@ class Handlers:
                 "ID успешно отмененных заказов", canceled_order_ids
             )
         )
-        sender_info = (
-            await self.managers_container.users_manager.get_user_info_by_vk_id(
-                client_vk_id
-            )
-        )
         canceled_word = "отменил" if sender_info.sex is Sex.MALE else "отменила"
         canceler_tag = self.helpers.get_tag_from_vk_user_dataclass(sender_info)
         additional_messages = (
@@ -170,39 +189,64 @@ class Handlers:
             current_chat_peer_id: int) -> HandlingResult:
         return await self.helpers.request_orders_as_notification(
             client_vk_id, current_chat_peer_id,
-            filters=(
-                not_(models.Order.is_canceled), not_(models.Order.is_paid),
-                models.Order.is_taken
-            ),
+            filters=(orders_filters.TAKEN,),
             no_orders_found_client_error="Среди твоих заказов нет взятых!",
             no_orders_found_employees_error="Взятых заказов еще нет!"
         )
 
+    async def search_orders(
+            self, client_vk_id: int, current_chat_peer_id: int,
+            search_text: str) -> HandlingResult:
+        return await self.helpers.request_orders_as_notification(
+            client_vk_id, current_chat_peer_id,
+            filters=(),
+            no_orders_found_client_error=(
+                "Среди твоих заказов ничего не найдено!"
+            ),
+            no_orders_found_employees_error="Ничего не найдено!",
+            search_text=search_text
+        )
+
+    async def get_next_orders_page(
+            self, current_chat_peer_id: int) -> HandlingResult:
+        return await self.helpers.request_next_orders_page(
+            current_chat_peer_id
+        )
+
     async def get_pending_orders(
             self, client_vk_id: int,
             current_chat_peer_id: int) -> HandlingResult:
         return await self.helpers.request_orders_as_notification(
             client_vk_id, current_chat_peer_id,
-            filters=(
-                not_(models.Order.is_taken), not_(models.Order.is_canceled)
-            ),
+            filters=(orders_filters.PENDING,),
             no_orders_found_client_error="Среди твоих заказов нет ожидающих!",
             no_orders_found_employees_error=(
                 "Заказов в ожидании еще нет! "
                 "(Но можно подождать новых клиентов ( ͡° ͜ʖ ͡°))"
-            )                       # Should be the Lenny ^
+            ),                      # Should be the Lenny ^
+            with_take_buttons=True
         )
 
     async def get_help_message(
             self, current_chat_peer_id: int,
             full_commands_help_message: str,
             commands_only_for_clients_message: str) -> HandlingResult:
+        request_is_from_employee = (
+            current_chat_peer_id == self.vk_config.EMPLOYEES_CHAT_PEER_ID
+        )
         return HandlingResult(
-            Notification(text_for_client=(
-                full_commands_help_message
-                if current_chat_peer_id == self.vk_config.EMPLOYEES_CHAT_PEER_ID
-                else commands_only_for_clients_message
-            )), commit_needed=False
+            Notification(
+                text_for_client=(
+                    full_commands_help_message
+                    if request_is_from_employee else
+                    commands_only_for_clients_message
+                ),
+                keyboard_for_client=(
+                    self.helpers.get_common_commands_keyboard(
+                        for_employees=request_is_from_employee
+                    )
+                )
+            ), commit_needed=False
         )
 
     async def get_canceled_orders(
@@ -211,7 +255,7 @@ class Handlers:
             limit: int) -> HandlingResult:
         return await self.helpers.request_orders_as_notification(
             client_vk_id, current_chat_peer_id,
-            filters=(models.Order.is_canceled,),
+            filters=(orders_filters.CANCELED,),
             no_orders_found_client_error="Среди твоих заказов нет отмененных!",
             no_orders_found_employees_error="Отмененных заказов еще нет!",
             limit=limit
@@ -223,7 +267,7 @@ class Handlers:
             limit: int) -> HandlingResult:
         return await self.helpers.request_orders_as_notification(
             client_vk_id, current_chat_peer_id,
-            filters=(models.Order.is_paid,),
+            filters=(orders_filters.PAID,),
             no_orders_found_client_error="Среди твоих заказов нет отмененных!",
             no_orders_found_employees_error=(
                 "Оплаченных заказов еще нет! (Грустно!)"
@@ -232,17 +276,40 @@ class Handlers:
         )
 
     async def mark_orders_as_paid(
-            self, employee_vk_id: int, order_ids: Tuple[int],
+            self, employee_vk_id: int, order_ids: IntervalSet,
             earnings_amount: int) -> HandlingResult:
         client_callback_messages = UserCallbackMessages()
-        found_orders = (
-            self.managers_container.orders_manager.get_orders_by_ids(order_ids)
+        earning_date = datetime.date.today()
+        # The user is got before the first write, because the commands can't
+        # write, while this one waits for VK
+        employee_info = await (
+            self.managers_container.users_manager.get_user_info_by_vk_id(
+                employee_vk_id
+            )
+        )
+        paid_orders = await (
+            self.managers_container.orders_manager.mark_orders_as_paid(
+                order_ids, employee_vk_id, earnings_amount, earning_date
+            )
+        )
+        marked_as_paid_order_ids = []
+        for order in paid_orders:
+            marked_as_paid_order_ids.append(order.id)
+            client_callback_messages.add_message(
+                order.creator_vk_id,
+                f"ID {order.id} (\"{order.text}\")"
+            )
+        # Orders, which weren't marked as paid, are found to tell, why they
+        # weren't
+        found_orders = await (
+            self.managers_container.orders_manager.get_orders_by_ids(
+                order_ids.difference(marked_as_paid_order_ids)
+            )
         )
         already_paid_order_ids = []
         canceled_order_ids = []
         not_taken_order_ids = []
         taken_by_other_employee_order_ids = []
-        marked_as_paid_order_ids = []
         for order in found_orders.successful_rows:
             if order.is_paid:
                 already_paid_order_ids.append(order.id)
@@ -250,23 +317,17 @@ class Handlers:
                 canceled_order_ids.append(order.id)
             elif not order.is_taken:
                 not_taken_order_ids.append(order.id)
-            elif order.taker_vk_id != employee_vk_id:
-                taken_by_other_employee_order_ids.append(order.id)
             else:
-                order.earnings = earnings_amount
-                order.earning_date = datetime.date.today()
-                marked_as_paid_order_ids.append(order.id)
-                client_callback_messages.add_message(
-                    order.creator_vk_id,
-                    f"ID {order.id} (\"{order.text}\")"
-                )
+                taken_by_other_employee_order_ids.append(order.id)
+        if marked_as_paid_order_ids:
+            # Paid orders can't be canceled, so the earnings are only added
+            await self.managers_container.orders_manager.add_monthly_earnings(
+                employee_vk_id, earning_date,
+                earnings_amount * len(marked_as_paid_order_ids),
+                len(marked_as_paid_order_ids)
+            )
         additional_messages = ()
         if client_callback_messages.messages:
-            employee_info = await (
-                self.managers_container.users_manager.get_user_info_by_vk_id(
-                    employee_vk_id
-                )
-            )
             employee_tag = (
                 self.helpers.get_tag_from_vk_user_dataclass(employee_info)
             )
@@ -322,7 +383,7 @@ class Handlers:
 
     async def get_monthly_paid_orders(
             self, year: int, month: int) -> HandlingResult:
-        orders = self.helpers.get_monthly_paid_orders_by_month_and_year(
+        orders = await self.helpers.get_monthly_paid_orders_by_month_and_year(
             month, year
         )
         if orders:
@@ -340,34 +401,43 @@ class Handlers:
         )
 
     async def take_orders(
-            self, user_vk_id: int, order_ids: Tuple[int]) -> HandlingResult:
+            self, user_vk_id: int, order_ids: IntervalSet) -> HandlingResult:
         # Allowed only for employees
         client_callback_messages = UserCallbackMessages()
-        found_orders = (
-            self.managers_container.orders_manager.get_orders_by_ids(order_ids)
+        # The user is got before the first write, because the commands can't
+        # write, while this one waits for VK
+        employee_info = await (
+            self.managers_container.users_manager.get_user_info_by_vk_id(
+                user_vk_id
+            )
+        )
+        taken_orders = await (
+            self.managers_container.orders_manager.take_orders(
+                order_ids, user_vk_id
+            )
+        )
+        taken_order_ids = []
+        for order in taken_orders:
+            taken_order_ids.append(order.id)
+            client_callback_messages.add_message(
+                order.creator_vk_id,
+                f"ID {order.id} (\"{order.text}\")"
+            )
+        # Orders, which weren't taken, are found to tell, why they weren't
+        found_orders = await (
+            self.managers_container.orders_manager.get_orders_by_ids(
+                order_ids.difference(taken_order_ids)
+            )
         )
         already_taken_order_ids = []
         canceled_order_ids = []
-        taken_order_ids = []
         for order in found_orders.successful_rows:
             if order.is_taken:
                 already_taken_order_ids.append(order.id)
-            elif order.is_canceled:
+            else:  # Only taken and canceled orders aren't pending
                 canceled_order_ids.append(order.id)
-            else:
-                order.taker_vk_id = user_vk_id
-                taken_order_ids.append(order.id)
-                client_callback_messages.add_message(
-                    order.creator_vk_id,
-                    f"ID {order.id} (\"{order.text}\")"
-                )
         additional_messages = ()
         if client_callback_messages.messages:
-            employee_info = await (
-                self.managers_container.users_manager.get_user_info_by_vk_id(
-                    user_vk_id
-                )
-            )
             employee_tag = (
                 self.helpers.get_tag_from_vk_user_dataclass(employee_info)
             )
@@ -408,26 +478,28 @@ class Handlers:
             current_chat_peer_id: int) -> HandlingResult:
         return await self.helpers.request_orders_as_notification(
             client_vk_id, current_chat_peer_id,
-            filters=(
-                not_(models.Order.is_paid), not_(models.Order.is_canceled)
-            ),
+            filters=(orders_filters.ACTIVE,),
             no_orders_found_client_error="Среди твоих заказов нет активных!",
             no_orders_found_employees_error="Активных заказов еще нет!"
         )
 
     async def get_help_message_for_specific_commands(
-            self, command_descriptions: Dict[str, List[Callable[..., str]]],
+            self,
+            # lexer.lexer_classes imports handlers, so the class isn't there
+            # yet, when this module is imported
+            command_descriptions: Dict[
+                str, List["lexer.lexer_classes.CommandDescriptions"]
+            ],
             command_names: Tuple[str, ...]) -> HandlingResult:
         command_descriptions_as_strings = []
         quoted_not_found_commands: List[str] = []
         for command_name in command_names:
             try:
                 command_descriptions_as_strings.extend(
-                    # Here desc_func is a Command.get_full_description,
-                    # if I set Command.get_full_description as a type -
-                    # I wouldn't get any IDE hints anyway
-                    desc_func()
-                    for desc_func in command_descriptions[command_name]
+                    descriptions.compact
+                    for descriptions in command_descriptions[
+                        command_name.casefold()
+                    ]
                 )
             except KeyError:
                 quoted_not_found_commands.append(f"\"{command_name}\"")
@@ -450,13 +522,15 @@ class Handlers:
 
     async def get_order_by_id(
             self, client_vk_id: int, current_chat_peer_id: int,
-            order_ids: Tuple[int, ...]) -> HandlingResult:
-        found_orders = (
+            order_ids: IntervalSet) -> HandlingResult:
+        found_orders = await (
             self.managers_container.orders_manager.get_orders_by_ids(order_ids)
         )
         output: List[str] = [
-            f"Заказ с ID {failed_id} не найден!"
-            for failed_id in found_orders.failed_ids
+            f"Заказ с ID {start} не найден!"
+            if start == end else
+            f"Заказы с ID от {start} до {end} не найдены!"
+            for start, end in found_orders.failed_ids.intervals
         ]
         request_is_from_client = (
             current_chat_peer_id != self.vk_config.EMPLOYEES_CHAT_PEER_ID
@@ -482,23 +556,17 @@ class Handlers:
     async def get_monthly_earnings(
             self, year: int, month: int) -> HandlingResult:
         # Allowed only for employees
-        orders = self.helpers.get_monthly_paid_orders_by_month_and_year(
-            month, year
+        earnings_report = await (
+            self.managers_container.orders_manager.get_earnings_report(
+                *self.helpers.get_month_dates(year, month)
+            )
         )
-        if orders:
-            earnings: Dict[int, int] = {}
-            total_earnings = 0
-            for order in orders:
-                total_earnings += order.earnings
-                try:
-                    earnings[order.taker_vk_id] += order.earnings
-                except KeyError:
-                    earnings[order.taker_vk_id] = order.earnings
+        if earnings_report.users_earnings:
             earnings_as_strings: List[str] = []
-            for employee_vk_id, taker_earnings in earnings.items():
+            for employee_earnings in earnings_report.users_earnings:
                 employee_info = await (
                     self.managers_container.users_manager
-                    .get_user_info_by_vk_id(employee_vk_id)
+                    .get_user_info_by_vk_id(employee_earnings.vk_id)
                 )
                 earned_word = (
                     "заработал"
@@ -509,13 +577,15 @@ class Handlers:
                     employee_info
                 )
                 earnings_as_strings.append(
-                    f"{employee_tag} {earned_word} {taker_earnings} руб."
+                    f"{employee_tag} {earned_word} "
+                    f"{employee_earnings.earnings} руб."
                 )
             return HandlingResult(
                 Notification(
                     text_for_employees="\n".join(
                         (
-                            f"Общий доход: {total_earnings} руб.",
+                            f"Общий доход: {earnings_report.total_earnings} "
+                            f"руб.",
                             *earnings_as_strings
                         )
                     )
@@ -548,16 +618,8 @@ class Handlers:
             )
         else:
             client_vk_id = client_info.id
-            order = models.Order(
-                creator_vk_id=client_vk_id,
-                real_creator_vk_id=employee_vk_id,
-                text=text
-            )
-            self.managers_container.orders_manager.add(order)
-            self.managers_container.orders_manager.flush()
-            full_client_tag = self.helpers.get_tag_from_vk_user_dataclass(
-                client_info
-            )
+            # The user is got before the first write, because the commands
+            # can't write, while this one waits for VK
             employee_tag = self.helpers.get_tag_from_vk_user_dataclass(
                 await (
                     self.managers_container.users_manager
@@ -566,6 +628,15 @@ class Handlers:
                     )
                 )
             )
+            order = models.Order(
+                creator_vk_id=client_vk_id,
+                real_creator_vk_id=employee_vk_id,
+                text=text
+            )
+            await self.managers_container.orders_manager.add(order)
+            full_client_tag = self.helpers.get_tag_from_vk_user_dataclass(
+                client_info
+            )
             return HandlingResult(
                 Notification(
                     text_for_employees=(
@@ -591,7 +662,7 @@ class Handlers:
             await self.vk_worker.get_user_info(user_vk_id)
         )
         try:
-            self.managers_container.users_manager.delete_user_info(
+            await self.managers_container.users_manager.delete_user_info(
                 models.CachedVKUser.vk_id == user_vk_id
             )
         except orm.exceptions.NoRowsFound:
@@ -614,6 +685,39 @@ class Handlers:
             ), commit_needed=True
         )
 
+    async def get_slowest_statements(self) -> HandlingResult:
+        # Allowed only for employees
+        statements = self.managers_container.get_slowest_statements()
+        if not statements:
+            return HandlingResult(
+                Notification(
+                    text_for_employees="Запросов к базе данных еще не было!"
+                ), commit_needed=False
+            )
+        statements_as_strings: List[str] = []
+        for number, statement in enumerate(statements, start=1):
+            command_text = (
+                "не из команды"
+                if statement.slowest_command is None else
+                f"команда \"{statement.slowest_command}\""
+            )
+            statements_as_strings.append(
+                f"{number}. {statement.max_duration * 1000:.1f} мс "
+                f"({command_text}; в среднем "
+                f"{statement.average_duration * 1000:.1f} мс за "
+                f"{statement.runs_amount} раз):\n"
+                # Ten statements should fit into one message
+                + orm.slow_statements.shorten_shape(statement.shape, 250)
+            )
+        return HandlingResult(
+            Notification(
+                text_for_employees=(
+                    "Самые медленные запросы:\n\n"
+                    + "\n\n".join(statements_as_strings)
+                )
+            ), commit_needed=False
+        )
+
     async def get_memo(self) -> HandlingResult:
         return HandlingResult(
             Notification(
@@ -0,0 +1,93 @@
+from bisect import bisect_right
+from typing import Iterable, Iterator, List, Tuple
+
+
+class IntervalSet:
+    """
+    Set of integers, which is stored as sorted closed intervals, that don't
+    overlap and don't touch each other. It is needed for the order IDs, which
+    are often written as ranges ("100-400, 512"), so the range of a million IDs
+    takes as much memory as the range of two IDs.
+    """
+
+    def __init__(self, intervals: Iterable[Tuple[int, int]] = ()):
+        """
+        Args:
+            intervals:
+                (start, end) pairs in any order, where the end is included and
+                isn't less than the start; they can overlap and repeat
+        """
+        merged_intervals: List[Tuple[int, int]] = []
+        for start, end in sorted(intervals):
+            if merged_intervals and start <= merged_intervals[-1][1] + 1:
+                if end > merged_intervals[-1][1]:
+                    merged_intervals[-1] = (merged_intervals[-1][0], end)
+            else:
+                merged_intervals.append((start, end))
+        self.intervals: Tuple[Tuple[int, int], ...] = tuple(merged_intervals)
+        self._starts = tuple(start for start, _end in self.intervals)
+
+    @classmethod
+    def from_values(cls, values: Iterable[int]) -> "IntervalSet":
+        return cls((value, value) for value in values)
+
+    def __contains__(self, value: int) -> bool:
+        index = bisect_right(self._starts, value) - 1
+        return index != -1 and value <= self.intervals[index][1]
+
+    def __iter__(self) -> Iterator[int]:
+        for start, end in self.intervals:
+            yield from range(start, end + 1)
+
+    def __len__(self) -> int:
+        return sum(end - start + 1 for start, end in self.intervals)
+
+    def __bool__(self) -> bool:
+        return bool(self.intervals)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, IntervalSet):
+            return self.intervals == other.intervals
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self.intervals)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({list(self.intervals)!r})"
+
+    def __str__(self) -> str:
+        """
+        Returns the intervals like "100-400, 512" (like they are written in the
+        commands).
+        """
+        return ", ".join(
+            str(start) if start == end else f"{start}-{end}"
+            for start, end in self.intervals
+        )
+
+    def difference(self, values: Iterable[int]) -> "IntervalSet":
+        """
+        Removes the values from the intervals without going through every
+        integer of the intervals.
+
+        Args:
+            values: integers to remove (they can be outside of the intervals)
+
+        Returns:
+            new IntervalSet without the values
+        """
+        values = sorted(set(values))
+        intervals: List[Tuple[int, int]] = []
+        value_index = 0
+        for start, end in self.intervals:
+            while value_index < len(values) and values[value_index] < start:
+                value_index += 1
+            while value_index < len(values) and values[value_index] <= end:
+                if values[value_index] > start:
+                    intervals.append((start, values[value_index] - 1))
+                start = values[value_index] + 1
+                value_index += 1
+            if start <= end:
+                intervals.append((start, end))
+        return IntervalSet(intervals)
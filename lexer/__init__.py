@@ -1 +1,4 @@
-from . import lexer_classes, lexer_implementations, exceptions, generators
+from . import (
+    lexer_classes, lexer_implementations, exceptions, generators, indexes,
+    matching
+)
@@ -37,8 +37,9 @@ class CommandsGenerator:
                 (last argument is changing in each returned command)
 
         Returns:
-            three Commands. First with default limit, second without limit and
-            third with the specified limit.
+            three Commands. First with default limit, second without limit
+            (it shows the orders by pages) and third with the specified
+            limit.
         """
         metadata = (VKSenderIDGetter, VKPeerIDGetter)
         return (
@@ -62,8 +63,10 @@ class CommandsGenerator:
                 ),
                 handler=handler,
                 description=(
-                    f"показывает все {orders_name} (если спрашивает "
-                    f"клиент - только заказы этого же клиента)"
+                    f"показывает все {orders_name} (по "
+                    f"{self.vk_config.DEFAULT_BIG_ORDER_SEQUENCES_LIMIT} "
+                    f"заказов, следующие - по команде /дальше; если "
+                    f"спрашивает клиент - только заказы этого же клиента)"
                 ),
                 metadata=metadata,
                 fillers=(None,)  # limit=
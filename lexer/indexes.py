@@ -0,0 +1,216 @@
+from typing import Dict, List, Sequence, Tuple, Iterable, Set, Optional
+
+from lexer.lexer_classes import Command
+
+
+class CommandsIndex:
+    """
+    Index over the names of the commands. It is needed to find the commands,
+    which can be written in some text, without parsing the text with every
+    command.
+    """
+
+    def __init__(self, commands: Sequence[Command]):
+        self.commands = tuple(commands)
+        # Dict[case-folded name, indexes of the commands with this name]
+        self._command_indexes_by_name: Dict[str, List[int]] = {}
+        for command_index, command in enumerate(self.commands):
+            for name in command.names:
+                folded_name = name.casefold()
+                try:
+                    self._command_indexes_by_name[folded_name].append(
+                        command_index
+                    )
+                except KeyError:
+                    self._command_indexes_by_name[folded_name] = [
+                        command_index
+                    ]
+        # Command name is matched with the beginning of the text symbol by
+        # symbol, so only prefixes of the text with these lengths can be names
+        self._names_lengths: Tuple[int, ...] = tuple(sorted({
+            len(name) for command in self.commands for name in command.names
+        }))
+
+    def get_candidates(self, text: str) -> List[Command]:
+        """
+        Finds commands, which have a name, that is written at the beginning of
+        the text (case is ignored).
+
+        Args:
+            text: user input (like "command arg1 arg2")
+
+        Returns:
+            found commands in the same order as they were given to the index
+            (so the priority of the overloaded commands stays the same)
+        """
+        command_indexes = set()
+        for name_length in self._names_lengths:
+            if name_length > len(text):
+                break
+            command_indexes.update(
+                self._command_indexes_by_name.get(
+                    text[:name_length].casefold(), ()
+                )
+            )
+        return [
+            self.commands[command_index]
+            for command_index in sorted(command_indexes)
+        ]
+
+
+def get_edit_distance(
+        first: str, second: str, max_distance: Optional[int] = None) -> int:
+    """
+    Counts the minimal amount of inserted, deleted and replaced symbols, which
+    is needed to make the second string from the first one (Levenshtein
+    distance).
+
+    Args:
+        first: first string
+        second: second string
+        max_distance:
+            if the distance is greater, counting is stopped and
+            max_distance + 1 is returned (None means no limit)
+
+    Returns:
+        distance or max_distance + 1, if the distance is greater
+    """
+    if max_distance is None:
+        max_distance = max(len(first), len(second))
+    too_far = max_distance + 1
+    if abs(len(first) - len(second)) > max_distance:
+        return too_far
+    # Only the cells, which are not further than max_distance from the
+    # diagonal, can have the distance not greater than max_distance, so the
+    # other cells are too_far
+    previous_row = [
+        index if index <= max_distance else too_far
+        for index in range(len(second) + 1)
+    ]
+    for first_index, first_symbol in enumerate(first, start=1):
+        current_row = [too_far] * (len(second) + 1)
+        if first_index <= max_distance:
+            current_row[0] = first_index
+        lowest_index = max(1, first_index - max_distance)
+        highest_index = min(len(second), first_index + max_distance)
+        for second_index in range(lowest_index, highest_index + 1):
+            # Replacement, deletion and insertion (without min(), because it
+            # is the hottest loop here)
+            distance = previous_row[second_index - 1] + (
+                first_symbol != second[second_index - 1]
+            )
+            if previous_row[second_index] < distance:
+                distance = previous_row[second_index] + 1
+            if current_row[second_index - 1] < distance:
+                distance = current_row[second_index - 1] + 1
+            current_row[second_index] = distance
+        if min(current_row) > max_distance:
+            return too_far
+        previous_row = current_row
+    return min(previous_row[-1], too_far)
+
+
+def _get_deletions(string: str, max_deletions: int) -> Set[str]:
+    """
+    Returns all strings, which can be made from the string by deleting up to
+    max_deletions symbols (including the string itself).
+    """
+    deletions = {string}
+    current_deletions = {string}
+    for _ in range(max_deletions):
+        current_deletions = {
+            deletion[:index] + deletion[index + 1:]
+            for deletion in current_deletions
+            for index in range(len(deletion))
+        }
+        deletions.update(current_deletions)
+    return deletions
+
+
+class NamesIndex:
+    """
+    Index for finding the names, which are similar to the beginning of some
+    text (for "did you mean" suggestions).
+
+    For every name all strings, which are made by deleting up to max_distance
+    symbols from it, are stored, because if two strings differ by N edits,
+    both of them become the same string after deleting up to N symbols from
+    each one. So a typo is found by deleting symbols from the text and
+    looking the results up, without comparing the text with every name.
+    """
+
+    def __init__(self, names: Iterable[str], max_distance: int = 2):
+        self.max_distance = max_distance
+        # Dict[case-folded name, name]
+        self._names: Dict[str, str] = {}
+        # Dict[name with deleted symbols, case-folded names]
+        self._names_by_deletion: Dict[str, List[str]] = {}
+        for name in names:
+            folded_name = name.casefold()
+            if folded_name in self._names:
+                continue
+            self._names[folded_name] = name
+            for deletion in _get_deletions(folded_name, max_distance):
+                try:
+                    self._names_by_deletion[deletion].append(folded_name)
+                except KeyError:
+                    self._names_by_deletion[deletion] = [folded_name]
+        self._max_words_amount = max(
+            (name.count(" ") + 1 for name in self._names), default=0
+        )
+        self._max_name_length = max(map(len, self._names), default=0)
+        # Dict[case-folded name, index of the name]
+        self._names_order = {
+            folded_name: index for index, folded_name in enumerate(self._names)
+        }
+
+    def find_similar(self, text: str, limit: int = 3) -> List[str]:
+        """
+        Finds names, which are similar to the beginning of the text (case is
+        ignored). Every beginning, which consists of the whole words and isn't
+        longer than the names, is checked, because names can consist of
+        multiple words.
+
+        Args:
+            text: user input (like "command arg1 arg2")
+            limit: maximal amount of the names to return
+
+        Returns:
+            names from the most similar ones (in the order, in which they
+            were given to the index, if they are equally similar)
+        """
+        folded_text = text.casefold()
+        # Dict[case-folded name, edit distance]
+        distances: Dict[str, int] = {}
+        prefix_end = 0
+        for _ in range(self._max_words_amount):
+            prefix_end = folded_text.find(" ", prefix_end + 1)
+            if prefix_end == -1:
+                prefix_end = len(folded_text)
+            prefix = folded_text[:prefix_end]
+            if len(prefix) > self._max_name_length + self.max_distance:
+                break
+            # Short words are similar to too many names
+            max_distance = min(self.max_distance, len(prefix) // 3)
+            candidates = {
+                folded_name
+                for deletion in _get_deletions(prefix, max_distance)
+                for folded_name in self._names_by_deletion.get(deletion, ())
+            }
+            for folded_name in candidates:
+                distance = get_edit_distance(
+                    prefix, folded_name, max_distance
+                )
+                if distance < distances.get(folded_name, max_distance + 1):
+                    distances[folded_name] = distance
+            if prefix_end == len(folded_text):
+                break
+        return [
+            self._names[folded_name]
+            for folded_name in sorted(
+                distances,
+                key=lambda folded_name: (
+                    distances[folded_name], self._names_order[folded_name]
+                )
+            )[:limit]
+        ]
@@ -1,11 +1,16 @@
 import datetime
 import re
+import sys
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
-from typing import Optional, Any, Tuple, Callable, Type, Dict, List, Awaitable
+from dataclasses import dataclass, field
+from typing import (
+    Optional, Any, Tuple, Callable, Type, Dict, List, Awaitable, Pattern,
+    Iterator, Union, Sequence
+)
 
 import exceptions
 import lexer.exceptions
+import lexer.matching
 from enums import GrammaticalCases
 from handlers.dataclasses import HandlingResult
 
@@ -82,6 +87,32 @@ class BaseArgType(ABC):
     def regex(self) -> str:
         pass
 
+    def get_match_ends(
+            self, text: lexer.matching.TextToMatch, start: int,
+            allowed_ends: lexer.matching.AllowedEnds) -> Iterator[int]:
+        """
+        Yields positions, at which the argument, that begins at the start
+        position, can end. Positions should be yielded in the same order, in
+        which the regex engine would try them with the self.regex, and only
+        positions from allowed_ends should be yielded.
+
+        This implementation tries every allowed end with the self.regex in
+        ascending order (like the lazy regex does), so it is slow and it is
+        better to override it.
+
+        Args:
+            text: text of the command
+            start: position, at which the argument begins
+            allowed_ends: positions, at which the argument is allowed to end
+
+        Returns:
+            iterator over the positions, at which the argument can end
+        """
+        pattern = re.compile(self.regex, flags=re.DOTALL | re.IGNORECASE)
+        for end in allowed_ends.after(start):
+            if pattern.fullmatch(text.string, start, end) is not None:
+                yield end
+
     @property
     def description(self) -> Optional[str]:
         return None
@@ -132,7 +163,8 @@ class ConstantContext:
 
     full_commands_help_message: str
     commands_only_for_clients_message: str
-    command_descriptions: Dict[str, List[Callable[..., str]]]
+    # Dict[case-folded command name, descriptions of the commands with it]
+    command_descriptions: Dict[str, List["CommandDescriptions"]]
 
 
 class BaseMetadataElement(ABC):
@@ -195,49 +227,120 @@ class Command:
     fillers: tuple = ()
     arguments: Tuple[Arg, ...] = ()
     allowed_only_for_employees: bool = False
+    # (names, compiled patterns of the names), see _get_name_patterns
+    _name_patterns: Optional[Tuple[
+        Tuple[str, ...], Tuple[Pattern, ...]
+    ]] = field(default=None, init=False, repr=False, compare=False)
+
+    def _get_name_patterns(self) -> Tuple[Pattern, ...]:
+        """
+        Returns compiled patterns of the names, which are built once and then
+        reused until the names are changed.
+
+        Returns:
+            patterns of the names in the same order as the names
+        """
+        if (
+            self._name_patterns is not None
+            and self._name_patterns[0] == self.names
+        ):
+            return self._name_patterns[1]
+        name_patterns = tuple(
+            re.compile(re.escape(name), flags=re.DOTALL | re.IGNORECASE)
+            for name in self.names
+        )
+        self._name_patterns = (self.names, name_patterns)
+        return name_patterns
 
     def convert_command_to_args(
-            self, command: str, separator: str = " ") -> ConvertedCommand:
+            self, command: Union[str, lexer.matching.TextToMatch],
+            separator: str = " ") -> ConvertedCommand:
         """
         Takes some str, converts it to tuple with some values.
 
         Args:
             command:
-                user input (like "command arg1 arg2")
+                user input (like "command arg1 arg2") or TextToMatch with it
+                (one TextToMatch can be given to multiple commands, so they
+                don't match the same names and argument types twice)
             separator:
                 what symbol needs to be between arguments (regex); default " "
 
         Returns:
             tuple of some values, which are converted arguments from string
+
+        Raises:
+            ParsingError:
+                if the command doesn't match; args_num is the number of the
+                first argument, which can't be matched (0 if the name can't be
+                matched)
         """
-        for args_num in range(len(self.arguments) + 1):
-            names = '|'.join(re.escape(name) for name in self.names)
-            pattern = separator.join(
-                [
-                    f"({names})", *[
-                        f"({arg.type.regex})"
-                        for arg in self.arguments[:args_num]
-                    ]  # Something like (\d\d)
-                ]  # Something like (?i)(command) (\d\d)
-            ) + ("$" if args_num == len(self.arguments) else "")
-            rgx_result = re.match(
-                pattern, command, flags=re.DOTALL | re.IGNORECASE
+        if isinstance(command, lexer.matching.TextToMatch):
+            text = command
+            text_is_own = False
+        else:
+            text = lexer.matching.TextToMatch(command)
+            text_is_own = True
+        name_patterns = self._get_name_patterns()
+        name_ends = text.get_name_ends(self.names, name_patterns)
+        try:
+            name_end_index, arg_spans = lexer.matching.match_command(
+                text, name_ends, [arg.type for arg in self.arguments],
+                separator
             )
-            if rgx_result is None:
+        finally:
+            if text_is_own:
+                text.forget_match_ends()
+        # noinspection PyArgumentList
+        # because IDK why it thinks that `arg` argument is already filled
+        # (like `self`)
+        return ConvertedCommand(
+            name=text.string[:name_ends[name_end_index]],
+            arguments=[
+                arg.type.convert(text.string[arg_start:arg_end])
+                for arg, (arg_start, arg_end) in zip(self.arguments, arg_spans)
+            ]
+        )
+
+    def convert_payload_arguments(
+            self, arguments: Sequence[str]) -> ConvertedCommand:
+        """
+        Converts the arguments, which are given separately (from the payload
+        of the keyboard button), so only every argument is checked, without
+        searching for the name and the separators.
+
+        Args:
+            arguments:
+                arguments as they would be written in the text of the command
+                (there should be as many of them as in self.arguments)
+
+        Returns:
+            converted command with the first name of the command
+
+        Raises:
+            ParsingError:
+                if some argument doesn't match its type; args_num is the
+                number of the first such argument
+        """
+        for args_num, (arg, argument) in enumerate(
+            zip(self.arguments, arguments), start=1
+        ):
+            text = lexer.matching.TextToMatch(argument)
+            whole_argument = lexer.matching.AllowedEnds((len(argument),))
+            argument_matches = next(
+                text.get_match_ends(arg.type, 0, whole_argument), None
+            ) is not None
+            text.forget_match_ends()
+            if not argument_matches:
                 raise lexer.exceptions.ParsingError(args_num)
-        # noinspection PyUnboundLocalVariable
-        # because range(len(self.arguments) + 1) will be at least with length of
-        # 1
-        rgx_groups = rgx_result.groups()
         # noinspection PyArgumentList
         # because IDK why it thinks that `arg` argument is already filled
         # (like `self`)
         return ConvertedCommand(
-            name=rgx_groups[0],
+            name=self.names[0],
             arguments=[
-                converter(group) for group, converter in zip(
-                    rgx_groups[1:], [arg.type.convert for arg in self.arguments]
-                )
+                arg.type.convert(argument)
+                for arg, argument in zip(self.arguments, arguments)
             ]
         )
 
@@ -343,3 +446,47 @@ class Command:
             f" - {self.description}" if self.description is not None else ""
         )
         return f"/{self.names[0]}{alt_names}{args_str}{description_str}"
+
+
+@dataclass
+class CommandDescriptions:
+    """
+    All renderings of the command description. They are made once, so help
+    requests don't build the same strings again.
+    """
+
+    compact: str
+    full: str
+    full_with_type_descriptions: str
+    full_with_heading: str
+    full_with_heading_and_type_descriptions: str
+
+    @classmethod
+    def from_command(cls, command: Command) -> "CommandDescriptions":
+        # Strings are interned, because many names lead to the same
+        # descriptions and they live as long as the bot
+        return cls(
+            compact=sys.intern(command.get_compact_full_description()),
+            full=sys.intern(command.get_full_description()),
+            full_with_type_descriptions=sys.intern(
+                command.get_full_description(include_type_descriptions=True)
+            ),
+            full_with_heading=sys.intern(
+                command.get_full_description(include_heading=True)
+            ),
+            full_with_heading_and_type_descriptions=sys.intern(
+                command.get_full_description(
+                    include_type_descriptions=True, include_heading=True
+                )
+            )
+        )
+
+
+@dataclass
+class ParsedCommand:
+    # None if no command matches the text
+    command: Optional[Command] = None
+    converted_command: Optional[ConvertedCommand] = None
+    # Number of the furthest argument, on which the matching failed (0 if it
+    # failed on the name)
+    error_args_amount: int = 0
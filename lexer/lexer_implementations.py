@@ -1,12 +1,14 @@
 import re
-from typing import Dict, List, Callable, Optional
+from typing import Dict, List, Optional, Iterator, Tuple
 
 from enums import GrammaticalCases
+from interval_set import IntervalSet
 from lexer.enums import IntTypes
 from lexer.lexer_classes import (
     Context, BaseArgType, BaseMetadataElement, BaseConstantMetadataElement,
-    ConstantContext
+    ConstantContext, CommandDescriptions
 )
+from lexer.matching import TextToMatch, AllowedEnds
 
 
 class IntArgType(BaseArgType):
@@ -50,6 +52,19 @@ class IntArgType(BaseArgType):
             return r"\d+"
         return r"[1-9]\d*"
 
+    def get_match_ends(
+            self, text: TextToMatch, start: int,
+            allowed_ends: AllowedEnds) -> Iterator[int]:
+        match = re.compile(self.regex).match(text.string, start)
+        if match is not None:
+            digits_start = (
+                start + 1 if text.string.startswith("-", start) else start
+            )
+            # Digits are matched greedily, so the longest number goes first
+            for end in range(match.end(), digits_start, -1):
+                if end in allowed_ends:
+                    yield end
+
     def convert(self, arg: str) -> int:
         return int(arg)
 
@@ -72,6 +87,22 @@ class MonthNumberArgType(BaseArgType):
     def regex(self) -> str:
         return r"(?:0?[1-9]|1[012])"
 
+    def get_match_ends(
+            self, text: TextToMatch, start: int,
+            allowed_ends: AllowedEnds) -> Iterator[int]:
+        first_symbols = text.string[start:start + 2]
+        ends = []
+        # The same order as in the regex
+        if first_symbols[:1] == "0" and first_symbols[1:] in tuple("123456789"):
+            ends.append(start + 2)  # "0?[1-9]" with zero
+        elif first_symbols[:1] in tuple("123456789"):
+            ends.append(start + 1)  # "0?[1-9]" without zero
+        if first_symbols[:1] == "1" and first_symbols[1:] in tuple("012"):
+            ends.append(start + 2)  # "1[012]"
+        for end in ends:
+            if end in allowed_ends:
+                yield end
+
     def convert(self, arg: str) -> int:
         return int(arg)
 
@@ -107,6 +138,25 @@ class StringArgType(BaseArgType):
             return r".+?"
         return fr"(?:.+?){{1,{self.length_limit}}}"
 
+    def get_match_ends(
+            self, text: TextToMatch, start: int,
+            allowed_ends: AllowedEnds) -> Iterator[int]:
+        # Every non-empty string matches
+        if self.length_limit is None:
+            yield from allowed_ends.after(start)  # Shortest goes first
+        else:
+            # "(?:.+?){1,N}" makes N one-symbol repetitions first and then
+            # extends the last one, so it tries strings with the length of N
+            # and longer in ascending order, and only then the shorter ones in
+            # descending order
+            shorter_ends = []
+            for end in allowed_ends.after(start):
+                if end - start < self.length_limit:
+                    shorter_ends.append(end)
+                else:
+                    yield end
+            yield from reversed(shorter_ends)
+
     def __init__(self, length_limit: int = None):
         self.length_limit = length_limit
 
@@ -143,6 +193,72 @@ class SequenceArgType(BaseArgType):
             f"(?:{self.separator}{self.element_type.regex})*"
         )
 
+    def get_match_ends(
+            self, text: TextToMatch, start: int,
+            allowed_ends: AllowedEnds) -> Iterator[int]:
+        separator_ends = text.get_separator_ends(self.separator)
+        # Element can end either before the separator or at the end of the
+        # sequence
+        element_allowed_ends = allowed_ends.union(separator_ends)
+        yielded_ends = set()
+        # Starts of the separators and of the elements, after which all the
+        # possible ends were already tried. The ends, which are found after
+        # them, don't depend on the elements before them, so they would be
+        # yielded again, and only the ends, which weren't yielded yet, matter
+        explored_separator_starts = set()
+        explored_element_starts = set()
+        # Every item is [iterator over the ends of the element, iterator over
+        # the other starts of the element (the shorter matches of the
+        # separator before it, None until they are needed), end of the
+        # previous element, which should be yielded after both iterators are
+        # exhausted]
+        stack = [[
+            self.element_type.get_match_ends(
+                text, start, element_allowed_ends
+            ), iter(()), None
+        ]]
+        while stack:
+            item = stack[-1]
+            element_end = next(item[0], None)
+            if element_end is None:
+                previous_element_end = item[2]
+                if item[1] is None:
+                    item[1] = iter(text.get_shorter_separator_ends(
+                        self.separator, previous_element_end
+                    ))
+                element_start = next(item[1], None)
+                if element_start is not None:
+                    if element_start not in explored_element_starts:
+                        explored_element_starts.add(element_start)
+                        item[0] = self.element_type.get_match_ends(
+                            text, element_start, element_allowed_ends
+                        )
+                    continue
+                stack.pop()
+                element_end = previous_element_end
+                if element_end is None:
+                    continue
+            elif (
+                element_end in separator_ends
+                and element_end not in explored_separator_starts
+            ):
+                # Repetition is greedy, so one more element is tried first
+                # (after the longest match of the separator)
+                explored_separator_starts.add(element_end)
+                element_start = separator_ends[element_end]
+                if element_start in explored_element_starts:
+                    element_ends = iter(())
+                else:
+                    explored_element_starts.add(element_start)
+                    element_ends = self.element_type.get_match_ends(
+                        text, element_start, element_allowed_ends
+                    )
+                stack.append([element_ends, None, element_end])
+                continue
+            if element_end in allowed_ends and element_end not in yielded_ends:
+                yielded_ends.add(element_end)
+                yield element_end
+
     @property
     def description(self) -> str:
         return (
@@ -161,6 +277,91 @@ class SequenceArgType(BaseArgType):
         )
 
 
+class IntRangeArgType(BaseArgType):
+    """
+    Positive integer ("512") or a range of positive integers ("100-400"),
+    ends of the range are included.
+    """
+
+    def _get_name(
+            self, case: GrammaticalCases = GrammaticalCases.NOMINATIVE,
+            singular: bool = True) -> str:
+        if case is GrammaticalCases.NOMINATIVE:
+            if singular:
+                return "положительное целое число или диапазон таких чисел"
+            return "положительные целые числа или диапазоны таких чисел"
+        elif case is GrammaticalCases.GENITIVE:
+            if singular:
+                return "положительного целого числа или диапазона таких чисел"
+            return "положительных целых чисел или диапазонов таких чисел"
+
+    @property
+    def regex(self) -> str:
+        return r"\d+(?: *- *\d+)?"
+
+    def get_match_ends(
+            self, text: TextToMatch, start: int,
+            allowed_ends: AllowedEnds) -> Iterator[int]:
+        match = re.compile(self.regex).match(text.string, start)
+        if match is not None:
+            range_start_end = re.compile(r"\d+").match(
+                text.string, start
+            ).end()
+            ends = []
+            # The optional range end is greedy, so it goes first (it can be
+            # matched only after all digits of the range start, and the only
+            # place, where its digits can begin, is after all spaces)
+            if match.end() != range_start_end:
+                range_end_start = match.end()
+                while text.string[range_end_start - 1].isdigit():
+                    range_end_start -= 1
+                ends.extend(range(match.end(), range_end_start, -1))
+            ends.extend(range(range_start_end, start, -1))
+            for end in ends:
+                if end in allowed_ends:
+                    yield end
+
+    def convert(self, arg: str) -> Tuple[int, int]:
+        range_start, _separator, range_end = arg.partition("-")
+        range_start = int(range_start)
+        range_end = int(range_end) if range_end else range_start
+        # "400-100" is the same as "100-400"
+        return min(range_start, range_end), max(range_start, range_end)
+
+    @property
+    def description(self) -> str:
+        return (
+            "число (например, 512) или диапазон чисел через дефис (например, "
+            "100-400, оба конца входят в диапазон)"
+        )
+
+
+class IntervalSetArgType(SequenceArgType):
+    """
+    Sequence of positive integers and ranges of them, which is converted to the
+    IntervalSet, so ranges aren't unpacked to the separate integers.
+    """
+
+    def __init__(self, separator: str = r" *, *"):
+        super().__init__(IntRangeArgType(), separator)
+
+    def convert(self, arg: str) -> IntervalSet:
+        # Separator can't be a part of the element (elements are separated by
+        # it), so elements can be found without splitting the argument
+        return IntervalSet(
+            self.element_type.convert(element_match.group())
+            for element_match in re.finditer(self.element_type.regex, arg)
+        )
+
+    @property
+    def description(self) -> str:
+        return (
+            f"От 1 до бесконечности чисел или диапазонов чисел через дефис "
+            f"(например, 100-400), разделенных через '{self.separator}' (<- "
+            f"регулярное выражение); повторы не учитываются"
+        )
+
+
 class VKSenderIDGetter(BaseMetadataElement):
 
     @staticmethod
@@ -196,7 +397,7 @@ class CommandDescriptionsGetter(BaseConstantMetadataElement):
     @staticmethod
     def get_data_from_constant_context(
             constant_context: ConstantContext
-            ) -> Dict[str, List[Callable[..., str]]]:
+            ) -> Dict[str, List[CommandDescriptions]]:
         return constant_context.command_descriptions
 
 
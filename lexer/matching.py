@@ -0,0 +1,362 @@
+"""
+Matching of the commands without the backtracking regexes.
+
+Every argument type gives positions, where it can end (see
+BaseArgType.get_match_ends), and match_command goes through the arguments from
+left to right, remembering the positions from which the rest of the arguments
+can't be matched. So every (argument, position) pair is checked only once and a
+long text can't make the matching exponentially slow. The argument, on which
+the matching fails, is found in the same pass.
+
+TextToMatch remembers the possible ends of the arguments, so overloaded
+commands, which begin with the same argument types, don't match them twice.
+"""
+import functools
+import re
+from bisect import bisect_right
+from typing import (
+    Dict, Iterable, Iterator, List, Sequence, Tuple, Hashable, Any
+)
+
+import lexer.exceptions
+
+
+@functools.lru_cache(maxsize=None)
+def _compile_separator(separator: str) -> "re.Pattern":
+    return re.compile(separator, flags=re.DOTALL | re.IGNORECASE)
+
+
+class TextToMatch:
+    """
+    Text of the command with the positions of separators, which are found only
+    once for every separator.
+    """
+
+    def __init__(self, string: str):
+        self.string = string
+        # Dict[separator, Dict[separator start, separator end]]
+        self._separator_ends: Dict[str, Dict[int, int]] = {}
+        # Dict[(separator, separator start), ends of the shorter matches]
+        self._shorter_separator_ends: Dict[
+            Tuple[str, int], Tuple[int, ...]
+        ] = {}
+        # Dict[separator, allowed ends]
+        self._allowed_ends: Dict[str, AllowedEnds] = {}
+        # Dict[(names, ...), name ends]
+        self._name_ends: Dict[Hashable, List[int]] = {}
+        # Dict[(argument type, start, allowed ends), argument ends]
+        self._match_ends: Dict[Hashable, _RememberedEnds] = {}
+        self._any_end = None
+        # Like "$" in the regex, which also matches before the newline at the
+        # end of the text
+        self.end_of_text = AllowedEnds(
+            (len(string) - 1, len(string))
+            if string.endswith("\n") else
+            (len(string),)
+        )
+
+    def __len__(self) -> int:
+        return len(self.string)
+
+    def get_separator_ends(self, separator: str) -> Dict[int, int]:
+        """
+        Finds all positions, where the separator matches.
+
+        Args:
+            separator: regex of the separator
+
+        Returns:
+            dict, where keys are the positions, at which the separator begins,
+            and values are positions, at which it ends (keys are sorted)
+        """
+        try:
+            return self._separator_ends[separator]
+        except KeyError:
+            # Lookahead doesn't consume symbols, so matches can overlap
+            separator_ends = {
+                match.start(): match.end(1) for match in re.finditer(
+                    f"(?=({separator}))", self.string,
+                    flags=re.DOTALL | re.IGNORECASE
+                )
+            }
+            self._separator_ends[separator] = separator_ends
+            return separator_ends
+
+    def get_shorter_separator_ends(
+            self, separator: str, start: int) -> Tuple[int, ...]:
+        """
+        Finds the shorter matches of the separator, which begins at the
+        position (it should be one of the keys of get_separator_ends). The
+        regex engine tries them, if the rest of the text doesn't match after
+        the longest one (like " *, *" in "a ,  b" matches " ,  ", then " , "
+        and " ,"). The separators should be greedy (like all separators of the
+        commands), so the longest match is tried first.
+
+        Returns:
+            ends of the shorter matches in descending order (in which the
+            regex engine tries them)
+        """
+        try:
+            return self._shorter_separator_ends[separator, start]
+        except KeyError:
+            separator_pattern = _compile_separator(separator)
+            shorter_ends = tuple(
+                end for end in range(
+                    self.get_separator_ends(separator)[start] - 1, start - 1,
+                    -1
+                )
+                if separator_pattern.fullmatch(self.string, start, end)
+            )
+            self._shorter_separator_ends[separator, start] = shorter_ends
+            return shorter_ends
+
+    def iterate_separator_ends(
+            self, separator: str, start: int) -> Iterator[int]:
+        """
+        Yields ends of the separator, which begins at the position (it should
+        be one of the keys of get_separator_ends), in the order, in which the
+        regex engine tries them. The shorter matches are found only when they
+        are needed (see get_shorter_separator_ends).
+        """
+        yield self.get_separator_ends(separator)[start]
+        yield from self.get_shorter_separator_ends(separator, start)
+
+    def get_allowed_ends(self, separator: str) -> "AllowedEnds":
+        """
+        Returns positions, where an argument, which is followed by the
+        separator, can end.
+
+        Args:
+            separator: regex of the separator
+
+        Returns:
+            positions, at which the separator begins
+        """
+        try:
+            return self._allowed_ends[separator]
+        except KeyError:
+            allowed_ends = AllowedEnds(tuple(
+                self.get_separator_ends(separator)
+            ))
+            self._allowed_ends[separator] = allowed_ends
+            return allowed_ends
+
+    def get_any_end(self) -> "AllowedEnds":
+        """
+        Returns all positions of the text.
+        """
+        if self._any_end is None:
+            self._any_end = AllowedEnds(range(len(self.string) + 1))
+        return self._any_end
+
+    def get_name_ends(self, names_key: Hashable, name_patterns) -> List[int]:
+        """
+        Finds ends of the names, which are at the beginning of the text. Ends
+        are remembered, so commands with the same names don't match them
+        again.
+
+        Args:
+            names_key: names of the command
+            name_patterns: compiled patterns of the names (in the same order)
+
+        Returns:
+            ends of the matched names in the order of the names
+        """
+        try:
+            return self._name_ends[names_key]
+        except KeyError:
+            name_ends = []
+            for name_pattern in name_patterns:
+                name_match = name_pattern.match(self.string)
+                if name_match is not None:
+                    name_ends.append(name_match.end())
+            self._name_ends[names_key] = name_ends
+            return name_ends
+
+    def get_match_ends(
+            self, arg_type: Any, start: int,
+            allowed_ends: "AllowedEnds") -> Iterator[int]:
+        """
+        Same as arg_type.get_match_ends(self, start, allowed_ends), but ends,
+        which were already found for the argument type with the same regex,
+        aren't found again.
+        """
+        key = (type(arg_type), arg_type.regex, start, id(allowed_ends))
+        try:
+            remembered_ends = self._match_ends[key]
+        except KeyError:
+            remembered_ends = _RememberedEnds(
+                arg_type.get_match_ends(self, start, allowed_ends)
+            )
+            self._match_ends[key] = remembered_ends
+        return iter(remembered_ends)
+
+    def forget_match_ends(self) -> None:
+        """
+        Forgets the remembered ends of the arguments. Their iterators refer to
+        this object, so without this they are freed only by the cyclic garbage
+        collector (call it, when the text won't be matched anymore).
+        """
+        self._match_ends.clear()
+
+
+class _RememberedEnds:
+    """
+    Iterable, that remembers the values of the iterator, so they can be
+    iterated over multiple times, but the iterator is still consumed lazily.
+    """
+
+    def __init__(self, iterator: Iterator[int]):
+        self._iterator = iterator
+        self._values: List[int] = []
+
+    def __iter__(self) -> Iterator[int]:
+        index = 0
+        while True:
+            if index == len(self._values):
+                value = next(self._iterator, None)
+                if value is None:
+                    return
+                self._values.append(value)
+            yield self._values[index]
+            index += 1
+
+
+class AllowedEnds:
+    """
+    Sorted positions of the text, at which an argument is allowed to end.
+    """
+
+    def __init__(self, positions: Sequence[int]):
+        self.positions = positions
+        self._positions_set = frozenset(positions)
+
+    def __contains__(self, position: int) -> bool:
+        return position in self._positions_set
+
+    def after(self, position: int) -> Iterator[int]:
+        """
+        Yields allowed ends, which are greater than the position, in
+        ascending order.
+        """
+        for index in range(
+            bisect_right(self.positions, position), len(self.positions)
+        ):
+            yield self.positions[index]
+
+    def union(self, positions: Iterable[int]) -> "AllowedEnds":
+        return AllowedEnds(sorted(self._positions_set.union(positions)))
+
+
+def match_command(
+        text: TextToMatch, name_ends: Sequence[int], arg_types: Sequence,
+        separator: str) -> Tuple[int, List[Tuple[int, int]]]:
+    """
+    Matches the arguments with the rest of the text after one of the names.
+    Arguments are separated by the separator (it is also between the name and
+    the first argument) and the last argument should end at the end of the
+    text. Names and possible ends of every argument are tried in the order, in
+    which the regex engine would try them, so the result is the same as the
+    result of the regex "(name1|name2) (arg1) (arg2)$", but without the
+    backtracking.
+
+    Args:
+        text: text to match
+        name_ends: ends of the names, which are at the beginning of the text
+        arg_types: types of the arguments (BaseArgType's)
+        separator: what symbol needs to be between arguments (regex)
+
+    Returns:
+        index of the name end, after which the arguments are matched, and
+        (start, end) span of every argument
+
+    Raises:
+        ParsingError:
+            if the text doesn't match; args_num is the number of the first
+            argument, which can't be matched (0 if no name is matched), the
+            same as in the first regex of "(name1|name2)", "(name1|name2)
+            (arg1)", "(name1|name2) (arg1) (arg2)$", which doesn't match
+    """
+    if not name_ends:
+        raise lexer.exceptions.ParsingError(0)
+    if not arg_types:
+        for name_end_index, name_end in enumerate(name_ends):
+            if name_end in text.end_of_text:
+                return name_end_index, []
+        raise lexer.exceptions.ParsingError(0)
+    separator_ends = text.get_separator_ends(separator)
+    separator_allowed_ends = text.get_allowed_ends(separator)
+    last_arg_index = len(arg_types) - 1
+    failed_states = set()  # (argument index, start of the argument)
+    # Starts of the arguments, which were the furthest from the name
+    deepest_arg_index = -1
+    deepest_arg_starts: List[int] = []
+
+    def get_arg_spans(
+            arg_index: int,
+            arg_starts: Iterable[int]) -> Iterator[Tuple[int, int]]:
+        """
+        Yields (start, end) spans of the argument, which starts at one of the
+        ends of the separator (they are tried one after another, like the
+        regex engine does it).
+        """
+        nonlocal deepest_arg_index, deepest_arg_starts
+        for arg_start in arg_starts:
+            if (arg_index, arg_start) in failed_states:
+                continue
+            if arg_index > deepest_arg_index:
+                deepest_arg_index = arg_index
+                deepest_arg_starts = []
+            if arg_index == deepest_arg_index:
+                deepest_arg_starts.append(arg_start)
+            for arg_end in text.get_match_ends(
+                arg_types[arg_index], arg_start,
+                text.end_of_text
+                if arg_index == last_arg_index else
+                separator_allowed_ends
+            ):
+                yield arg_start, arg_end
+            failed_states.add((arg_index, arg_start))
+
+    for name_end_index, name_end in enumerate(name_ends):
+        if name_end not in separator_ends:
+            continue
+        # Chosen spans of all arguments except the last
+        arg_spans: List[Tuple[int, int]] = []
+        # Iterators over the possible spans of the arguments, which are being
+        # matched now (one iterator for every argument from the first one)
+        arg_spans_iterators = [get_arg_spans(
+            0, text.iterate_separator_ends(separator, name_end)
+        )]
+        while arg_spans_iterators:
+            arg_index = len(arg_spans_iterators) - 1
+            arg_span = next(arg_spans_iterators[-1], None)
+            if arg_span is None:
+                arg_spans_iterators.pop()
+                if arg_spans:
+                    arg_spans.pop()  # Previous argument will try its next end
+            elif arg_index == last_arg_index:
+                # The last argument can end only at the end of the text, so the
+                # whole text is matched
+                arg_spans.append(arg_span)
+                return name_end_index, arg_spans
+            else:
+                arg_spans.append(arg_span)
+                arg_spans_iterators.append(get_arg_spans(
+                    arg_index + 1,
+                    text.iterate_separator_ends(separator, arg_span[1])
+                ))
+    # The name and the arguments before the deepest one are matched. The
+    # deepest argument is matched too, if it matches anything (not only
+    # something, that is followed by the separator)
+    matched_args_amount = max(deepest_arg_index, 0)
+    if deepest_arg_index != -1 and any(
+        next(iter(text.get_match_ends(
+            arg_types[deepest_arg_index], arg_start, text.get_any_end()
+        )), None) is not None
+        for arg_start in deepest_arg_starts
+    ):
+        matched_args_amount += 1
+    raise lexer.exceptions.ParsingError(
+        min(matched_args_amount + 1, len(arg_types))
+    )
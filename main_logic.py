@@ -1,32 +1,44 @@
 import asyncio
 import datetime
+import json
 import logging
+import os
 import sys
 import traceback
-from typing import NoReturn, Optional, List, Tuple, Dict, Callable
+from typing import (
+    NoReturn, Optional, List, Tuple, Dict, Union, Coroutine, Any
+)
 
 import aiohttp
 import simple_avk
 
 import lexer.exceptions
 import lexer.generators
+import lexer.indexes
+import lexer.matching
+import orm.slow_statements
+from caches import LRUCache
 from enums import GrammaticalCases
 from handlers.handler_helpers import HandlerHelpers
 from handlers.handlers import Handlers, HandlingResult
 from lexer.enums import IntTypes
-from lexer.lexer_classes import Command, Arg, Context, ConstantContext
+from lexer.lexer_classes import (
+    Command, Arg, Context, ConstantContext, ParsedCommand,
+    CommandDescriptions
+)
 from lexer.lexer_implementations import (
     StringArgType, VKSenderIDGetter, VKPeerIDGetter,
     SequenceArgType, IntArgType, FullCommandsHelpMessageGetter,
     CommandDescriptionsGetter, CurrentYearGetter,
     CurrentMonthGetter, MonthNumberArgType,
-    CommandsOnlyForClientsHelpMessageGetter
+    CommandsOnlyForClientsHelpMessageGetter, IntervalSetArgType
 )
 from orm import db_apis
+from orm.db_config import make_db_config_from_files
 from vk.enums import Sex
 from vk.vk_config import VkConfig, make_vk_config_from_files
 from vk.vk_related_classes import Message
-from vk.vk_worker import VKWorker
+from vk.vk_worker import VKWorker, SNACKBAR_TEXT_MAX_LENGTH
 
 
 class MainLogic:
@@ -37,7 +49,7 @@ class MainLogic:
             vk_config: VkConfig,
             commands_generator: lexer.generators.CommandsGenerator,
             logger: Optional[logging.Logger] = None,
-            commit_changes: bool = True):
+            commit_changes: bool = True, use_parsing_cache: bool = True):
         self.vk_config = vk_config
         self.managers_container = managers_container
         self.vk_worker = vk_worker
@@ -86,8 +98,10 @@ class MainLogic:
                 metadata=(VKSenderIDGetter, VKPeerIDGetter),
                 arguments=(
                     Arg(
-                        "ID заказов, которые нужно отменить (через запятую)",
-                        SequenceArgType(IntArgType())
+                        (
+                            "ID заказов, которые нужно отменить (через "
+                            "запятую, можно диапазонами вроде 100-400)"
+                        ), IntervalSetArgType()
                     ),
                     Arg("причина отмены", StringArgType())
                 )
@@ -135,8 +149,8 @@ class MainLogic:
                     Arg(
                         (
                             "ID заказов, которые нужно отметить оплаченными "
-                            "(через запятую)"
-                        ), SequenceArgType(IntArgType())
+                            "(через запятую, можно диапазонами вроде 100-400)"
+                        ), IntervalSetArgType()
                     ),
                     Arg(
                         "выручка (с каждого указанного заказа)",
@@ -190,9 +204,9 @@ class MainLogic:
                 arguments=(
                     Arg(
                         (
-                            "ID заказов, которые нужно отметить "
-                            "взятыми (через запятую)"
-                        ), SequenceArgType(IntArgType())
+                            "ID заказов, которые нужно отметить взятыми "
+                            "(через запятую, можно диапазонами вроде 100-400)"
+                        ), IntervalSetArgType()
                     ),
                 ),
                 allowed_only_for_employees=True
@@ -232,8 +246,10 @@ class MainLogic:
                 metadata=(VKSenderIDGetter, VKPeerIDGetter),
                 arguments=(
                     Arg(
-                        "ID заказов (через запятую)",
-                        SequenceArgType(IntArgType())
+                        (
+                            "ID заказов (через запятую, можно диапазонами "
+                            "вроде 100-400)"
+                        ), IntervalSetArgType()
                     ),
                 )
             ),
@@ -307,78 +323,267 @@ class MainLogic:
                 names=("памятка", "memo"),
                 handler=handlers.get_memo,
                 description="показывает памятку по использованию бота"
+            ),
+            Command(
+                names=("поиск", "найти", "search"),
+                handler=handlers.search_orders,
+                description=(
+                    "ищет заказы по словам из текста и причины отмены (слова "
+                    "можно писать не полностью, сначала идут самые "
+                    "подходящие заказы; если ищет клиент - только среди "
+                    "заказов этого же клиента)"
+                ),
+                metadata=(VKSenderIDGetter, VKPeerIDGetter),
+                arguments=(Arg("слова для поиска", StringArgType()),)
+            ),
+            Command(
+                names=(
+                    "медленные запросы", "медленные", "slow queries",
+                    "slow statements"
+                ),
+                handler=handlers.get_slowest_statements,
+                description=(
+                    "показывает самые медленные запросы к базе данных за "
+                    "последнее время и команды, которые их сделали"
+                ),
+                allowed_only_for_employees=True
+            ),
+            Command(
+                names=("дальше", "next", "еще"),
+                handler=handlers.get_next_orders_page,
+                description=(
+                    "показывает следующие заказы, если последний список "
+                    "заказов в этом чате показан не полностью"
+                ),
+                metadata=(VKPeerIDGetter,)
             )
         )
-        command_descriptions: Dict[str, List[Callable[..., str]]] = {}
-        for command in self.commands:
+        # Every description is rendered once here, so help requests only look
+        # them up
+        rendered_descriptions = [
+            CommandDescriptions.from_command(command)
+            for command in self.commands
+        ]
+        command_descriptions: Dict[str, List[CommandDescriptions]] = {}
+        for command, descriptions in zip(self.commands, rendered_descriptions):
             for name in command.names:
+                folded_name = name.casefold()
                 try:
-                    command_descriptions[name].append(
-                        command.get_compact_full_description
-                    )
+                    command_descriptions[folded_name].append(descriptions)
                 except KeyError:
-                    command_descriptions[name] = [
-                        command.get_compact_full_description
-                    ]
-        first_command_desc = self.commands[0].get_compact_full_description()
-        commands_for_clients_str = (
-            vk_config.HELP_MESSAGE_BEGINNING + first_command_desc
+                    command_descriptions[folded_name] = [descriptions]
+        all_commands_str = sys.intern(
+            vk_config.HELP_MESSAGE_BEGINNING + "\n".join(
+                descriptions.compact
+                for descriptions in rendered_descriptions
+            )
+        )
+        commands_for_clients_str = sys.intern(
+            vk_config.HELP_MESSAGE_BEGINNING + "\n".join(
+                descriptions.compact
+                for command, descriptions in zip(
+                    self.commands, rendered_descriptions
+                )
+                if not command.allowed_only_for_employees
+            )
         )
-        all_commands_str = vk_config.HELP_MESSAGE_BEGINNING + first_command_desc
-        for command in self.commands[1:]:
-            description = command.get_compact_full_description()
-            all_commands_str += f"\n{description}"
-            if not command.allowed_only_for_employees:
-                commands_for_clients_str += f"\n{description}"
         self.constant_context = ConstantContext(
             full_commands_help_message=all_commands_str,
             commands_only_for_clients_message=commands_for_clients_str,
             command_descriptions=command_descriptions
         )
+        self.commands_index = lexer.indexes.CommandsIndex(self.commands)
+        # Dict[(first name, amount of arguments), command] for the payloads
+        # of the keyboard buttons (see vk_related_classes.CommandButton)
+        self.commands_by_payload_key: Dict[Tuple[str, int], Command] = {}
+        for command in self.commands:
+            payload_key = (command.names[0], len(command.arguments))
+            if payload_key not in self.commands_by_payload_key:
+                self.commands_by_payload_key[payload_key] = command
+        # For the suggestions, when the command name is misspelled (clients
+        # don't get the names of the commands, which they can't use)
+        self.names_index = lexer.indexes.NamesIndex(
+            name for command in self.commands for name in command.names
+        )
+        self.names_for_clients_index = lexer.indexes.NamesIndex(
+            name
+            for command in self.commands
+            if not command.allowed_only_for_employees
+            for name in command.names
+        )
+        self.parsing_cache: Optional[LRUCache] = (
+            LRUCache(vk_config.PARSED_COMMANDS_CACHE_SIZE)
+            if use_parsing_cache else None
+        )
 
-    async def handle_command(
-            self, current_chat_peer_id: int, command: str,
-            vk_message_info: dict) -> List[Message]:
+    def parse_command(self, command: str) -> ParsedCommand:
+        """
+        Finds the command, which matches the text, and converts its arguments.
+        Results are cached (if the cache is used), because most of the
+        messages are the same few commands.
+
+        Args:
+            command: user input (like "command arg1 arg2")
+
+        Returns:
+            matched command with converted arguments or the number of the
+            furthest argument, on which the matching failed
+        """
+        if self.parsing_cache is not None:
+            parsed_command = self.parsing_cache.get(command)
+            if parsed_command is not None:
+                return parsed_command
         error_args_amount = 0
-        for command_ in self.commands:
+        # Shared between the commands, so overloads don't match the same
+        # things again
+        text_to_match = lexer.matching.TextToMatch(command)
+        # Commands, which names aren't at the beginning of the text, will fail
+        # on the name anyway, so they can't affect error_args_amount
+        for command_ in self.commands_index.get_candidates(command):
             try:
-                converted_command = command_.convert_command_to_args(command)
+                converted_command = command_.convert_command_to_args(
+                    text_to_match
+                )
             except lexer.exceptions.ParsingError as parsing_error:
                 if parsing_error.args_num > error_args_amount:
                     error_args_amount = parsing_error.args_num
             else:
-                if (
-                    command_.allowed_only_for_employees
-                    and (
-                        current_chat_peer_id
-                        != self.vk_config.EMPLOYEES_CHAT_PEER_ID
-                    )
-                ):
-                    return [Message(
-                        (
-                            f"Команда \"{converted_command.name}\" "
-                            f"доступна только сотрудникам (ее нужно "
-                            f"написать в чате для сотрудников)!"
-                        ), current_chat_peer_id
-                    )]
-                handling_result: HandlingResult = await command_.handler(
-                    *command_.get_converted_metadata(
-                        Context(vk_message_info, datetime.date.today())
-                    ),
-                    *command_.get_converted_constant_metadata(
-                        self.constant_context
-                    ),
-                    *command_.fillers,
-                    *converted_command.arguments
+                parsed_command = ParsedCommand(command_, converted_command)
+                break
+        else:
+            parsed_command = ParsedCommand(
+                error_args_amount=error_args_amount
+            )
+        text_to_match.forget_match_ends()
+        if self.parsing_cache is not None:
+            self.parsing_cache.put(command, parsed_command)
+        return parsed_command
+
+    def parse_payload(
+            self, payload: Union[str, dict]) -> Optional[ParsedCommand]:
+        """
+        Finds the command by the payload of the keyboard button and converts
+        the pre-bound arguments, so the text isn't parsed.
+
+        Args:
+            payload:
+                payload of the button (JSON string from the message or the
+                dict from the callback event), see
+                vk_related_classes.CommandButton.get_payload
+
+        Returns:
+            matched command with converted arguments, the number of the
+            argument, which doesn't match its type, or None if the payload
+            isn't from the CommandButton (or its command doesn't exist
+            anymore)
+        """
+        if isinstance(payload, str):
+            try:
+                payload = json.loads(payload)
+            except ValueError:
+                return None
+        try:
+            command_name = payload["command"]
+            arguments = payload["arguments"]
+        except (KeyError, TypeError):
+            return None
+        if not (
+            isinstance(command_name, str)
+            and isinstance(arguments, list)
+            and all(isinstance(argument, str) for argument in arguments)
+        ):
+            return None
+        command_ = self.commands_by_payload_key.get(
+            (command_name, len(arguments))
+        )
+        if command_ is None:
+            return None
+        try:
+            converted_command = command_.convert_payload_arguments(arguments)
+        except lexer.exceptions.ParsingError as parsing_error:
+            return ParsedCommand(error_args_amount=parsing_error.args_num)
+        return ParsedCommand(command_, converted_command)
+
+    async def handle_command(
+            self, current_chat_peer_id: int, command: str,
+            vk_message_info: dict,
+            parsed_command: Optional[ParsedCommand] = None) -> List[Message]:
+        """
+        Runs the command and returns the messages, which should be sent.
+
+        Args:
+            current_chat_peer_id: peer_id of the chat with the command
+            command: user input (like "command arg1 arg2")
+            vk_message_info: message info from VK (for the metadata)
+            parsed_command:
+                already parsed command (from the payload of the button); if
+                None, the command text is parsed
+
+        Returns:
+            messages with the results of the command
+        """
+        if parsed_command is None:
+            parsed_command = self.parse_command(command)
+        command_ = parsed_command.command
+        converted_command = parsed_command.converted_command
+        if command_ is not None:
+            if (
+                command_.allowed_only_for_employees
+                and (
+                    current_chat_peer_id
+                    != self.vk_config.EMPLOYEES_CHAT_PEER_ID
                 )
-                if self.commit_changes and handling_result.commit_needed:
-                    self.managers_container.commit()
-                return handling_result.notification.to_messages(
-                    client_peer_id=current_chat_peer_id,
-                    employees_chat_peer_id=self.vk_config.EMPLOYEES_CHAT_PEER_ID
+            ):
+                return [Message(
+                    (
+                        f"Команда \"{converted_command.name}\" "
+                        f"доступна только сотрудникам (ее нужно "
+                        f"написать в чате для сотрудников)!"
+                    ), current_chat_peer_id
+                )]
+            # Slow statements of the command are logged with its name
+            current_command_token = orm.slow_statements.CURRENT_COMMAND.set(
+                converted_command.name
+            )
+            try:
+                # Changes of the command are rolled back, if they aren't
+                # committed (or if the handler fails)
+                async with self.managers_container.unit_of_work():
+                    handling_result: HandlingResult = await command_.handler(
+                        *command_.get_converted_metadata(
+                            Context(vk_message_info, datetime.date.today())
+                        ),
+                        *command_.get_converted_constant_metadata(
+                            self.constant_context
+                        ),
+                        *command_.fillers,
+                        *converted_command.arguments
+                    )
+                    if (
+                        self.commit_changes
+                        and handling_result.commit_needed
+                    ):
+                        await self.managers_container.commit()
+            finally:
+                orm.slow_statements.CURRENT_COMMAND.reset(
+                    current_command_token
                 )
+            return handling_result.notification.to_messages(
+                client_peer_id=current_chat_peer_id,
+                employees_chat_peer_id=self.vk_config.EMPLOYEES_CHAT_PEER_ID
+            )
+        error_args_amount = parsed_command.error_args_amount
         if error_args_amount == 0:
             error_msg = "Ошибка обработки команды на её названии!"
+            similar_names = (
+                self.names_index
+                if current_chat_peer_id == self.vk_config.EMPLOYEES_CHAT_PEER_ID
+                else self.names_for_clients_index
+            ).find_similar(command)
+            if similar_names:
+                error_msg += " Похожие команды: {}.".format(
+                    ", ".join(f"/{name}" for name in similar_names)
+                )
         else:
             error_msg = (
                 f"Ошибка обработки команды на аргументе номер "
@@ -406,12 +611,59 @@ class MainLogic:
 
     async def reply_to_vk_message(
             self, current_chat_peer_id: int, command: str,
-            message_info: dict) -> None:
-        done_replies = await self.vk_worker.multiple_reply(
+            message_info: dict,
+            parsed_command: Optional[ParsedCommand] = None) -> None:
+        await self.send_replies(
+            current_chat_peer_id,
             await self.handle_command(
-                current_chat_peer_id, command, message_info
+                current_chat_peer_id, command, message_info, parsed_command
             )
         )
+
+    async def reply_to_vk_callback(
+            self, command: str, event_info: dict,
+            parsed_command: Optional[ParsedCommand]) -> None:
+        """
+        Runs the command of the callback button. The reply to the chat, where
+        the button was pressed, is shown in the snackbar (if it fits), so no
+        new message is sent there.
+
+        Args:
+            command: text of the command (for the logs and errors)
+            event_info: "object" of the "message_event" event
+            parsed_command:
+                command from the payload of the button (None if the button
+                doesn't run any command)
+        """
+        if parsed_command is None:
+            await self.vk_worker.answer_message_event(
+                event_info, "Эта кнопка больше не работает."
+            )
+            return
+        current_chat_peer_id = event_info["peer_id"]
+        messages = await self.handle_command(
+            current_chat_peer_id, command,
+            {"peer_id": current_chat_peer_id, "from_id": event_info["user_id"]},
+            parsed_command
+        )
+        snackbar_text = None
+        other_messages = []
+        for message in messages:
+            if (
+                snackbar_text is None
+                and message.peer_id == current_chat_peer_id
+                and message.keyboard is None
+                and len(message.text) <= SNACKBAR_TEXT_MAX_LENGTH
+            ):
+                snackbar_text = message.text
+            else:
+                other_messages.append(message)
+        await self.vk_worker.answer_message_event(event_info, snackbar_text)
+        await self.send_replies(current_chat_peer_id, other_messages)
+
+    async def send_replies(
+            self, current_chat_peer_id: int, messages: List[Message]) -> None:
+        done_replies = await self.vk_worker.multiple_reply(messages)
         ids_of_people_who_blacklisted_the_bot = []
         for reply in done_replies:
             exception = reply.exception
@@ -490,17 +742,57 @@ class MainLogic:
                     f"Она была залоггирована, админы - уведомлены.", peer_id
                 ))
 
+    def start_replying(
+            self, peer_id: int, text: str,
+            coroutine: Coroutine[Any, Any, None]) -> None:
+        asyncio.create_task(coroutine).add_done_callback(
+            lambda future: asyncio.create_task(
+                self.future_done_callback(peer_id, text, future)
+            )
+        )
+
     async def listen_for_vk_events(self) -> NoReturn:
-        async for message_info in self.vk_worker.listen_for_messages():
+        async for event in self.vk_worker.listen_for_events():
+            if event["type"] == "message_event":
+                event_info = event["object"]
+                payload = event_info.get("payload")
+                parsed_command = self.parse_payload(payload)
+                # VK gives the payload of the callback as an object
+                text = (
+                    " ".join((payload["command"], *payload["arguments"]))
+                    if (
+                        parsed_command is not None
+                        and isinstance(payload, dict)
+                    ) else
+                    "(неизвестная кнопка)"
+                )
+                self.start_replying(
+                    event_info["peer_id"], text,
+                    self.reply_to_vk_callback(text, event_info, parsed_command)
+                )
+                continue
+            message_info = event["object"]["message"]
             text: str = message_info["text"]
             peer_id: int = message_info["peer_id"]
-            if text.startswith("/"):
+            payload = message_info.get("payload")
+            # Buttons send the command in the payload, so the text isn't
+            # parsed
+            parsed_command = (
+                None if payload is None else self.parse_payload(payload)
+            )
+            if parsed_command is not None:
+                self.start_replying(
+                    peer_id, text,
+                    self.reply_to_vk_message(
+                        peer_id, text, message_info, parsed_command
+                    )
+                )
+            elif text.startswith("/"):
                 text = text[1:]  # Cutting /
-                asyncio.create_task(
+                self.start_replying(
+                    peer_id, text,
                     self.reply_to_vk_message(peer_id, text, message_info)
-                ).add_done_callback(lambda future: asyncio.create_task(
-                    self.future_done_callback(peer_id, text, future)
-                ))
+                )
 
     async def send_commands_from_stdin(self) -> NoReturn:
         while True:
@@ -537,15 +829,27 @@ async def main(debug: bool = False):
             ),
             vk_config
         )
-        db_session = db_apis.get_db_session("sqlite:///BAC_light.db")
         logging.basicConfig(
             level=logging.INFO,
             format="[%(asctime)s | %(name)s | %(levelname)s] - %(message)s"
         )
+        # Secrets of the database are optional (SQLite doesn't need them)
+        files_with_db_config = [
+            open(path, "r", encoding="utf-8") for path in [
+                "orm/config/db_config.ini", "orm/config/db_secrets.ini"
+            ] if os.path.exists(path)
+        ]
+        db_config = make_db_config_from_files(files_with_db_config)
+        for file in files_with_db_config:
+            file.close()
+        db_executor = db_apis.get_db_executor(
+            db_config, logging.getLogger("migrations"),
+            logging.getLogger("slow_statements")
+        )
         managers_container = db_apis.ManagersContainer(
-            db_apis.OrdersManager(db_session),
+            db_apis.OrdersManager(db_executor),
             db_apis.CachedVKUsersManager(
-                db_session,
+                db_executor,
                 vk_worker,
                 logging.getLogger("users_caching_logger")
             )
@@ -563,10 +867,25 @@ async def main(debug: bool = False):
             lexer.generators.CommandsGenerator(vk_config),
             logging.getLogger("command_errors")
         )
-        if debug:
-            await main_logic.send_commands_from_stdin()
-        else:
-            await main_logic.listen_for_vk_events()
+        archiving_task = asyncio.create_task(
+            db_apis.archive_orders_periodically(
+                managers_container.orders_manager, db_config,
+                logging.getLogger("orders_archiving")
+            )
+        )
+        try:
+            if debug:
+                await main_logic.send_commands_from_stdin()
+            else:
+                await main_logic.listen_for_vk_events()
+        finally:
+            # The batch, which is being moved, is rolled back
+            archiving_task.cancel()
+            try:
+                await archiving_task
+            except asyncio.CancelledError:
+                pass
+            await db_executor.shutdown()
 
 
 if __name__ == "__main__":
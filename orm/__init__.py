@@ -1 +1 @@
-from . import db_apis, models
+from . import db_apis, models, migrations
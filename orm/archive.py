@@ -0,0 +1,124 @@
+"""
+Archive of the orders, which were closed long ago.
+
+Almost every command needs only the active orders, so paid and canceled
+orders are moved from the orders to the archived orders, when they are
+closed for long enough, and the orders stay small and stay in the cache, no
+matter how many years of the orders are kept. Closed orders can't be changed,
+so the archived orders are only read.
+
+Reads are transparent to the archive: listings, search and reports of the
+OrdersManager read the orders and then the archived orders with the same
+filters (see adapt_to_archive), the archived orders are loaded as the
+orders and keep their IDs.
+"""
+import datetime
+
+from sqlalchemy import Column, and_, or_, select, func
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import ClauseElement, visitors
+
+from orm import models
+from orm.enums import OrderStatuses
+
+
+def adapt_to_archive(clause: ClauseElement) -> ClauseElement:
+    """
+    Returns the copy of the clause (like the filter of the orders), which has
+    the columns of the archived orders instead of the columns of the orders.
+    """
+    orders_table = models.Order.__table__
+
+    def replace(element: ClauseElement) -> ClauseElement:
+        if isinstance(element, Column) and element.table is orders_table:
+            return models.archived_orders_table.c[element.key]
+        return None
+
+    return visitors.replacement_traverse(clause, {}, replace)
+
+
+def move_closed_orders(
+        session: Session, closed_before: datetime.date,
+        batch_size: int) -> int:
+    """
+    Moves to the archive the oldest paid and canceled orders, which were
+    closed before the date (orders, which were closed before the closing
+    dates were added, have no closing date, so they are moved too).
+
+    Args:
+        session: session of the writer
+        closed_before: date, from which the closed orders are left
+        batch_size: maximum amount of the moved orders
+
+    Returns:
+        amount of the moved orders (if it is less than the batch size, there
+        are no more orders to move)
+    """
+    orders_table = models.Order.__table__
+    # SQLite gives the new order the greatest ID plus one, so the newest
+    # order is never moved, otherwise its ID would be given again
+    newest_order_id = select([func.max(orders_table.c.id)]).as_scalar()
+    moved_ids = (
+        select([orders_table.c.id])
+        .where(and_(
+            orders_table.c.status.in_(
+                (OrderStatuses.PAID, OrderStatuses.CANCELED)
+            ),
+            or_(
+                orders_table.c.closing_date.is_(None),
+                orders_table.c.closing_date < closed_before
+            ),
+            orders_table.c.id < newest_order_id
+        ))
+        # Sorted, so the same orders are found by both statements below
+        .order_by(orders_table.c.id)
+        .limit(batch_size)
+    )
+    columns = [column.key for column in orders_table.columns]
+    session.execute(
+        models.archived_orders_table.insert().from_select(
+            columns,
+            select([orders_table.c[column] for column in columns])
+            .where(orders_table.c.id.in_(moved_ids))
+        )
+    )
+    return session.execute(
+        orders_table.delete().where(orders_table.c.id.in_(moved_ids))
+    ).rowcount
+
+
+def analyze(session: Session) -> None:
+    """
+    Updates the statistics of the tables (the orders are much smaller after
+    the moving, so the query planner should know about it).
+    """
+    session.execute("ANALYZE")
+
+
+def vacuum_free_pages(session: Session, max_pages_amount: int) -> int:
+    """
+    Gives the free pages of SQLite back to the file system (if the database
+    was made with the incremental auto vacuum, see sqlite_auto_vacuum in the
+    config). PostgreSQL vacuums the tables itself.
+
+    Args:
+        session: session of the writer
+        max_pages_amount: maximum amount of the given back pages
+
+    Returns:
+        amount of the free pages, which are left (0, if the database isn't
+        vacuumed this way)
+    """
+    if (
+        session.bind.dialect.name != "sqlite"
+        # 2 is INCREMENTAL
+        or session.execute("PRAGMA auto_vacuum").scalar() != 2
+    ):
+        return 0
+    free_pages_amount = session.execute("PRAGMA freelist_count").scalar()
+    vacuumed_pages_amount = min(free_pages_amount, max_pages_amount)
+    # sqlite3 makes only one step of the statement without the columns, and
+    # one step of incremental_vacuum frees one page
+    for _ in range(vacuumed_pages_amount):
+        session.execute("PRAGMA incremental_vacuum")
+    return free_pages_amount - vacuumed_pages_amount
@@ -1,96 +1,867 @@
 import asyncio
+import contextlib
+import datetime
+import heapq
 import logging
+import time
 from dataclasses import dataclass
-from typing import Any, List, Iterable, Optional, Union
+from typing import (
+    Any, List, Optional, Union, Iterable, Iterator, Tuple, AsyncIterator, Dict,
+    NoReturn
+)
 
-from sqlalchemy import create_engine
+from sqlalchemy import (
+    create_engine, or_, and_, func, tuple_, event, select, union_all,
+    bindparam
+)
+from sqlalchemy.engine import Engine, Connection
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.ext import baked
 from sqlalchemy.orm import Session, Query
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql import ClauseElement
 
 import exceptions
+import orm.archive
 import orm.exceptions
+import orm.migrations
+import orm.search
+import orm.slow_statements
+from orm.db_config import DbConfig
+from orm.db_executor import DatabaseExecutor
 from enums import GrammaticalCases
-from orm import models
+from interval_set import IntervalSet
+from orm import models, orders_filters
+from orm.enums import EarningsGroupings, OrderStatuses
+from orm.orders_filters import OrdersFilter
+from orm.slow_statements import SlowStatementsLog, StatementStatistics
 from vk import vk_related_classes
 from vk.vk_worker import VKWorker
 
+# Old builds of SQLite don't allow more than 999 parameters in one query
+MAX_BOUND_PARAMETERS_AMOUNT = 900
 
-def get_db_session(path_to_sqlite_db: str) -> Session:
-    sql_engine = create_engine(path_to_sqlite_db)
-    models.DeclarativeBase.metadata.create_all(sql_engine)
-    return Session(sql_engine)
+# Cache of the queries, which are run on almost every command. Query is built
+# and compiled on its first run, the next runs only give the values of the
+# parameters to it (see OrdersManager._bake_query)
+QUERIES_BAKERY = baked.bakery(size=500)
+
+# Only these statements have the plans (other ones, like PRAGMA or SAVEPOINT,
+# aren't explained)
+EXPLAINED_STATEMENTS_BEGINNINGS = (
+    "SELECT", "INSERT", "UPDATE", "DELETE", "WITH"
+)
+
+
+def make_engine(db_config: DbConfig) -> Engine:
+    url = make_url(db_config.URL)
+    if url.get_backend_name() != "sqlite":
+        return create_engine(
+            url, pool_size=db_config.POOL_SIZE,
+            max_overflow=db_config.MAX_OVERFLOW
+        )
+    # By default file databases are opened for every session, but the pool
+    # keeps the connections with their page cache and memory map. Connection
+    # is used only by one thread at a time, but threads change, so the check
+    # of the thread is turned off
+    engine = create_engine(
+        url, poolclass=QueuePool, pool_size=db_config.POOL_SIZE,
+        max_overflow=db_config.MAX_OVERFLOW,
+        connect_args={"check_same_thread": False}
+    )
+    sqlite_pragmas = db_config.sqlite_pragmas
+
+    # noinspection PyUnusedLocal
+    # because connection_record is needed for the signature of the event
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in sqlite_pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+    return engine
+
+
+def _explain_statement(
+        connection: Connection, statement: str,
+        parameters: Any) -> Optional[str]:
+    """
+    Returns the plan of the statement (EXPLAIN QUERY PLAN of SQLite or
+    EXPLAIN of PostgreSQL, nothing is run by them), which is made on the same
+    connection, so it sees the same tables (None if the statement can't be
+    explained).
+    """
+    dialect_name = connection.dialect.name
+    if dialect_name not in ("sqlite", "postgresql") or not (
+        statement.lstrip().upper().startswith(EXPLAINED_STATEMENTS_BEGINNINGS)
+    ):
+        return None
+    # Cursor of the DB-API, so the EXPLAIN isn't timed itself
+    cursor = connection.connection.cursor()
+    try:
+        if dialect_name == "postgresql":
+            cursor.execute(f"EXPLAIN {statement}", parameters)
+            return "\n".join(row[0] for row in cursor.fetchall())
+        cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+        # Dict[ID of the step of the plan, its depth in the tree of the plan]
+        depths = {0: 0}
+        lines = []
+        # Rows are (ID of the step, ID of the parent step, unused, step)
+        for step_id, parent_id, _unused, step in cursor.fetchall():
+            depth = depths.get(parent_id, 0) + 1
+            depths[step_id] = depth
+            lines.append("  " * (depth - 1) + step)
+        return "\n".join(lines)
+    finally:
+        cursor.close()
+
+
+def log_slow_statements(
+        engine: Engine, slow_statements_log: SlowStatementsLog) -> None:
+    """
+    Times every statement of the engine and adds it to the log (see
+    orm/slow_statements.py). Slow statements are explained right after they
+    are run.
+    """
+
+    # noinspection PyUnusedLocal
+    # because the arguments are needed for the signature of the event
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_timing(
+            connection, cursor, statement, parameters, context,
+            executemany) -> None:
+        if context is not None:
+            context.statement_started_at = time.perf_counter()
+
+    # noinspection PyUnusedLocal
+    # because cursor is needed for the signature of the event
+    @event.listens_for(engine, "after_cursor_execute")
+    def stop_timing(
+            connection, cursor, statement, parameters, context,
+            executemany) -> None:
+        # Statements of the dialect itself (like the checks of the new
+        # connections) have no context, so they aren't timed
+        if context is None:
+            return
+        duration = time.perf_counter() - context.statement_started_at
+        if not slow_statements_log.add_statement(statement, duration):
+            return
+        plan = None
+        if not executemany:
+            try:
+                plan = _explain_statement(connection, statement, parameters)
+            except Exception as error:
+                plan = f"(EXPLAIN failed: {error})"
+        slow_statements_log.log_slow_statement(
+            statement, parameters, duration, plan
+        )
+
+
+def get_db_executor(
+        db_config: DbConfig,
+        logger: Optional[logging.Logger] = None,
+        slow_statements_logger: Optional[logging.Logger] = None
+        ) -> DatabaseExecutor:
+    sql_engine = make_engine(db_config)
+    # Creates the tables and updates the existing ones
+    orm.migrations.migrate(sql_engine, logger)
+    # Statements of the migrations aren't timed, they are slow anyway
+    slow_statements_log = SlowStatementsLog(
+        db_config.SLOW_STATEMENT_THRESHOLD,
+        db_config.SLOWEST_STATEMENTS_AMOUNT,
+        db_config.SLOW_STATEMENTS_WINDOW, slow_statements_logger
+    )
+    log_slow_statements(sql_engine, slow_statements_log)
+    return DatabaseExecutor(
+        sql_engine, db_config.READERS_AMOUNT,
+        db_config.LOCKED_RETRIES_AMOUNT, db_config.LOCKED_RETRY_DELAY,
+        db_config.GROUP_COMMIT_WINDOW, db_config.GROUP_COMMIT_MAX_SIZE,
+        slow_statements_log
+    )
 
 
 @dataclass
 class FoundResults:
-    failed_ids: List[int]
+    failed_ids: IntervalSet
     successful_rows: List[models.Order]
 
 
+@dataclass
+class UserEarnings:
+    vk_id: int
+    earnings: int
+    paid_orders_amount: int
+
+    @property
+    def average_earnings(self) -> float:
+        return self.earnings / self.paid_orders_amount
+
+
+@dataclass
+class EarningsReport:
+    total_earnings: int
+    paid_orders_amount: int
+    users_earnings: List[UserEarnings]
+
+    @property
+    def average_earnings(self) -> float:
+        if self.paid_orders_amount == 0:
+            return 0
+        return self.total_earnings / self.paid_orders_amount
+
+
 class OrdersManager:
+    """
+    Public methods are run by the DatabaseExecutor (so they are awaited),
+    methods with the session are run in its threads.
+    """
 
-    def __init__(self, sqlalchemy_session: Session):
-        self.db_session = sqlalchemy_session
+    def __init__(self, executor: DatabaseExecutor):
+        self.executor = executor
 
-    def _get_query(self) -> Query:
+    @staticmethod
+    def _get_query(session: Session) -> Query:
         return (
-            self.db_session
+            session
             .query(models.Order)
             .order_by(models.Order.id.desc())
         )
 
-    def get_orders(
-            self, *filters: Any,
-            limit: Optional[int] = None) -> List[models.Order]:
-        query = self._get_query()
-        if filters:
-            query = query.filter(*filters)
+    @staticmethod
+    def _bake_query(
+            archived: bool,
+            conditions: Tuple[ClauseElement, ...] = ()) -> baked.BakedQuery:
+        """
+        Returns the cached query of the orders or the archived orders (they
+        are loaded as the orders) with the conditions of the orders.
+
+        The conditions are the part of the key of the cache, so they should
+        be made once (like the conditions of orm/orders_filters.py) and the
+        values should be given to them with the bound parameters. Conditions
+        are adapted to the archived orders only, when the query is built.
+        """
+        entity = models.ArchivedOrder if archived else models.Order
+        query = QUERIES_BAKERY(
+            lambda session: session.query(entity), archived
+        )
+        if conditions:
+            query.add_criteria(
+                lambda query_: query_.filter(*(
+                    orm.archive.adapt_to_archive(condition)
+                    if archived else
+                    condition
+                    for condition in conditions
+                )),
+                *conditions
+            )
+        return query
+
+    @staticmethod
+    def _merge_with_archived(
+            orders: List[models.Order],
+            archived_orders: List[models.Order]) -> List[models.Order]:
+        """
+        Merges the orders and the archived orders, which are sorted by ID in
+        descending order, so they stay sorted. The orders are read before the
+        archived ones, so the order, which was archived between the reads, is
+        read twice, and it is left once.
+        """
+        order_ids = {order.id for order in orders}
+        return list(heapq.merge(
+            orders,
+            [order for order in archived_orders if order.id not in order_ids],
+            key=lambda order: order.id, reverse=True
+        ))
+
+    async def get_orders(
+            self, *filters: OrdersFilter, limit: Optional[int] = None,
+            before_id: Optional[int] = None) -> List[models.Order]:
+        """
+        Args:
+            filters: filters of the orders (see orm/orders_filters.py)
+            limit: maximum amount of the orders
+            before_id:
+                if specified, only orders with lesser IDs are returned (so the
+                next page of the orders is found by the last ID of the
+                previous page without skipping the previous pages)
+
+        Returns:
+            orders, sorted by ID in descending order
+        """
+        return await self.executor.read(
+            self._get_orders, filters, limit, before_id
+        )
+
+    def _get_orders(
+            self, session: Session, filters: Tuple[OrdersFilter, ...],
+            limit: Optional[int],
+            before_id: Optional[int]) -> List[models.Order]:
+        if before_id is not None:
+            filters = (*filters, orders_filters.with_id_before(before_id))
+        orders = self._get_sorted_orders(session, False, filters, limit)
+        if limit is not None and len(orders) == limit:
+            # Archived orders with lesser IDs wouldn't get to the page, so
+            # the listings of the active orders don't go through the archive
+            filters = (*filters, orders_filters.with_id_after(orders[-1].id))
+        archived_orders = self._get_sorted_orders(
+            session, True, filters, limit
+        )
+        return self._merge_with_archived(orders, archived_orders)[:limit]
+
+    def _get_sorted_orders(
+            self, session: Session, archived: bool,
+            filters: Tuple[OrdersFilter, ...],
+            limit: Optional[int]) -> List[models.Order]:
+        """
+        Returns:
+            orders or archived orders, sorted by ID in descending order
+        """
+        entity = models.ArchivedOrder if archived else models.Order
+        query = self._bake_query(
+            archived, tuple(filter_.condition for filter_ in filters)
+        )
+        query += lambda query_: query_.order_by(entity.id.desc())
+        parameters = {}
+        for filter_ in filters:
+            parameters.update(filter_.parameters)
         if limit is not None:
-            query = query.limit(limit)
-        return query.all()
+            query += lambda query_: query_.limit(bindparam("limit"))
+            parameters["limit"] = limit
+        return query(session).params(**parameters).all()
 
-    def get_orders_by_ids(self, order_ids: Iterable[int]) -> FoundResults:
-        orders: List[models.Order] = (
-            self._get_query()
-            .filter(models.Order.id.in_(order_ids))
-            .all()
+    async def search_orders(
+            self, search_text: str, *filters: OrdersFilter, limit: int,
+            offset: int = 0) -> List[models.Order]:
+        """
+        Finds the orders by their texts and cancellation reasons (see
+        orm/search.py).
+
+        Args:
+            search_text: words, which should be in the orders
+            filters: filters of the orders (see orm/orders_filters.py)
+            limit: maximum amount of the orders
+            offset: amount of the found orders, which are skipped (they were
+                shown on the previous pages)
+
+        Returns:
+            orders, sorted from the most relevant ones
+        """
+        return await self.executor.read(
+            self._search_orders, search_text, filters, limit, offset
         )
-        failed_ids = list(order_ids)
-        for order in orders:
-            failed_ids.remove(order.id)
-        return FoundResults(failed_ids, orders)
 
-    def commit(self) -> None:
-        self.db_session.commit()
+    def _search_orders(
+            self, session: Session, search_text: str,
+            filters: Tuple[OrdersFilter, ...], limit: int,
+            offset: int) -> List[models.Order]:
+        if not orm.search.get_search_words(search_text):
+            return []
+        conditions = tuple(filter_.condition for filter_ in filters)
+        parameters = {}
+        for filter_ in filters:
+            parameters.update(filter_.parameters)
+        dialect_name = session.bind.dialect.name
+        if dialect_name == "sqlite":
+            rows = orm.search.search_in_sqlite(
+                session, search_text, conditions,
+                # Filtered orders are usually few (like orders of the
+                # client), so all found ones are sorted by the relevance
+                ranked_matches_limit=(
+                    None if filters else orm.search.RANKED_MATCHES_LIMIT
+                )
+            ).params(**parameters).limit(limit).offset(offset).all()
+            return [
+                archived_order if order is None else order
+                for order, archived_order, _rank in rows
+            ]
+        # (order, relevance)
+        found_rows: List[Tuple[models.Order, Any]] = []
+        for archived, orders_table in (
+            (False, models.Order.__table__),
+            (True, models.archived_orders_table)
+        ):
+            query = orm.search.add_search(
+                self._bake_query(archived, conditions).to_query(session),
+                search_text, dialect_name, orders_table
+            )
+            # It isn't known, how many orders of the previous pages were
+            # archived, so the previous pages are read from both tables
+            found_rows.extend(
+                query.params(**parameters).limit(offset + limit).all()
+            )
+        found_rows.sort(key=lambda row: (row[1], -row[0].id))
+        found_orders: List[models.Order] = []
+        for order, _relevance in found_rows:
+            # The order, which was archived between the reads, is found
+            # twice
+            if not found_orders or found_orders[-1].id != order.id:
+                found_orders.append(order)
+        return found_orders[offset:offset + limit]
 
-    def delete(self, *orders: models.Order) -> None:
-        for order in orders:
-            self.db_session.delete(order)
+    @staticmethod
+    def _split_to_chunks(
+            intervals: Iterable[Tuple[int, int]]
+            ) -> Iterator[List[Tuple[int, int]]]:
+        """
+        Splits the intervals of the IDs to the chunks, which conditions have
+        no more than MAX_BOUND_PARAMETERS_AMOUNT parameters (one for a single
+        ID and two for a range).
+        """
+        chunk: List[Tuple[int, int]] = []
+        chunk_parameters_amount = 0
+        for start, end in intervals:
+            parameters_amount = 1 if start == end else 2
+            if (
+                chunk_parameters_amount + parameters_amount
+                > MAX_BOUND_PARAMETERS_AMOUNT
+            ):
+                yield chunk
+                chunk = []
+                chunk_parameters_amount = 0
+            chunk.append((start, end))
+            chunk_parameters_amount += parameters_amount
+        if chunk:
+            yield chunk
 
-    def add(self, *orders: models.Order) -> None:
-        self.db_session.add_all(orders)
+    @staticmethod
+    def _get_ids_parameters(
+            intervals: Iterable[Tuple[int, int]]
+            ) -> Tuple[int, bool, Dict[str, Any]]:
+        """
+        Returns:
+            amount of the ranges of the IDs, are there single IDs, and the
+            parameters of the condition of the IDs (see _get_ids_condition)
+        """
+        parameters: Dict[str, Any] = {}
+        single_ids = []
+        ranges_amount = 0
+        for start, end in intervals:
+            if start == end:
+                single_ids.append(start)
+            else:
+                parameters[f"range_start_{ranges_amount}"] = start
+                parameters[f"range_end_{ranges_amount}"] = end
+                ranges_amount += 1
+        if single_ids:
+            parameters["single_ids"] = single_ids
+        return ranges_amount, bool(single_ids), parameters
 
-    def flush(self) -> None:
-        self.db_session.flush()
+    @staticmethod
+    def _get_ids_condition(
+            id_column: Any, ranges_amount: int,
+            with_single_ids: bool) -> ClauseElement:
+        """
+        Returns the condition of the IDs with the bound parameters (see
+        _get_ids_parameters). It is the same for the same amount of the
+        ranges, so the queries with it are cached.
+        """
+        conditions = [
+            id_column.between(
+                bindparam(f"range_start_{range_number}"),
+                bindparam(f"range_end_{range_number}")
+            )
+            for range_number in range(ranges_amount)
+        ]
+        if with_single_ids:
+            # Expanding parameter is replaced with the parameters of all
+            # IDs, when the query is run
+            conditions.append(
+                id_column.in_(bindparam("single_ids", expanding=True))
+            )
+        return or_(*conditions)
+
+    async def get_orders_by_ids(
+            self, order_ids: IntervalSet) -> FoundResults:
+        """
+        Finds orders, which IDs are in the order_ids. Ranges of the IDs are
+        checked with BETWEEN, so they aren't unpacked to the separate IDs. A
+        lot of IDs are found with several queries, so no query has more than
+        MAX_BOUND_PARAMETERS_AMOUNT parameters.
+
+        Args:
+            order_ids: IDs of the orders to find
+
+        Returns:
+            found orders (sorted by ID in descending order) and IDs, for which
+            no orders are found
+        """
+        return await self.executor.read(self._get_orders_by_ids, order_ids)
+
+    def _find_by_ids(
+            self, session: Session, archived: bool,
+            order_ids: IntervalSet) -> List[models.Order]:
+        """
+        Finds the orders or the archived orders by their IDs with one query
+        for every chunk of the IDs.
+
+        Returns:
+            found orders (sorted by ID in descending order)
+        """
+        entity = models.ArchivedOrder if archived else models.Order
+        orders: List[models.Order] = []
+        # Chunks are made from the greatest IDs, so orders of every next
+        # chunk have lesser IDs and all orders stay sorted in descending
+        # order, when every chunk is sorted. Chunks are sorted here, because
+        # with the sorting SQLite reads the whole table instead of finding
+        # the ranges of the IDs
+        for chunk in self._split_to_chunks(reversed(order_ids.intervals)):
+            ranges_amount, with_single_ids, parameters = (
+                self._get_ids_parameters(chunk)
+            )
+            query = self._bake_query(archived)
+            query.add_criteria(
+                lambda query_: query_.filter(self._get_ids_condition(
+                    entity.id, ranges_amount, with_single_ids
+                )),
+                ranges_amount, with_single_ids
+            )
+            orders.extend(sorted(
+                query(session).params(**parameters).all(),
+                key=lambda order: order.id, reverse=True
+            ))
+        return orders
+
+    def _get_orders_by_ids(
+            self, session: Session, order_ids: IntervalSet) -> FoundResults:
+        orders = self._find_by_ids(session, False, order_ids)
+        failed_ids = order_ids.difference(order.id for order in orders)
+        # The archive is read only for the IDs, which aren't in the orders
+        archived_orders = self._find_by_ids(session, True, failed_ids)
+        if archived_orders:
+            orders = self._merge_with_archived(orders, archived_orders)
+            failed_ids = failed_ids.difference(
+                order.id for order in archived_orders
+            )
+        return FoundResults(failed_ids=failed_ids, successful_rows=orders)
+
+    async def take_orders(
+            self, order_ids: IntervalSet,
+            taker_vk_id: int) -> List[models.Order]:
+        """
+        Takes the pending orders, which IDs are in the order_ids.
+
+        Returns:
+            taken orders (sorted by ID in descending order)
+        """
+        return await self.executor.write(
+            self._change_orders, order_ids, models.Order.is_pending,
+            models.Order.get_taking_changes(taker_vk_id)
+        )
+
+    async def cancel_orders(
+            self, order_ids: IntervalSet, canceler_vk_id: int,
+            cancellation_reason: str,
+            only_own_orders: bool) -> List[models.Order]:
+        """
+        Cancels the active orders, which IDs are in the order_ids and which
+        aren't taken by other employee (the client can cancel their order,
+        even if it is taken).
+
+        Args:
+            order_ids: IDs of the orders to cancel
+            canceler_vk_id: VK ID of the client or the employee
+            cancellation_reason: reason of the cancellation
+            only_own_orders:
+                cancel only orders, which are created by the canceler (for
+                the clients)
+
+        Returns:
+            canceled orders (sorted by ID in descending order)
+        """
+        condition = and_(
+            models.Order.is_active,
+            or_(
+                models.Order.is_pending,
+                models.Order.taker_vk_id == canceler_vk_id,
+                models.Order.creator_vk_id == canceler_vk_id
+            )
+        )
+        if only_own_orders:
+            condition = and_(
+                condition, models.Order.creator_vk_id == canceler_vk_id
+            )
+        return await self.executor.write(
+            self._change_orders, order_ids, condition,
+            models.Order.get_cancellation_changes(
+                canceler_vk_id, cancellation_reason
+            )
+        )
+
+    async def mark_orders_as_paid(
+            self, order_ids: IntervalSet, employee_vk_id: int, earnings: int,
+            earning_date: datetime.date) -> List[models.Order]:
+        """
+        Marks as paid the orders, which IDs are in the order_ids and which are
+        taken by the employee and aren't canceled or paid yet.
+
+        Returns:
+            paid orders (sorted by ID in descending order)
+        """
+        return await self.executor.write(
+            self._change_orders, order_ids,
+            and_(
+                models.Order.status == OrderStatuses.TAKEN,
+                models.Order.taker_vk_id == employee_vk_id
+            ),
+            models.Order.get_payment_changes(earnings, earning_date)
+        )
+
+    def _change_orders(
+            self, session: Session, order_ids: IntervalSet, condition: Any,
+            changes: Dict[str, Any]) -> List[models.Order]:
+        """
+        Changes the orders, which IDs are in the order_ids and which match
+        the condition, with one UPDATE for every chunk of the IDs (see
+        get_orders_by_ids), so two commands can't both change the same order,
+        which matched the condition before the change.
+
+        Returns:
+            changed orders (sorted by ID in descending order) with the changes
+        """
+        changed_orders: List[models.Order] = []
+        for chunk in self._split_to_chunks(reversed(order_ids.intervals)):
+            ranges_amount, with_single_ids, parameters = (
+                self._get_ids_parameters(chunk)
+            )
+            chunk_condition = and_(
+                self._get_ids_condition(
+                    models.Order.id, ranges_amount, with_single_ids
+                ),
+                condition
+            )
+            # Rows are locked (where the database can do it) until the
+            # UPDATE, so it changes the same orders, which are selected.
+            # SQLite has no row locks, but the transaction of the writer
+            # already holds the whole database
+            orders = (
+                self._get_query(session)
+                .filter(chunk_condition)
+                .params(**parameters)
+                .with_for_update()
+                .all()
+            )
+            if not orders:
+                continue
+            (
+                session
+                .query(models.Order)
+                .filter(chunk_condition)
+                .params(**parameters)
+                .update(changes, synchronize_session=False)
+            )
+            for order in orders:
+                for attribute_name, value in changes.items():
+                    # Without the history, so the orders aren't updated again
+                    # on the flush
+                    set_committed_value(order, attribute_name, value)
+            changed_orders.extend(orders)
+        return changed_orders
+
+    async def add_monthly_earnings(
+            self, employee_vk_id: int, earning_date: datetime.date,
+            earnings: int, paid_orders_amount: int) -> None:
+        """
+        Adds the earnings to the earnings of the employee for the month of the
+        earning date (negative values are subtracted).
+
+        Args:
+            employee_vk_id: VK ID of the employee, who took the orders
+            earning_date: date, when the orders were paid
+            earnings: sum of the earnings of the orders
+            paid_orders_amount: amount of the orders
+        """
+        await self.executor.write(
+            self._add_monthly_earnings, employee_vk_id, earning_date,
+            earnings, paid_orders_amount
+        )
+
+    @staticmethod
+    def _add_monthly_earnings(
+            session: Session, employee_vk_id: int,
+            earning_date: datetime.date, earnings: int,
+            paid_orders_amount: int) -> None:
+        monthly_earnings: Optional[models.MonthlyEarnings] = (
+            session.query(models.MonthlyEarnings).get(
+                (earning_date.year, earning_date.month, employee_vk_id)
+            )
+        )
+        if monthly_earnings is None:
+            session.add(models.MonthlyEarnings(
+                year=earning_date.year, month=earning_date.month,
+                employee_vk_id=employee_vk_id, earnings=earnings,
+                paid_orders_amount=paid_orders_amount
+            ))
+        else:
+            monthly_earnings.earnings += earnings
+            monthly_earnings.paid_orders_amount += paid_orders_amount
+
+    async def get_earnings_report(
+            self, start_date: datetime.date, end_date: datetime.date,
+            grouping: EarningsGroupings = EarningsGroupings.EMPLOYEES
+            ) -> EarningsReport:
+        """
+        Sums up the earnings of the orders, which were paid from the start
+        date and before the end date, with one GROUP BY query, so the orders
+        themselves aren't loaded. Earnings of the employees for the whole
+        months are taken from the monthly earnings, so the orders aren't
+        even read.
+
+        Args:
+            start_date: first date of the report
+            end_date: date after the last date of the report
+            grouping: by whom the earnings are grouped
+
+        Returns:
+            earnings of everyone in the grouping, who has paid orders in the
+            dates (from the greatest earnings), and their sum
+        """
+        return await self.executor.read(
+            self._get_earnings_report, start_date, end_date, grouping
+        )
+
+    @staticmethod
+    def _get_earnings_report(
+            session: Session, start_date: datetime.date,
+            end_date: datetime.date,
+            grouping: EarningsGroupings) -> EarningsReport:
+        if (
+            grouping is EarningsGroupings.EMPLOYEES
+            and start_date.day == 1 and end_date.day == 1
+        ):
+            month = tuple_(
+                models.MonthlyEarnings.year, models.MonthlyEarnings.month
+            )
+            vk_id = models.MonthlyEarnings.employee_vk_id
+            earnings = func.sum(models.MonthlyEarnings.earnings)
+            paid_orders_amount = func.sum(
+                models.MonthlyEarnings.paid_orders_amount
+            )
+            filters = (
+                month >= tuple_(start_date.year, start_date.month),
+                month < tuple_(end_date.year, end_date.month)
+            )
+        else:
+            # Paid orders are read from the orders and the archived orders
+            # with one statement, so the order, which is archived at the
+            # same time, isn't counted twice
+            paid_orders = union_all(*(
+                select([
+                    (
+                        orders_table.c.taker_vk_id
+                        if grouping is EarningsGroupings.EMPLOYEES else
+                        orders_table.c.creator_vk_id
+                    ).label("vk_id"),
+                    orders_table.c.earnings
+                ])
+                # Only paid orders have the earning date
+                .where(and_(
+                    orders_table.c.earning_date >= start_date,
+                    orders_table.c.earning_date < end_date
+                ))
+                for orders_table in (
+                    models.Order.__table__, models.archived_orders_table
+                )
+            )).alias("paid_orders")
+            vk_id = paid_orders.c.vk_id
+            earnings = func.sum(paid_orders.c.earnings)
+            paid_orders_amount = func.count()
+            filters = ()
+        users_earnings = [
+            UserEarnings(*row) for row in (
+                session
+                .query(vk_id, earnings, paid_orders_amount)
+                .filter(*filters)
+                .group_by(vk_id)
+                .having(paid_orders_amount != 0)
+                .order_by(earnings.desc(), vk_id)
+            )
+        ]
+        return EarningsReport(
+            total_earnings=sum(
+                user_earnings.earnings for user_earnings in users_earnings
+            ),
+            paid_orders_amount=sum(
+                user_earnings.paid_orders_amount
+                for user_earnings in users_earnings
+            ),
+            users_earnings=users_earnings
+        )
+
+    async def archive_closed_orders(
+            self, closed_before: datetime.date, batch_size: int,
+            vacuum_batch_size: int) -> int:
+        """
+        Moves to the archive the paid and canceled orders, which were closed
+        before the date (see orm/archive.py). They are moved in batches and
+        every batch is committed separately, so the commands are handled
+        between them. After the moving, the statistics of the tables are
+        updated and the database is vacuumed (in batches too).
+
+        Args:
+            closed_before: date, from which the closed orders are left
+            batch_size: maximum amount of the orders, which are moved at once
+            vacuum_batch_size:
+                maximum amount of the free pages, which are given back to the
+                file system at once
+
+        Returns:
+            amount of the archived orders
+        """
+        archived_orders_amount = 0
+        while True:
+            moved_orders_amount = await self.executor.write(
+                orm.archive.move_closed_orders, closed_before, batch_size
+            )
+            archived_orders_amount += moved_orders_amount
+            if moved_orders_amount < batch_size:
+                break
+        if archived_orders_amount != 0:
+            await self.executor.write(orm.archive.analyze)
+            while True:
+                free_pages_amount = await self.executor.write(
+                    orm.archive.vacuum_free_pages, vacuum_batch_size
+                )
+                if free_pages_amount == 0:
+                    break
+        return archived_orders_amount
+
+    async def commit(self) -> None:
+        await self.executor.commit()
+
+    async def delete(self, *orders: models.Order) -> None:
+        await self.executor.write(self._delete, orders)
+
+    @staticmethod
+    def _delete(session: Session, orders: Tuple[models.Order, ...]) -> None:
+        for order in orders:
+            session.delete(order)
+
+    async def add(self, *orders: models.Order) -> None:
+        """
+        Adds the new orders (they get their IDs here) or saves the changes of
+        the orders, which were found before.
+        """
+        await self.executor.write(Session.add_all, orders)
 
 
 class CachedVKUsersManager:
 
     def __init__(
-            self, sqlalchemy_session: Session, vk_worker: VKWorker,
+            self, executor: DatabaseExecutor, vk_worker: VKWorker,
             logger: Optional[logging.Logger] = None):
-        self.db_session = sqlalchemy_session
+        self.executor = executor
         self.vk_worker = vk_worker
-        self.asyncio_lock = asyncio.Lock()
         self.logger = logger
 
     async def get_user_info_by_vk_id(
             self, vk_id: Union[int, str],
             name_case: GrammaticalCases = GrammaticalCases.NOMINATIVE
             ) -> vk_related_classes.VKUserInfo:
-        # noinspection GrazieInspection
-        # because ] in the penultimate explanation string is opened, but
-        # LanguageTool doesn't see the opening square bracket.
         """
         Gets user info by ID. If no user info found - downloads it, even with
         the name cases.
@@ -102,97 +873,137 @@ class CachedVKUsersManager:
         Returns:
             info about the specified user
         """
-        async with self.asyncio_lock:
-            try:
-                vk_id = int(vk_id)
-                # If vk_id is a number:
-                #     Try to find row by vk_id in the database
-                #     If there is no row:
-                #         Get user info from vk
-                #         Add a row
-                #     [get from database - (download - add)?]
-                # Else:
-                #     Get user info from vk
-                #     Try to find row by .id in the database
-                #     If there is no row:
-                #         Add a row from the existing user info
-                #     [download - get from database - (add)?]
-            except ValueError:
-                user_info_from_vk = await self.vk_worker.get_user_info(
-                    vk_id, name_case
+        # noinspection GrazieInspection
+        # because ] in the penultimate explanation string is opened, but
+        # LanguageTool doesn't see the opening square bracket.
+        # If vk_id is a number:
+        #     Try to find row by vk_id in the database
+        #     If there is no row:
+        #         Get user info from vk
+        #         Add a row
+        #     [get from database - (download - add)?]
+        # Else:
+        #     Get user info from vk
+        #     Try to find row by .id in the database
+        #     If there is no row:
+        #         Add a row from the existing user info
+        #     [download - get from database - (add)?]
+        try:
+            vk_id = int(vk_id)
+        except ValueError:
+            user_info_from_vk = await self.vk_worker.get_user_info(
+                vk_id, name_case
+            )
+            vk_id = user_info_from_vk.id
+        else:
+            user_info_from_vk = None
+        user_info = await self.executor.read(
+            self._get_cached_user_info, vk_id, name_case
+        )
+        if user_info is not None:
+            return user_info
+        if user_info_from_vk is None:
+            user_info_from_vk = await self.vk_worker.get_user_info(
+                vk_id, name_case
+            )
+        # The command can wait for the VK API here, so the cache is written
+        # in its own unit of work (the command doesn't hold the write lock
+        # while it waits for the next users)
+        await self.executor.write_and_commit(
+            self._cache_user_info, user_info_from_vk, name_case
+        )
+        return user_info_from_vk
+
+    @staticmethod
+    def _get_user(session: Session, vk_id: int) -> models.CachedVKUser:
+        """
+        Raises:
+            NoResultFound: if the user isn't in the database
+        """
+        query = QUERIES_BAKERY(
+            lambda session_: session_.query(models.CachedVKUser).filter(
+                models.CachedVKUser.vk_id == bindparam("vk_id")
+            )
+        )
+        return query(session).params(vk_id=vk_id).one()
+
+    @staticmethod
+    def _get_cached_user_info(
+            session: Session, vk_id: int, name_case: GrammaticalCases
+            ) -> Optional[vk_related_classes.VKUserInfo]:
+        """
+        Returns:
+            user info or None, if there is no user or the name case of the
+            user in the database
+        """
+        try:
+            user_info = CachedVKUsersManager._get_user(session, vk_id)
+        except NoResultFound:
+            return None
+        try:
+            return user_info.get_as_vk_user_info_dataclass(name_case)
+        except exceptions.NameCaseNotFound:
+            return None
+
+    def _cache_user_info(
+            self, session: Session,
+            user_info_from_vk: vk_related_classes.VKUserInfo,
+            name_case: GrammaticalCases) -> None:
+        vk_id = user_info_from_vk.id
+        name = user_info_from_vk.name
+        surname = user_info_from_vk.surname
+        # The user is checked again, because other command could cache the
+        # same user, while this one was downloading it from VK (writes are
+        # made one after another, so the check can't be outdated here)
+        try:
+            user_info = self._get_user(session, vk_id)
+        except NoResultFound:
+            cached_vk_user = models.CachedVKUser(
+                vk_id=vk_id,
+                sex=user_info_from_vk.sex
+            )
+            cached_vk_user.names = [
+                models.UserNameAndSurname(
+                    case=name_case,
+                    name=name,
+                    surname=surname
                 )
-                vk_id = user_info_from_vk.id
-            else:
-                user_info_from_vk = None
-            try:
-                user_info: models.CachedVKUser = (
-                    self.db_session
-                    .query(models.CachedVKUser)
-                    .filter(models.CachedVKUser.vk_id == vk_id)
-                    .one()
+            ]
+            session.add(cached_vk_user)
+            if self.logger is not None:
+                self.logger.info(
+                    f"Info about VK user with VK ID {vk_id} and name and "
+                    f"surname in case {name_case} ({name} {surname}) added "
+                    f"to the database session"
                 )
-            except NoResultFound:
-                if user_info_from_vk is None:
-                    user_info_from_vk = await self.vk_worker.get_user_info(
-                        vk_id, name_case
-                    )
-                cached_vk_user = models.CachedVKUser(
-                    vk_id=user_info_from_vk.id,
-                    sex=user_info_from_vk.sex
+        else:
+            if any(name.case == name_case for name in user_info.names):
+                return
+            user_info.names.append(
+                models.UserNameAndSurname(
+                    user_vk_id=user_info.id,
+                    case=name_case,
+                    name=name,
+                    surname=surname
                 )
-                name = user_info_from_vk.name
-                surname = user_info_from_vk.surname
-                cached_vk_user.names = [
-                    models.UserNameAndSurname(
-                        case=name_case,
-                        name=name,
-                        surname=surname
-                    )
-                ]
-                self.db_session.add(cached_vk_user)
-                if self.logger is not None:
-                    self.logger.info(
-                        f"Info about VK user with VK ID {vk_id} and name and "
-                        f"surname in case {name_case} ({name} {surname}) added "
-                        f"to the database session"
-                    )
-                return user_info_from_vk
-            else:
-                try:
-                    return (
-                        user_info.get_as_vk_user_info_dataclass(name_case)
-                    )
-                except exceptions.NameCaseNotFound:
-                    user_info_from_vk = await self.vk_worker.get_user_info(
-                        vk_id, name_case
-                    )
-                    name = user_info_from_vk.name
-                    surname = user_info_from_vk.surname
-                    user_info.names.append(
-                        models.UserNameAndSurname(
-                            user_vk_id=user_info.id,
-                            case=name_case,
-                            name=name,
-                            surname=surname
-                        )
-                    )
-                    if self.logger is not None:
-                        self.logger.info(
-                            f"Name and surname of VK user with VK ID {vk_id} "
-                            f"in case {name_case} ({name} {surname}) added to "
-                            f"the database session"
-                        )
-                    return user_info_from_vk
-
-    def commit(self) -> None:
-        self.db_session.commit()
-
-    def flush(self) -> None:
-        self.db_session.flush()
-
-    def delete_user_info(self, *filters: Any) -> None:
+            )
+            if self.logger is not None:
+                self.logger.info(
+                    f"Name and surname of VK user with VK ID {vk_id} "
+                    f"in case {name_case} ({name} {surname}) added to "
+                    f"the database session"
+                )
+
+    async def commit(self) -> None:
+        await self.executor.commit()
+
+    async def delete_user_info(self, *filters: Any) -> None:
+        await self.executor.write(self._delete_user_info, filters)
+
+    @staticmethod
+    def _delete_user_info(session: Session, filters: tuple) -> None:
         instances = (
-            self.db_session
+            session
             .query(models.CachedVKUser)
             .filter(*filters)
             .all()
@@ -200,16 +1011,17 @@ class CachedVKUsersManager:
         if not instances:
             raise orm.exceptions.NoRowsFound()
         for instance in instances:
-            self.db_session.delete(instance)
+            session.delete(instance)
 
 
 class ManagersContainer:
     """
     A facade for the OrdersManager and CachedVKUsersManager.
 
-    It is needed because managers have one session, so I can check one session
-    for pending changes (otherwise, when I'm using two managers separately, I
-    can't know if their sessions is the same and this is quite bad).
+    It is needed because managers usually have one executor, so I can start
+    and commit one unit of work of the command (otherwise, when I'm using two
+    managers separately, I can't know if their executors is the same and this
+    is quite bad).
     """
 
     def __init__(
@@ -220,23 +1032,84 @@ class ManagersContainer:
         self.managers = (
             self.orders_manager, self.users_manager
         )
-        self.session_is_same_in_all_managers = all(
-            self.managers[i - 1].db_session is self.managers[i].db_session
-            for i in range(1, len(self.managers))
+        self.executors: List[DatabaseExecutor] = []
+        for manager in self.managers:
+            if all(
+                manager.executor is not executor for executor in self.executors
+            ):
+                self.executors.append(manager.executor)
+
+    @contextlib.asynccontextmanager
+    async def unit_of_work(self) -> AsyncIterator[None]:
+        """
+        Starts the units of work of the command in all executors (see
+        DatabaseExecutor.unit_of_work).
+        """
+        async with contextlib.AsyncExitStack() as units_of_work:
+            for executor in self.executors:
+                await units_of_work.enter_async_context(
+                    executor.unit_of_work()
+                )
+            yield
+
+    async def commit(self) -> None:
+        for executor in self.executors:
+            await executor.commit()
+
+    def get_slowest_statements(self) -> List[StatementStatistics]:
+        """
+        Returns:
+            statistics of the slowest shapes of the statements of all
+            executors (see orm/slow_statements.py), sorted from the slowest
+            run
+        """
+        statements: List[StatementStatistics] = []
+        slowest_statements_amount = 0
+        for executor in self.executors:
+            if executor.slow_statements_log is not None:
+                statements.extend(
+                    executor.slow_statements_log.get_slowest_statements()
+                )
+                slowest_statements_amount = max(
+                    slowest_statements_amount,
+                    executor.slow_statements_log.slowest_statements_amount
+                )
+        statements.sort(
+            key=lambda statement: statement.max_duration, reverse=True
         )
+        return statements[:slowest_statements_amount]
 
-    def commit(self) -> None:
-        if self.session_is_same_in_all_managers:
-            # Working with the db_session of the orders_manager because why not
-            self.orders_manager.commit()
-        else:
-            for manager in self.managers:
-                manager.commit()
 
-    def flush(self) -> None:
-        if self.session_is_same_in_all_managers:
-            # Working with the db_session of the orders_manager because why not
-            self.orders_manager.flush()
+async def archive_orders_periodically(
+        orders_manager: OrdersManager, db_config: DbConfig,
+        logger: Optional[logging.Logger] = None) -> NoReturn:
+    """
+    Archives the orders, which were closed long ago (see
+    OrdersManager.archive_closed_orders), every archiving interval of the
+    config, starting right away.
+    """
+    # Slow statements of the archiving are logged with this name (the task
+    # has its own context, so the commands aren't affected)
+    orm.slow_statements.CURRENT_COMMAND.set("archiving of the orders")
+    while True:
+        try:
+            archived_orders_amount = (
+                await orders_manager.archive_closed_orders(
+                    datetime.date.today() - datetime.timedelta(
+                        days=db_config.ARCHIVE_ORDERS_AFTER_DAYS
+                    ),
+                    db_config.ARCHIVING_BATCH_SIZE,
+                    db_config.VACUUM_BATCH_SIZE
+                )
+            )
+        except Exception:
+            # The orders, which weren't moved, are moved next time
+            if logger is not None:
+                logger.exception("Closed orders weren't archived")
         else:
-            for manager in self.managers:
-                manager.flush()
+            if logger is not None:
+                logger.info(
+                    f"{archived_orders_amount} closed orders are moved to "
+                    f"the archive"
+                )
+        await asyncio.sleep(db_config.ARCHIVING_INTERVAL)
@@ -0,0 +1,93 @@
+from dataclasses import dataclass
+from typing import List, TextIO
+
+from sqlalchemy.engine.url import make_url
+
+
+@dataclass
+class DbConfig:
+    URL: str
+    READERS_AMOUNT: int
+    POOL_SIZE: int
+    MAX_OVERFLOW: int
+    LOCKED_RETRIES_AMOUNT: int
+    LOCKED_RETRY_DELAY: float
+    GROUP_COMMIT_WINDOW: float
+    GROUP_COMMIT_MAX_SIZE: int
+    ARCHIVE_ORDERS_AFTER_DAYS: int
+    ARCHIVING_BATCH_SIZE: int
+    ARCHIVING_INTERVAL: float
+    VACUUM_BATCH_SIZE: int
+    SLOW_STATEMENT_THRESHOLD: float
+    SLOWEST_STATEMENTS_AMOUNT: int
+    SLOW_STATEMENTS_WINDOW: float
+    SQLITE_AUTO_VACUUM: str
+    SQLITE_JOURNAL_MODE: str
+    SQLITE_SYNCHRONOUS: str
+    SQLITE_MMAP_SIZE: int
+    SQLITE_CACHE_SIZE: int
+    SQLITE_BUSY_TIMEOUT: int
+    SQLITE_TEMP_STORE: str
+
+    @property
+    def sqlite_pragmas(self) -> List[str]:
+        """
+        Returns PRAGMA statements, which are executed on every new SQLite
+        connection.
+        """
+        return [
+            # Is changed only in the new databases (before the tables are
+            # created)
+            f"PRAGMA auto_vacuum = {self.SQLITE_AUTO_VACUUM}",
+            f"PRAGMA journal_mode = {self.SQLITE_JOURNAL_MODE}",
+            f"PRAGMA synchronous = {self.SQLITE_SYNCHRONOUS}",
+            f"PRAGMA mmap_size = {self.SQLITE_MMAP_SIZE}",
+            f"PRAGMA cache_size = {self.SQLITE_CACHE_SIZE}",
+            f"PRAGMA busy_timeout = {self.SQLITE_BUSY_TIMEOUT}",
+            f"PRAGMA temp_store = {self.SQLITE_TEMP_STORE}",
+        ]
+
+
+def make_db_config_from_files(files_with_config: List[TextIO]) -> DbConfig:
+    """
+    Reads the files like make_vk_config_from_files, values of the later files
+    replace the values of the earlier ones.
+
+    WARNING: All files will be read
+
+    Raises:
+        ValueError: if the URL is of the in-memory SQLite database
+    """
+    config_values = {}
+    for file in files_with_config:
+        for line in file:
+            if line.endswith("\n"):
+                line = line[:-1]
+            if line and line[0] != ";":  # Comments start with ; in .ini files
+                # URLs can have "=" in them, so only the first one divides
+                # the name and the value
+                divided_line = line.split("=", 1)  # "a = b" -> ["a ", " b"]
+                variable_name = divided_line[0].rstrip()  # "a " -> "a"
+                variable_value_as_str = divided_line[1].lstrip()  # " b" -> "b"
+                field_name = variable_name.upper()
+                config_values[field_name] = (
+                    # __annotations__ looks like {field_name: annotation_class}
+                    DbConfig.__annotations__[
+                        field_name
+                    ](variable_value_as_str)  # Calling class's constructor
+                )
+    db_config = DbConfig(**config_values)
+    url = make_url(db_config.URL)
+    # Every SQLite connection has its own in-memory database, so the tables,
+    # which are created by the migrations, wouldn't be seen by the threads
+    # of the DatabaseExecutor (and one shared connection would mix the
+    # transactions of the readers and the writer)
+    if (
+        url.get_backend_name() == "sqlite"
+        and url.database in (None, "", ":memory:")
+    ):
+        raise ValueError(
+            f"In-memory SQLite databases aren't supported (URL {url!r}), "
+            f"use a file, for example sqlite:///BAC_light.db"
+        )
+    return db_config
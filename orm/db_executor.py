@@ -0,0 +1,499 @@
+"""
+Runs the work with the database outside of the event loop.
+
+SQLAlchemy (and the drivers of the databases) are blocking, so a query, that
+runs in the event loop, stops the long poll and the sending of the messages in
+all chats. DatabaseExecutor runs every function, that works with the session,
+in a thread and the handlers await its result.
+
+Writes go to one writer thread (SQLite allows only one writer at a time
+anyway, so more writer threads would only wait for each other) and reads go to
+a small pool of reader threads, where every thread has its own session.
+Objects, which are returned from the threads, are detached from the sessions
+with all of their columns loaded, so they can be read in the event loop
+without the queries. Changes of the detached objects are saved by adding them
+to the session again (see OrdersManager.add).
+
+Every command has its own unit of work (see DatabaseExecutor.unit_of_work),
+so the commit or the rollback of one command doesn't touch the changes of the
+other commands. Units of work write one after another: the first write of the
+command waits for the write lock, which is released on its commit or
+rollback, while the commands, which only read, don't wait for anything. So
+the commands shouldn't wait for the network (like the VK API) after their
+first write, and the data, which is only cached, is written in its own unit
+of work (see DatabaseExecutor.write_and_commit).
+
+Commits are grouped: units of work of the commands, which are committed
+close to each other, are written in one transaction of the database (one
+fsync instead of one for every command). Every unit of work is a SAVEPOINT
+inside of that transaction, so the unit of work, which is rolled back,
+doesn't roll back the others, and committed unit of work waits until the
+whole group is committed (so the reply isn't sent before its changes are
+saved). The group is committed, when it has group_commit_max_size units of
+work or group_commit_window seconds after its first unit of work was
+committed: by the unit of work, which holds the write lock then (when it
+ends), or by the next one, which takes the lock, so the group doesn't wait
+for all units of work, which are queued for the lock. If the commit of the
+group fails, all of its units of work fail. Commits per second and sizes of
+the groups are counted in DatabaseExecutor.group_commit_metrics.
+
+Other processes (like the sqlite3 shell) can still hold the SQLite database,
+so the work is retried, if SQLite says "database is locked", but only where
+retrying can't repeat the changes: reads are run again and the transaction of
+the group begins with BEGIN IMMEDIATE, which takes the write lock of the
+database before anything is changed (so later statements of the group don't
+wait for the lock).
+"""
+import asyncio
+import contextlib
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, TypeVar, Any, Optional, AsyncIterator, Dict, List
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.orm.session import SessionTransaction
+
+from orm.slow_statements import SlowStatementsLog
+
+ResultType = TypeVar("ResultType")
+
+
+class UnitOfWork:
+    """
+    Changes of one command. They are made in the session of the current
+    group of commits (only in the writer thread) inside of the SAVEPOINT,
+    which is started on the first write.
+    """
+
+    def __init__(self):
+        self.session: Optional[Session] = None
+        self.savepoint: Optional[SessionTransaction] = None
+
+    @property
+    def is_writing(self) -> bool:
+        """
+        Has the unit of work the changes, which aren't committed or rolled
+        back yet (so it holds the write lock).
+        """
+        return self.savepoint is not None
+
+
+@dataclass
+class GroupCommitMetrics:
+    started_at: float = field(default_factory=time.monotonic)
+    # Commits of the database transactions
+    commits_amount: int = 0
+    committed_units_of_work_amount: int = 0
+    failed_commits_amount: int = 0
+    # Dict[amount of the units of work in the group, amount of such groups]
+    batch_sizes: Dict[int, int] = field(default_factory=dict)
+
+    def add_commit(self, batch_size: int) -> None:
+        self.commits_amount += 1
+        self.committed_units_of_work_amount += batch_size
+        try:
+            self.batch_sizes[batch_size] += 1
+        except KeyError:
+            self.batch_sizes[batch_size] = 1
+
+    @property
+    def commits_per_second(self) -> float:
+        return self.commits_amount / (time.monotonic() - self.started_at)
+
+    @property
+    def average_batch_size(self) -> float:
+        if self.commits_amount == 0:
+            return 0
+        return self.committed_units_of_work_amount / self.commits_amount
+
+    @property
+    def max_batch_size(self) -> int:
+        return max(self.batch_sizes, default=0)
+
+
+class DatabaseExecutor:
+
+    def __init__(
+            self, engine: Engine, readers_amount: int = 4,
+            locked_retries_amount: int = 5, locked_retry_delay: float = 0.05,
+            group_commit_window: float = 0.01,
+            group_commit_max_size: int = 50,
+            slow_statements_log: Optional[SlowStatementsLog] = None):
+        self.engine = engine
+        self.locked_retries_amount = locked_retries_amount
+        # In seconds, doubled after every retry
+        self.locked_retry_delay = locked_retry_delay
+        self._is_sqlite = engine.dialect.name == "sqlite"
+        # In seconds
+        self.group_commit_window = group_commit_window
+        self.group_commit_max_size = group_commit_max_size
+        self.group_commit_metrics = GroupCommitMetrics()
+        # Statistics of the statements of the engine (if they are timed, see
+        # orm.db_apis.log_slow_statements)
+        self.slow_statements_log = slow_statements_log
+        self._make_session = sessionmaker(bind=engine)
+        # Session of every reader thread
+        self._thread_data = threading.local()
+        # Is held by the unit of work, which is writing, and by the commit of
+        # the group
+        self._write_lock = asyncio.Lock()
+        # Session of the group, which isn't committed yet (its transaction is
+        # started by the first unit of work of the group)
+        self._group_session: Optional[Session] = None
+        # Are waited by the committed units of work of the group
+        self._group_commit_waiters: List[asyncio.Future] = []
+        # Time (of time.monotonic), when the window of the group is over
+        self._group_commit_deadline = 0.0
+        # Is kept, so the task of the waiting group isn't garbage collected
+        self._group_commit_task: Optional[asyncio.Task] = None
+        self._current_unit_of_work: (
+            "contextvars.ContextVar[Optional[UnitOfWork]]"
+        ) = contextvars.ContextVar(
+            f"current_unit_of_work_{id(self)}", default=None
+        )
+        self._writer = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="database_writer"
+        )
+        self._readers = ThreadPoolExecutor(
+            max_workers=readers_amount, thread_name_prefix="database_reader"
+        )
+
+    def _get_thread_session(self) -> Session:
+        try:
+            return self._thread_data.session
+        except AttributeError:
+            session = self._make_session()
+            self._thread_data.session = session
+            return session
+
+    async def _run_in_thread(
+            self, executor: ThreadPoolExecutor,
+            function: Callable[..., ResultType], *args: Any) -> ResultType:
+        # Context variables (like the command, which makes the queries) are
+        # copied to the thread, because run_in_executor doesn't do it
+        return await asyncio.get_running_loop().run_in_executor(
+            executor, functools.partial(
+                contextvars.copy_context().run, function, *args
+            )
+        )
+
+    def _retry_if_locked(
+            self, function: Callable[..., ResultType],
+            *args: Any) -> ResultType:
+        """
+        Runs the function (in the current thread) again, if it raised the
+        "database is locked" error, waiting more before every next try.
+        """
+        delay = self.locked_retry_delay
+        for _ in range(self.locked_retries_amount):
+            try:
+                return function(*args)
+            except OperationalError as error:
+                if "database is locked" not in str(error.orig):
+                    raise
+            time.sleep(delay)
+            delay *= 2
+        return function(*args)
+
+    def _read_once(
+            self, function: Callable[..., ResultType],
+            args: tuple) -> ResultType:
+        session = self._get_thread_session()
+        try:
+            return function(session, *args)
+        finally:
+            session.expunge_all()
+            # The transaction of the reader is ended, so it doesn't hold the
+            # snapshot of the database until the next read
+            session.rollback()
+
+    def _read(
+            self, function: Callable[..., ResultType],
+            *args: Any) -> ResultType:
+        return self._retry_if_locked(self._read_once, function, args)
+
+    def _begin_group(self) -> Session:
+        session = self._make_session()
+        if self._is_sqlite:
+            def begin_immediate() -> None:
+                try:
+                    session.execute("BEGIN IMMEDIATE")
+                except OperationalError:
+                    session.rollback()
+                    raise
+
+            try:
+                self._retry_if_locked(begin_immediate)
+            except Exception:
+                session.close()
+                raise
+        return session
+
+    def _begin_writing(self, unit_of_work: UnitOfWork) -> None:
+        if self._group_session is None:
+            self._group_session = self._begin_group()
+        unit_of_work.session = self._group_session
+        unit_of_work.savepoint = self._group_session.begin_nested()
+
+    def _end_writing_in_thread(
+            self, unit_of_work: UnitOfWork, commit: bool) -> None:
+        savepoint = unit_of_work.savepoint
+        if commit:
+            savepoint.commit()
+        elif savepoint.is_active:
+            savepoint.rollback()
+        else:
+            # The savepoint was already rolled back by the failed flush, it
+            # only needs to be closed
+            savepoint.close()
+        if not self._group_commit_waiters and not commit:
+            # Nothing to commit in the group, so its transaction doesn't hold
+            # the database
+            self._end_group_in_thread(commit=False)
+
+    def _end_group_in_thread(self, commit: bool) -> None:
+        session = self._group_session
+        self._group_session = None
+        try:
+            if commit:
+                session.commit()
+            else:
+                session.rollback()
+        finally:
+            session.close()
+
+    @staticmethod
+    def _write(
+            unit_of_work: UnitOfWork, function: Callable[..., ResultType],
+            *args: Any) -> ResultType:
+        session = unit_of_work.session
+        try:
+            result = function(session, *args)
+            # Pending objects would be lost when they are expunged
+            session.flush()
+            return result
+        finally:
+            session.expunge_all()
+
+    @staticmethod
+    def _read_written(
+            unit_of_work: UnitOfWork, function: Callable[..., ResultType],
+            *args: Any) -> ResultType:
+        try:
+            return function(unit_of_work.session, *args)
+        finally:
+            unit_of_work.session.expunge_all()
+
+    async def read(
+            self, function: Callable[..., ResultType],
+            *args: Any) -> ResultType:
+        """
+        Runs function(session, *args) in one of the reader threads. Readers
+        don't see the changes, which aren't committed yet, so if the unit of
+        work of the command is writing, the function is run in the writer
+        thread with its session (to see its changes).
+
+        Returns:
+            result of the function (objects are detached from the session)
+        """
+        unit_of_work = self._current_unit_of_work.get()
+        if unit_of_work is not None and unit_of_work.is_writing:
+            return await self._run_in_thread(
+                self._writer, self._read_written, unit_of_work, function,
+                *args
+            )
+        return await self._run_in_thread(
+            self._readers, self._read, function, *args
+        )
+
+    async def write(
+            self, function: Callable[..., ResultType],
+            *args: Any) -> ResultType:
+        """
+        Runs function(session, *args) in the writer thread with the session of
+        the current unit of work and flushes the changes. They are saved in
+        the database only on the commit. Without the unit of work, the
+        changes are committed right away.
+
+        Returns:
+            result of the function (objects are detached from the session)
+        """
+        unit_of_work = self._current_unit_of_work.get()
+        if unit_of_work is None:
+            return await self.write_and_commit(function, *args)
+        if not unit_of_work.is_writing:
+            await self._write_lock.acquire()
+            try:
+                # The window of the group could be over, while this unit of
+                # work waited for the lock
+                await self._commit_group_if_due()
+                await self._run_in_thread(
+                    self._writer, self._begin_writing, unit_of_work
+                )
+            except BaseException:
+                self._write_lock.release()
+                raise
+        return await self._run_in_thread(
+            self._writer, self._write, unit_of_work, function, *args
+        )
+
+    async def write_and_commit(
+            self, function: Callable[..., ResultType],
+            *args: Any) -> ResultType:
+        """
+        Runs function(session, *args) in the writer thread in its own unit of
+        work and commits it, so the unit of work of the command doesn't start
+        writing (and doesn't hold the write lock until its commit). If the
+        unit of work of the command is already writing, the changes are added
+        to it (its own unit of work would wait for the lock, which is held by
+        the command).
+
+        Returns:
+            result of the function (objects are detached from the session)
+        """
+        unit_of_work = self._current_unit_of_work.get()
+        if unit_of_work is not None and unit_of_work.is_writing:
+            return await self.write(function, *args)
+        async with self.unit_of_work():
+            result = await self.write(function, *args)
+            await self.commit()
+            return result
+
+    async def _end_writing(self, commit: bool) -> Optional[asyncio.Future]:
+        """
+        Returns:
+            future, which is done, when the group with the committed unit of
+            work is committed (None if the unit of work is rolled back or has
+            nothing to commit)
+        """
+        unit_of_work = self._current_unit_of_work.get()
+        if unit_of_work is None or not unit_of_work.is_writing:
+            return None
+        group_commit_waiter = None
+        try:
+            try:
+                await self._run_in_thread(
+                    self._writer, self._end_writing_in_thread, unit_of_work,
+                    commit
+                )
+            except BaseException:
+                if commit:
+                    # The savepoint can't be released, so it is rolled back
+                    await self._run_in_thread(
+                        self._writer, self._end_writing_in_thread,
+                        unit_of_work, False
+                    )
+                raise
+            if commit:
+                group_commit_waiter = (
+                    asyncio.get_running_loop().create_future()
+                )
+                self._group_commit_waiters.append(group_commit_waiter)
+                if len(self._group_commit_waiters) == 1:
+                    self._group_commit_deadline = (
+                        time.monotonic() + self.group_commit_window
+                    )
+                    self._group_commit_task = asyncio.create_task(
+                        self._commit_group_later(self._group_commit_waiters)
+                    )
+            await self._commit_group_if_due()
+        finally:
+            unit_of_work.session = None
+            unit_of_work.savepoint = None
+            self._write_lock.release()
+        return group_commit_waiter
+
+    async def _commit_group_later(
+            self, group_commit_waiters: List[asyncio.Future]) -> None:
+        await asyncio.sleep(self.group_commit_window)
+        # If the lock is held, the group is committed by the unit of work,
+        # which holds it (or by the next one), before this task gets the lock
+        async with self._write_lock:
+            if self._group_commit_waiters is group_commit_waiters:
+                await self._commit_group()
+
+    async def _commit_group_if_due(self) -> None:
+        """
+        Commits the group, if it is full or its window is over (the write
+        lock should be held and no unit of work should be writing).
+        """
+        if self._group_commit_waiters and (
+            len(self._group_commit_waiters) >= self.group_commit_max_size
+            or time.monotonic() >= self._group_commit_deadline
+        ):
+            await self._commit_group()
+
+    async def _commit_group(self) -> None:
+        """
+        Commits the group of the units of work (the write lock should be
+        held). Errors of the commit are given to the units of work of the
+        group.
+        """
+        self._group_commit_task = None
+        waiters = self._group_commit_waiters
+        self._group_commit_waiters = []
+        if not waiters:
+            return
+        try:
+            await self._run_in_thread(
+                self._writer, self._end_group_in_thread, True
+            )
+        except Exception as error:
+            self.group_commit_metrics.failed_commits_amount += 1
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(error)
+        else:
+            self.group_commit_metrics.add_commit(len(waiters))
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+
+    async def commit(self) -> None:
+        """
+        Commits the changes of the current unit of work and waits until they
+        are saved in the database with the changes of its group.
+        """
+        group_commit_waiter = await self._end_writing(commit=True)
+        if group_commit_waiter is not None:
+            await group_commit_waiter
+
+    async def rollback(self) -> None:
+        """
+        Rolls back the changes of the current unit of work.
+        """
+        await self._end_writing(commit=False)
+
+    @contextlib.asynccontextmanager
+    async def unit_of_work(self) -> AsyncIterator[UnitOfWork]:
+        """
+        Makes the unit of work, which is used by the writes and the reads
+        inside of the "async with" block (and in the tasks, which are started
+        there). Changes, which aren't committed at the end of the block, are
+        rolled back.
+        """
+        unit_of_work = UnitOfWork()
+        token = self._current_unit_of_work.set(unit_of_work)
+        try:
+            yield unit_of_work
+        finally:
+            try:
+                await self.rollback()
+            finally:
+                self._current_unit_of_work.reset(token)
+
+    async def shutdown(self) -> None:
+        """
+        Commits the group, which is waiting for the commit, waits until all
+        started functions are done and stops the threads.
+        """
+        async with self._write_lock:
+            await self._commit_group()
+        self._writer.shutdown()
+        self._readers.shutdown()
@@ -0,0 +1,13 @@
+from enum import Enum, auto
+
+
+class OrderStatuses(Enum):
+    PENDING = auto()
+    TAKEN = auto()
+    CANCELED = auto()
+    PAID = auto()
+
+
+class EarningsGroupings(Enum):
+    EMPLOYEES = auto()  # By the takers of the orders
+    CLIENTS = auto()  # By the creators of the orders
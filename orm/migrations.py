@@ -0,0 +1,358 @@
+"""
+Versioned migrations of the existing databases.
+
+create_all creates only the missing tables and never changes the existing
+ones, so changes of the existing tables (like new indexes) are made here.
+Every migration has a number and the number of the last applied migration is
+stored in the schema_version table, so every migration is applied once. New
+databases are created from the models right away, so they get the last
+version without applying the migrations.
+"""
+import logging
+from dataclasses import dataclass
+from typing import Callable, Iterable, Optional, Tuple
+
+from sqlalchemy import (
+    Table, inspect, case, extract, func, select, MetaData, Column, Integer,
+    String, Date, Index
+)
+from sqlalchemy.engine import Connection, Engine
+
+# search is imported for its listener, which makes the search index, when
+# create_all creates the tables of the new databases
+from orm import models, search
+from orm.enums import OrderStatuses
+
+
+@dataclass
+class Migration:
+    version: int
+    description: str
+    apply: Callable[[Connection], None]
+
+
+def create_missing_indexes(
+        connection: Connection, table: Table,
+        index_names: Iterable[str]) -> None:
+    """
+    Creates the indexes of the table, which aren't in the database yet.
+
+    Args:
+        connection: connection to the database
+        table:
+            table with the indexes (it should be described in the migration
+            as it is at the time of the migration, because the models change)
+        index_names: names of the indexes, which should be created
+
+    Raises:
+        ValueError: if the table has no index with one of the names
+    """
+    indexes = {index.name: index for index in table.indexes}
+    unknown_index_names = set(index_names).difference(indexes)
+    if unknown_index_names:
+        raise ValueError(
+            f"Table {table.name} has no indexes "
+            f"{', '.join(sorted(unknown_index_names))}"
+        )
+    existing_index_names = {
+        index["name"] for index in inspect(connection).get_indexes(table.name)
+    }
+    for index_name in index_names:
+        if index_name not in existing_index_names:
+            indexes[index_name].create(connection)
+
+
+def _add_orders_listing_indexes(connection: Connection) -> None:
+    # Orders with the columns and the indexes of this migration
+    orders_table = Table(
+        "orders", MetaData(),
+        Column("id", Integer, primary_key=True),
+        Column("creator_vk_id", Integer),
+        Column("taker_vk_id", Integer),
+        Column("canceler_vk_id", Integer),
+        Column("earnings", Integer),
+        Column("earning_date", Date)
+    )
+    Index(
+        "ix_orders_creator_vk_id_id",
+        orders_table.c.creator_vk_id, orders_table.c.id.desc()
+    )
+    Index(
+        "ix_orders_taker_vk_id_id",
+        orders_table.c.taker_vk_id, orders_table.c.id.desc()
+    )
+    Index(
+        "ix_orders_canceler_vk_id_id",
+        orders_table.c.canceler_vk_id, orders_table.c.id.desc()
+    )
+    Index(
+        "ix_orders_earnings_id",
+        orders_table.c.earnings, orders_table.c.id.desc()
+    )
+    Index("ix_orders_earning_date", orders_table.c.earning_date)
+    create_missing_indexes(
+        connection, orders_table, (
+            "ix_orders_creator_vk_id_id", "ix_orders_taker_vk_id_id",
+            "ix_orders_canceler_vk_id_id", "ix_orders_earnings_id",
+            "ix_orders_earning_date"
+        )
+    )
+
+
+def _add_orders_status(connection: Connection) -> None:
+    """
+    Adds the status column, fills it from the columns, on which the status
+    depends, and replaces the indexes of those columns with the indexes of
+    the status.
+    """
+    # Orders with the columns and the indexes of this migration
+    orders_table = Table(
+        "orders", MetaData(),
+        Column("id", Integer, primary_key=True),
+        Column("creator_vk_id", Integer),
+        Column("taker_vk_id", Integer),
+        Column("canceler_vk_id", Integer),
+        Column("earnings", Integer),
+        Column("status", String(8))
+    )
+    Index(
+        "ix_orders_status_id",
+        orders_table.c.status, orders_table.c.id.desc()
+    )
+    Index(
+        "ix_orders_creator_vk_id_status_id",
+        orders_table.c.creator_vk_id, orders_table.c.status,
+        orders_table.c.id.desc()
+    )
+    connection.execute(
+        f"ALTER TABLE {orders_table.name} ADD COLUMN status VARCHAR(8) "
+        f"NOT NULL DEFAULT '{OrderStatuses.PENDING.name}'"
+    )
+    connection.execute(
+        orders_table.update().values(status=case(
+            [
+                # Paid orders can't be canceled, but canceled orders can be
+                # taken, so the cancellation is checked first
+                (
+                    orders_table.c.canceler_vk_id.isnot(None),
+                    OrderStatuses.CANCELED.name
+                ),
+                (orders_table.c.earnings.isnot(None), OrderStatuses.PAID.name),
+                (
+                    orders_table.c.taker_vk_id.isnot(None),
+                    OrderStatuses.TAKEN.name
+                ),
+            ],
+            else_=OrderStatuses.PENDING.name
+        ))
+    )
+    for index_name in (
+        "ix_orders_taker_vk_id_id", "ix_orders_canceler_vk_id_id",
+        "ix_orders_earnings_id"
+    ):
+        connection.execute(f"DROP INDEX IF EXISTS {index_name}")
+    create_missing_indexes(
+        connection, orders_table,
+        ("ix_orders_status_id", "ix_orders_creator_vk_id_status_id")
+    )
+
+
+def _fill_monthly_earnings(connection: Connection) -> None:
+    """
+    Sums up the earnings of the orders, which were paid before the monthly
+    earnings were added (the table itself is already created by create_all).
+    """
+    # Tables with the columns of this migration
+    orders_table = Table(
+        "orders", MetaData(),
+        Column("id", Integer, primary_key=True),
+        Column("taker_vk_id", Integer),
+        Column("earnings", Integer),
+        Column("earning_date", Date),
+        Column("status", String(8))
+    )
+    monthly_earnings_table = Table(
+        "monthly_earnings", MetaData(),
+        Column("year", Integer, primary_key=True),
+        Column("month", Integer, primary_key=True),
+        Column("employee_vk_id", Integer, primary_key=True),
+        Column("earnings", Integer, nullable=False),
+        Column("paid_orders_amount", Integer, nullable=False)
+    )
+    year = extract("year", orders_table.c.earning_date)
+    month = extract("month", orders_table.c.earning_date)
+    connection.execute(
+        monthly_earnings_table.insert().from_select(
+            (
+                "year", "month", "employee_vk_id", "earnings",
+                "paid_orders_amount"
+            ),
+            select([
+                year, month, orders_table.c.taker_vk_id,
+                func.sum(orders_table.c.earnings), func.count()
+            ])
+            .where(orders_table.c.status == OrderStatuses.PAID.name)
+            .group_by(year, month, orders_table.c.taker_vk_id)
+        )
+    )
+
+
+def _add_orders_search(connection: Connection) -> None:
+    """
+    Creates the search index of the orders (see orm/search.py) and fills it
+    with the existing orders.
+    """
+    dialect_name = connection.dialect.name
+    if dialect_name == "sqlite":
+        for statement in (
+            "CREATE VIRTUAL TABLE IF NOT EXISTS orders_search USING fts5("
+            "text, cancellation_reason, content='orders', content_rowid='id')",
+            "CREATE TRIGGER IF NOT EXISTS orders_search_after_insert "
+            "AFTER INSERT ON orders BEGIN "
+            "INSERT INTO orders_search(rowid, text, cancellation_reason) "
+            "VALUES (new.id, new.text, new.cancellation_reason); "
+            "END",
+            "CREATE TRIGGER IF NOT EXISTS orders_search_after_delete "
+            "AFTER DELETE ON orders BEGIN "
+            "INSERT INTO orders_search("
+            "orders_search, rowid, text, cancellation_reason"
+            ") VALUES ('delete', old.id, old.text, old.cancellation_reason); "
+            "END",
+            "CREATE TRIGGER IF NOT EXISTS orders_search_after_update "
+            "AFTER UPDATE OF text, cancellation_reason ON orders BEGIN "
+            "INSERT INTO orders_search("
+            "orders_search, rowid, text, cancellation_reason"
+            ") VALUES ('delete', old.id, old.text, old.cancellation_reason); "
+            "INSERT INTO orders_search(rowid, text, cancellation_reason) "
+            "VALUES (new.id, new.text, new.cancellation_reason); "
+            "END",
+            "INSERT INTO orders_search(orders_search) VALUES ('rebuild')",
+        ):
+            connection.execute(statement)
+    elif dialect_name == "postgresql":
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS ix_orders_search ON orders "
+            "USING GIN (to_tsvector('russian', "
+            "text || ' ' || coalesce(cancellation_reason, '')))"
+        )
+
+
+def _add_orders_archive(connection: Connection) -> None:
+    """
+    Adds the closing dates of the orders and makes the search index keep the
+    archived orders (the table of them is already created by create_all).
+    Paid orders were closed on their earning dates, but the dates of the
+    cancellations weren't stored, so the canceled orders are left without
+    them (and they are archived on the first archiving).
+    """
+    # Orders with the columns of this migration
+    orders_table = Table(
+        "orders", MetaData(),
+        Column("id", Integer, primary_key=True),
+        Column("status", String(8)),
+        Column("earning_date", Date),
+        Column("closing_date", Date)
+    )
+    connection.execute(
+        f"ALTER TABLE {orders_table.name} ADD COLUMN closing_date DATE"
+    )
+    connection.execute(
+        orders_table.update()
+        .where(orders_table.c.status == OrderStatuses.PAID.name)
+        .values(closing_date=orders_table.c.earning_date)
+    )
+    # There are no archived orders yet, so the index has everything and
+    # isn't filled again
+    dialect_name = connection.dialect.name
+    if dialect_name == "sqlite":
+        for statement in (
+            # The trigger is made again with the condition, so the archived
+            # orders are left in the index
+            "DROP TRIGGER IF EXISTS orders_search_after_delete",
+            "CREATE TRIGGER orders_search_after_delete "
+            "AFTER DELETE ON orders WHEN NOT EXISTS ("
+            "SELECT 1 FROM archived_orders WHERE id = old.id"
+            ") BEGIN "
+            "INSERT INTO orders_search("
+            "orders_search, rowid, text, cancellation_reason"
+            ") VALUES ('delete', old.id, old.text, old.cancellation_reason); "
+            "END",
+            "CREATE TRIGGER IF NOT EXISTS archived_orders_search_after_delete "
+            "AFTER DELETE ON archived_orders BEGIN "
+            "INSERT INTO orders_search("
+            "orders_search, rowid, text, cancellation_reason"
+            ") VALUES ('delete', old.id, old.text, old.cancellation_reason); "
+            "END",
+        ):
+            connection.execute(statement)
+    elif dialect_name == "postgresql":
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS ix_archived_orders_search "
+            "ON archived_orders USING GIN (to_tsvector('russian', "
+            "text || ' ' || coalesce(cancellation_reason, '')))"
+        )
+
+
+# In the order of the versions; migrations shouldn't be changed after they are
+# released, the new ones should be added instead
+MIGRATIONS: Tuple[Migration, ...] = (
+    Migration(
+        1, "indexes for the listings of the orders",
+        _add_orders_listing_indexes
+    ),
+    Migration(2, "status of the orders", _add_orders_status),
+    Migration(
+        3, "earnings of the employees by the months", _fill_monthly_earnings
+    ),
+    Migration(4, "search of the orders", _add_orders_search),
+    Migration(5, "archive of the orders", _add_orders_archive),
+)
+
+
+def get_latest_version() -> int:
+    return MIGRATIONS[-1].version if MIGRATIONS else 0
+
+
+def migrate(engine: Engine, logger: Optional[logging.Logger] = None) -> int:
+    """
+    Creates the missing tables and applies the migrations, which weren't
+    applied to the database yet (every one in its own transaction).
+
+    Args:
+        engine: engine of the database
+        logger: logger for the applied migrations
+
+    Returns:
+        version of the database after the migrations
+    """
+    schema_version_table = models.SchemaVersion.__table__
+    # Databases, which were made before the migrations, have the orders, but
+    # don't have the version
+    database_is_new = not engine.dialect.has_table(
+        engine, models.Order.__tablename__
+    )
+    models.DeclarativeBase.metadata.create_all(engine)
+    with engine.begin() as connection:
+        current_version = connection.execute(
+            schema_version_table.select()
+        ).scalar()
+        if current_version is None:
+            current_version = get_latest_version() if database_is_new else 0
+            connection.execute(
+                schema_version_table.insert().values(version=current_version)
+            )
+    for migration in MIGRATIONS:
+        if migration.version <= current_version:
+            continue
+        with engine.begin() as connection:
+            migration.apply(connection)
+            connection.execute(
+                schema_version_table.update().values(version=migration.version)
+            )
+        current_version = migration.version
+        if logger is not None:
+            logger.info(
+                f"Применена миграция базы данных номер {migration.version} "
+                f"({migration.description})"
+            )
+    return current_version
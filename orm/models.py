@@ -1,13 +1,17 @@
-from typing import List
+import datetime
+from typing import List, Dict, Any
 
-from sqlalchemy import Column, Integer, String, ForeignKey, Enum, Date
+from sqlalchemy import (
+    Column, Integer, String, ForeignKey, Enum, Date, Index, Table
+)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, aliased
 
 import exceptions
 import vk.vk_related_classes
 from enums import GrammaticalCases
+from orm.enums import OrderStatuses
 from vk.enums import Sex
 
 DeclarativeBase = declarative_base()
@@ -35,8 +39,94 @@ class Order(DeclarativeBase):
     earnings = Column(Integer)
     earning_date = Column(Date)
 
+    # Date of the cancellation or the payment. Orders, which were closed
+    # long ago, are moved to the archive (see orm/archive.py)
+    closing_date = Column(Date)
+
+    # Is changed only with the changes of the taking, cancellation and
+    # payment (see get_taking_changes and others below), so it always agrees
+    # with the columns above. It is stored (and not computed from them), so
+    # the state of the order is checked with one indexed column
+    status = Column(
+        Enum(OrderStatuses, native_enum=False), nullable=False,
+        default=OrderStatuses.PENDING,
+        server_default=OrderStatuses.PENDING.name
+    )
+
+    # Orders are always listed from the newest ones (see
+    # OrdersManager._get_query), so "id DESC" is in the indexes, and the
+    # listings are taken from the index without sorting. If you change the
+    # indexes here, add a migration for the existing databases to
+    # orm/migrations.py
+    __table_args__ = (
+        # Orders of the client
+        Index("ix_orders_creator_vk_id_id", creator_vk_id, id.desc()),
+        # Orders with the status
+        Index("ix_orders_status_id", status, id.desc()),
+        # Orders of the client with the status
+        Index(
+            "ix_orders_creator_vk_id_status_id",
+            creator_vk_id, status, id.desc()
+        ),
+        # Monthly reports
+        Index("ix_orders_earning_date", earning_date),
+    )
+
+    def __init__(self, **kwargs):
+        # Column default is set only on the flush, but the status can be
+        # checked before it
+        kwargs.setdefault("status", OrderStatuses.PENDING)
+        super().__init__(**kwargs)
+
+    # Changes are given as Dict[attribute name, value], because they are set
+    # with one UPDATE of all orders, which are changed (see
+    # OrdersManager.take_orders and others)
+
+    @staticmethod
+    def get_taking_changes(taker_vk_id: int) -> Dict[str, Any]:
+        return {"taker_vk_id": taker_vk_id, "status": OrderStatuses.TAKEN}
+
+    @staticmethod
+    def get_cancellation_changes(
+            canceler_vk_id: int, cancellation_reason: str) -> Dict[str, Any]:
+        return {
+            "canceler_vk_id": canceler_vk_id,
+            "cancellation_reason": cancellation_reason,
+            "status": OrderStatuses.CANCELED,
+            "closing_date": datetime.date.today()
+        }
+
+    @staticmethod
+    def get_payment_changes(
+            earnings: int, earning_date: datetime.date) -> Dict[str, Any]:
+        return {
+            "earnings": earnings,
+            "earning_date": earning_date,
+            "status": OrderStatuses.PAID,
+            "closing_date": datetime.date.today()
+        }
+
+    @hybrid_property
+    def is_pending(self) -> bool:
+        return self.status == OrderStatuses.PENDING
+
+    @hybrid_property
+    def is_active(self) -> bool:
+        """
+        Is the order not canceled and not paid yet.
+        """
+        return self.status in (OrderStatuses.PENDING, OrderStatuses.TAKEN)
+
+    @is_active.expression
+    def is_active(cls):
+        return cls.status.in_((OrderStatuses.PENDING, OrderStatuses.TAKEN))
+
     @hybrid_property
     def is_taken(self) -> bool:
+        """
+        Was the order taken (it stays taken after the payment and the
+        cancellation, so the taker is checked instead of the status).
+        """
         return self.taker_vk_id is not None
 
     @is_taken.expression
@@ -45,19 +135,11 @@ class Order(DeclarativeBase):
 
     @hybrid_property
     def is_canceled(self) -> bool:
-        return self.canceler_vk_id is not None
-
-    @is_canceled.expression
-    def is_canceled(cls):
-        return cls.canceler_vk_id.isnot(None)
+        return self.status == OrderStatuses.CANCELED
 
     @hybrid_property
     def is_paid(self) -> bool:
-        return self.earnings is not None
-
-    @is_paid.expression
-    def is_paid(cls):
-        return cls.earnings.isnot(None)
+        return self.status == OrderStatuses.PAID
 
     @hybrid_property
     def is_requested_offline(self) -> bool:
@@ -68,6 +150,36 @@ class Order(DeclarativeBase):
         return cls.real_creator_vk_id.isnot(None)
 
 
+# Paid and canceled orders, which were closed long ago (see orm/archive.py).
+# The table has the same columns as the orders, so its rows are loaded as the
+# orders (with ArchivedOrder) and the IDs of the orders are kept. Its indexes
+# are the indexes of the orders, because the same listings go through it
+archived_orders_table = Table(
+    "archived_orders", DeclarativeBase.metadata,
+    *(column.copy() for column in Order.__table__.columns)
+)
+Index(
+    "ix_archived_orders_creator_vk_id_id",
+    archived_orders_table.c.creator_vk_id, archived_orders_table.c.id.desc()
+)
+Index(
+    "ix_archived_orders_status_id",
+    archived_orders_table.c.status, archived_orders_table.c.id.desc()
+)
+Index(
+    "ix_archived_orders_creator_vk_id_status_id",
+    archived_orders_table.c.creator_vk_id, archived_orders_table.c.status,
+    archived_orders_table.c.id.desc()
+)
+Index(
+    "ix_archived_orders_earning_date", archived_orders_table.c.earning_date
+)
+
+# Filters of the orders should be adapted to it with
+# orm.archive.adapt_to_archive
+ArchivedOrder = aliased(Order, archived_orders_table, adapt_on_names=True)
+
+
 class UserNameAndSurname(DeclarativeBase):
     __tablename__ = "names_and_surnames"
 
@@ -113,3 +225,29 @@ class CachedVKUser(DeclarativeBase):
         return vk.vk_related_classes.VKUserInfo(
             self.vk_id, name.name, name.surname, self.sex
         )
+
+
+class MonthlyEarnings(DeclarativeBase):
+    """
+    Earnings of the employee for the month, which are summed up when the
+    orders are marked as paid (see OrdersManager.add_monthly_earnings), so
+    the monthly reports don't go through the orders.
+    """
+    __tablename__ = "monthly_earnings"
+
+    year = Column(Integer, primary_key=True)
+    month = Column(Integer, primary_key=True)
+    employee_vk_id = Column(Integer, primary_key=True)
+
+    earnings = Column(Integer, nullable=False)
+    paid_orders_amount = Column(Integer, nullable=False)
+
+
+class SchemaVersion(DeclarativeBase):
+    """
+    Has one row with the number of the last migration, which was applied to
+    the database (see orm/migrations.py).
+    """
+    __tablename__ = "schema_version"
+
+    version = Column(Integer, primary_key=True)
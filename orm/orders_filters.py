@@ -0,0 +1,72 @@
+"""
+Filters of the orders for the listings and the search of the OrdersManager.
+
+Conditions of the filters are made once, when this module is imported, and
+the values are given to them with the bound parameters, so the queries with
+the same filters have the same conditions, and the OrdersManager builds and
+compiles them once (see OrdersManager._bake_query). New filters should
+be made here the same way.
+"""
+import datetime
+from dataclasses import dataclass, field
+from typing import Dict, Any
+
+from sqlalchemy import bindparam, and_
+from sqlalchemy.sql import ClauseElement
+
+from orm import models
+from orm.enums import OrderStatuses
+
+
+# Conditions are compared by identity (their == makes SQL), so they aren't
+# compared by the dataclass
+@dataclass(eq=False)
+class OrdersFilter:
+    condition: ClauseElement
+    # Dict[name of the bound parameter of the condition, value]
+    parameters: Dict[str, Any] = field(default_factory=dict)
+
+
+PENDING = OrdersFilter(models.Order.is_pending)
+TAKEN = OrdersFilter(models.Order.status == OrderStatuses.TAKEN)
+ACTIVE = OrdersFilter(models.Order.is_active)
+CANCELED = OrdersFilter(models.Order.is_canceled)
+PAID = OrdersFilter(models.Order.is_paid)
+
+_CREATED_BY_CONDITION = (
+    models.Order.creator_vk_id == bindparam("creator_vk_id")
+)
+_ID_BEFORE_CONDITION = models.Order.id < bindparam("before_id")
+_ID_AFTER_CONDITION = models.Order.id > bindparam("after_id")
+_EARNED_BETWEEN_CONDITION = and_(
+    models.Order.earning_date >= bindparam("earnings_start_date"),
+    models.Order.earning_date < bindparam("earnings_end_date")
+)
+
+
+def created_by(creator_vk_id: int) -> OrdersFilter:
+    return OrdersFilter(
+        _CREATED_BY_CONDITION, {"creator_vk_id": creator_vk_id}
+    )
+
+
+def with_id_before(order_id: int) -> OrdersFilter:
+    return OrdersFilter(_ID_BEFORE_CONDITION, {"before_id": order_id})
+
+
+def with_id_after(order_id: int) -> OrdersFilter:
+    return OrdersFilter(_ID_AFTER_CONDITION, {"after_id": order_id})
+
+
+def earned_between(
+        start_date: datetime.date, end_date: datetime.date) -> OrdersFilter:
+    """
+    Leaves the orders, which were paid from the start date and before the end
+    date (only paid orders have the earning date).
+    """
+    return OrdersFilter(
+        _EARNED_BETWEEN_CONDITION, {
+            "earnings_start_date": start_date,
+            "earnings_end_date": end_date
+        }
+    )
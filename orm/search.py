@@ -0,0 +1,260 @@
+"""
+Full-text search of the orders by their texts and cancellation reasons.
+
+SQLite has the FTS5 table orders_search with the texts and the reasons of the
+orders. It keeps only the index (the texts are read from the orders, its
+rowid is the ID of the order) and the triggers on the orders keep it up to
+date, so the code, which changes the orders, doesn't know about it. Orders,
+which are moved to the archive (see orm/archive.py), stay in the index, so
+the archived orders are found by the same index.
+PostgreSQL has the GIN indexes of the tsvector of the same columns instead.
+Other databases have no index, the orders are searched there with LIKE.
+
+The index is made by create_all for the new databases (see
+create_search_index) and by the migrations for the existing ones (see
+orm/migrations.py, they have the statements of their versions).
+"""
+from typing import Any, Tuple, List, Optional
+
+from sqlalchemy import (
+    event, literal_column, func, or_, and_, column, table, select, Table,
+    MetaData
+)
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Query, Session
+from sqlalchemy.sql import ClauseElement
+
+import orm.archive
+from orm import models
+
+SQLITE_SEARCH_TABLE = table("orders_search", column("rowid"), column("rank"))
+
+# Relevance of every found order is computed, so the words, which are in most
+# of the orders, are searched for too long. Only this amount of the newest
+# found orders is sorted by the relevance in such searches (see
+# search_in_sqlite)
+RANKED_MATCHES_LIMIT = 1000
+
+SQLITE_DDL: Tuple[str, ...] = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS orders_search USING fts5("
+    "text, cancellation_reason, content='orders', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS orders_search_after_insert "
+    "AFTER INSERT ON orders BEGIN "
+    "INSERT INTO orders_search(rowid, text, cancellation_reason) "
+    "VALUES (new.id, new.text, new.cancellation_reason); "
+    "END",
+    # Archived orders are copied to the archive before they are deleted from
+    # the orders, so they are left in the index
+    "CREATE TRIGGER IF NOT EXISTS orders_search_after_delete "
+    "AFTER DELETE ON orders WHEN NOT EXISTS ("
+    "SELECT 1 FROM archived_orders WHERE id = old.id"
+    ") BEGIN "
+    "INSERT INTO orders_search("
+    "orders_search, rowid, text, cancellation_reason"
+    ") VALUES ('delete', old.id, old.text, old.cancellation_reason); "
+    "END",
+    # Taking and payment don't change the searched columns, so they don't
+    # touch the index
+    "CREATE TRIGGER IF NOT EXISTS orders_search_after_update "
+    "AFTER UPDATE OF text, cancellation_reason ON orders BEGIN "
+    "INSERT INTO orders_search("
+    "orders_search, rowid, text, cancellation_reason"
+    ") VALUES ('delete', old.id, old.text, old.cancellation_reason); "
+    "INSERT INTO orders_search(rowid, text, cancellation_reason) "
+    "VALUES (new.id, new.text, new.cancellation_reason); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS archived_orders_search_after_delete "
+    "AFTER DELETE ON archived_orders BEGIN "
+    "INSERT INTO orders_search("
+    "orders_search, rowid, text, cancellation_reason"
+    ") VALUES ('delete', old.id, old.text, old.cancellation_reason); "
+    "END",
+)
+
+# The query should have the same expression, so the index is used
+POSTGRESQL_SEARCH_VECTOR = (
+    "to_tsvector('russian', "
+    "text || ' ' || coalesce(cancellation_reason, ''))"
+)
+
+POSTGRESQL_DDL: Tuple[str, ...] = (
+    f"CREATE INDEX IF NOT EXISTS ix_orders_search ON orders "
+    f"USING GIN ({POSTGRESQL_SEARCH_VECTOR})",
+    f"CREATE INDEX IF NOT EXISTS ix_archived_orders_search ON archived_orders "
+    f"USING GIN ({POSTGRESQL_SEARCH_VECTOR})",
+)
+
+
+def create_search_index(connection: Connection) -> None:
+    """
+    Creates the search index of the orders (if it isn't created yet) and
+    fills it with the existing orders (it is filled from the orders only, so
+    it shouldn't be done, when there are archived orders).
+    """
+    dialect_name = connection.dialect.name
+    if dialect_name == "sqlite":
+        for statement in SQLITE_DDL:
+            connection.execute(statement)
+        connection.execute(
+            "INSERT INTO orders_search(orders_search) VALUES ('rebuild')"
+        )
+    elif dialect_name == "postgresql":
+        for statement in POSTGRESQL_DDL:
+            connection.execute(statement)
+
+
+# noinspection PyUnusedLocal
+# because target and kwargs are needed for the signature of the event
+@event.listens_for(models.DeclarativeBase.metadata, "after_create")
+def _create_search_index_with_orders(
+        target: MetaData, connection: Connection, tables: List[Table],
+        **kwargs: Any) -> None:
+    # The triggers are made on both the orders and the archived orders, so
+    # the index is made after all tables are created
+    if models.Order.__table__ in tables:
+        create_search_index(connection)
+
+
+def get_search_words(search_text: str) -> List[str]:
+    """
+    Returns words of the search text, which have letters or digits (other
+    words can't be found, because only letters and digits are indexed).
+    """
+    return [
+        word for word in search_text.split()
+        if any(symbol.isalnum() for symbol in word)
+    ]
+
+
+def make_fts5_query(search_text: str) -> str:
+    """
+    Makes the FTS5 query, which finds the texts with all words of the search
+    text (or with the words, which begin with them). Every word is quoted, so
+    the symbols of the FTS5 syntax in the search text are searched as they
+    are.
+    """
+    return " AND ".join(
+        '"{}"*'.format(word.replace('"', '""'))
+        for word in get_search_words(search_text)
+    )
+
+
+def search_in_sqlite(
+        session: Session, search_text: str,
+        conditions: Tuple[ClauseElement, ...],
+        ranked_matches_limit: Optional[int] = None) -> Query:
+    """
+    Returns the query of the orders and the archived orders, which are found
+    by the search text and pass the conditions, sorted from the most relevant
+    ones (orders with the same relevance are sorted by ID in descending
+    order). The index has both of them, so they are found with one pass over
+    it. The search text should have search words (see get_search_words).
+
+    Args:
+        session: session of the database
+        search_text: text to search
+        conditions:
+            conditions of the orders (see orm/orders_filters.py, the values
+            of their parameters are given to the returned query)
+        ranked_matches_limit:
+            if it is specified, only this amount of the newest found orders
+            is left, so the relevance isn't computed for all of them. It
+            should be used without the conditions (the newest found orders
+            are found before the conditions)
+
+    Returns:
+        query of the rows (order or None, archived order or None, rank)
+    """
+    match = literal_column("orders_search").op("MATCH")(
+        make_fts5_query(search_text)
+    )
+    query = (
+        session
+        .query(models.Order, models.ArchivedOrder, SQLITE_SEARCH_TABLE.c.rank)
+        .select_from(SQLITE_SEARCH_TABLE)
+        # With the outer joins the index is read first
+        .outerjoin(
+            models.Order, models.Order.id == SQLITE_SEARCH_TABLE.c.rowid
+        )
+        .outerjoin(
+            models.ArchivedOrder,
+            models.ArchivedOrder.id == SQLITE_SEARCH_TABLE.c.rowid
+        )
+        .filter(
+            match,
+            or_(
+                and_(models.Order.id.isnot(None), *conditions),
+                and_(models.ArchivedOrder.id.isnot(None), *(
+                    orm.archive.adapt_to_archive(condition)
+                    for condition in conditions
+                ))
+            )
+        )
+    )
+    if ranked_matches_limit is not None:
+        # FTS5 finds the orders from the given rowid without going through
+        # the older ones
+        oldest_ranked_match = (
+            select([SQLITE_SEARCH_TABLE.c.rowid])
+            .where(match)
+            .order_by(SQLITE_SEARCH_TABLE.c.rowid.desc())
+            .limit(1)
+            .offset(ranked_matches_limit - 1)
+            .correlate(None)
+            .as_scalar()
+        )
+        query = query.filter(
+            SQLITE_SEARCH_TABLE.c.rowid >= func.coalesce(oldest_ranked_match, 0)
+        )
+    return query.order_by(
+        # Lesser rank is better
+        SQLITE_SEARCH_TABLE.c.rank, SQLITE_SEARCH_TABLE.c.rowid.desc()
+    )
+
+
+def add_search(
+        query: Query, search_text: str, dialect_name: str,
+        orders_table: Table = models.Order.__table__) -> Query:
+    """
+    Leaves only the orders of the query, which are found by the search text,
+    in the databases other than SQLite (see search_in_sqlite), and sorts them
+    from the most relevant ones (orders with the same relevance are sorted by
+    ID in descending order). The relevance is added to the query as the
+    column (lesser is better), so the found orders and the found archived
+    orders can be merged by it. The search text should have search words
+    (see get_search_words).
+
+    Args:
+        query: query of the orders
+        search_text: text to search
+        dialect_name: name of the dialect of the database
+        orders_table:
+            table of the orders of the query (the orders or the archived
+            orders)
+    """
+    if dialect_name == "postgresql":
+        # The vector has the names of the columns without the table, and
+        # there is only one table of the orders in the query
+        search_vector = literal_column(POSTGRESQL_SEARCH_VECTOR)
+        search_query = func.plainto_tsquery("russian", search_text)
+        relevance = -func.ts_rank(search_vector, search_query)
+        return (
+            query
+            .filter(search_vector.op("@@")(search_query))
+            .add_columns(relevance)
+            .order_by(None)
+            .order_by(relevance, orders_table.c.id.desc())
+        )
+    # Every found order has the same relevance, so the orders are left sorted
+    # by ID
+    return query.filter(and_(*(
+        or_(
+            func.lower(orders_table.c.text).contains(
+                word.lower(), autoescape=True
+            ),
+            func.lower(orders_table.c.cancellation_reason).contains(
+                word.lower(), autoescape=True
+            )
+        )
+        for word in get_search_words(search_text)
+    ))).add_columns(literal_column("0"))
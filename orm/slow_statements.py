@@ -0,0 +1,214 @@
+"""
+Log of the slow SQL statements.
+
+Every statement of the engine is timed by its events (see
+orm.db_apis.log_slow_statements) and added to the SlowStatementsLog.
+Statements, which are slower than the threshold of the config, are logged
+with their parameters, their plan (EXPLAIN QUERY PLAN of SQLite or EXPLAIN of
+PostgreSQL) and the command, which ran them (see CURRENT_COMMAND).
+
+Statements with the same text, but with different values of the parameters,
+have the same shape (lists of the parameters of any length are the same
+too), and the statistics of the shapes are kept for the last one or two
+windows of the config, so the slowest shapes are shown to the employees by
+the command.
+"""
+import functools
+import logging
+import re
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Optional, Dict, List, Any
+
+# Name of the command, which is handled now (it is copied to the threads of
+# the DatabaseExecutor with the other context variables)
+CURRENT_COMMAND: ContextVar[Optional[str]] = ContextVar(
+    "current_command", default=None
+)
+
+# Parameters of the IN with any amount of the values ("(?, ?, ?)" of SQLite
+# or "(%(ids_1)s, %(ids_2)s)" of psycopg2)
+_PARAMETERS_LIST_REGEX = re.compile(
+    r"\((?:\?|%\(\w+\)s)(?:, (?:\?|%\(\w+\)s))*\)"
+)
+# Columns of the SELECT, which are shown only in the log
+_SELECTED_COLUMNS_REGEX = re.compile(r"^SELECT\s.*?\sFROM\s", re.DOTALL)
+
+# Values of the parameters in the log are cut to this length (statements can
+# have thousands of IDs or long texts of the orders)
+PARAMETERS_TEXT_MAX_LENGTH = 1000
+
+
+@functools.lru_cache(maxsize=1000)
+def get_statement_shape(statement: str) -> str:
+    """
+    Returns the statement, where the lists of the parameters are replaced
+    with "(?...)". Statements are compiled with the bound parameters, so the
+    same query gives the same text, and the shapes are cached by it.
+    """
+    return _PARAMETERS_LIST_REGEX.sub("(?...)", statement)
+
+
+def shorten_shape(shape: str, max_length: int) -> str:
+    """
+    Returns the shape without the selected columns and not longer than the
+    maximum length, so it can be shown in the message.
+    """
+    shape = _SELECTED_COLUMNS_REGEX.sub("SELECT ... FROM ", shape, count=1)
+    shape = " ".join(shape.split())
+    if len(shape) > max_length:
+        return shape[:max_length - 3] + "..."
+    return shape
+
+
+@dataclass
+class StatementStatistics:
+    shape: str
+    runs_amount: int = 0
+    # In seconds
+    total_duration: float = 0
+    max_duration: float = 0
+    # Command, which ran the statement for the longest time (None if it was
+    # run outside of the commands)
+    slowest_command: Optional[str] = None
+
+    def add_run(self, duration: float, command: Optional[str]) -> None:
+        self.runs_amount += 1
+        self.total_duration += duration
+        if duration > self.max_duration:
+            self.max_duration = duration
+            self.slowest_command = command
+
+    def add_statistics(self, other: "StatementStatistics") -> None:
+        self.runs_amount += other.runs_amount
+        self.total_duration += other.total_duration
+        if other.max_duration > self.max_duration:
+            self.max_duration = other.max_duration
+            self.slowest_command = other.slowest_command
+
+    @property
+    def average_duration(self) -> float:
+        if self.runs_amount == 0:
+            return 0
+        return self.total_duration / self.runs_amount
+
+
+class SlowStatementsLog:
+    """
+    Statistics of the shapes of the statements and the log of the slow ones.
+    Statements are added from the threads of the DatabaseExecutor, so the
+    statistics are changed under the lock.
+    """
+
+    def __init__(
+            self, threshold: float, slowest_statements_amount: int,
+            window: float, logger: Optional[logging.Logger] = None):
+        """
+        Args:
+            threshold:
+                statements, which run this amount of seconds or longer, are
+                logged
+            slowest_statements_amount:
+                how many shapes are returned by get_slowest_statements
+            window:
+                statistics of the previous window (in seconds) are dropped,
+                when the next one starts
+            logger: logger of the slow statements
+        """
+        self.threshold = threshold
+        self.slowest_statements_amount = slowest_statements_amount
+        self.window = window
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._window_started_at = time.monotonic()
+        # Dict[shape of the statement, statistics]
+        self._statistics: Dict[str, StatementStatistics] = {}
+        self._previous_statistics: Dict[str, StatementStatistics] = {}
+
+    def _start_next_window(self, now: float) -> None:
+        windows_amount = int((now - self._window_started_at) // self.window)
+        self._previous_statistics = (
+            self._statistics if windows_amount == 1 else {}
+        )
+        self._statistics = {}
+        self._window_started_at += windows_amount * self.window
+
+    def add_statement(self, statement: str, duration: float) -> bool:
+        """
+        Adds the run of the statement to the statistics.
+
+        Args:
+            statement: text of the statement
+            duration: duration of the run in seconds
+
+        Returns:
+            is the statement slow (so it should be logged with
+            log_slow_statement)
+        """
+        shape = get_statement_shape(statement)
+        command = CURRENT_COMMAND.get()
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_started_at >= self.window:
+                self._start_next_window(now)
+            try:
+                statistics = self._statistics[shape]
+            except KeyError:
+                statistics = StatementStatistics(shape)
+                self._statistics[shape] = statistics
+            statistics.add_run(duration, command)
+        return duration >= self.threshold
+
+    def log_slow_statement(
+            self, statement: str, parameters: Any, duration: float,
+            plan: Optional[str]) -> None:
+        """
+        Args:
+            statement: text of the statement
+            parameters: parameters of the statement
+            duration: duration of the run in seconds
+            plan:
+                plan of the statement (None if the database can't explain
+                the statement)
+        """
+        if self.logger is None:
+            return
+        parameters_text = repr(parameters)
+        if len(parameters_text) > PARAMETERS_TEXT_MAX_LENGTH:
+            parameters_text = (
+                parameters_text[:PARAMETERS_TEXT_MAX_LENGTH - 3] + "..."
+            )
+        self.logger.warning(
+            f"Slow statement ({duration * 1000:.1f} ms, command "
+            f"{CURRENT_COMMAND.get()!r}):\n{statement}\n"
+            f"Parameters: {parameters_text}\n"
+            f"Plan:\n{'(unknown)' if plan is None else plan}"
+        )
+
+    def get_slowest_statements(self) -> List[StatementStatistics]:
+        """
+        Returns:
+            statistics of the slowest shapes of the statements of the current
+            window and the previous one (sorted from the slowest run)
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_started_at >= self.window:
+                self._start_next_window(now)
+            statistics: Dict[str, StatementStatistics] = {}
+            for window_statistics in (
+                self._previous_statistics, self._statistics
+            ):
+                for shape, shape_statistics in window_statistics.items():
+                    try:
+                        statistics[shape].add_statistics(shape_statistics)
+                    except KeyError:
+                        statistics[shape] = StatementStatistics(shape)
+                        statistics[shape].add_statistics(shape_statistics)
+        return sorted(
+            statistics.values(),
+            key=lambda shape_statistics: shape_statistics.max_duration,
+            reverse=True
+        )[:self.slowest_statements_amount]
@@ -4,3 +4,10 @@ from enum import Enum
 class Sex(Enum):
     MALE = 2
     FEMALE = 1
+
+
+class ButtonColors(Enum):
+    PRIMARY = "primary"
+    SECONDARY = "secondary"
+    POSITIVE = "positive"
+    NEGATIVE = "negative"
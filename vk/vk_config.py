@@ -10,6 +10,8 @@ class VkConfig:
     SYMBOLS_PER_MESSAGE: int
     HELP_MESSAGE_BEGINNING: str
     DEFAULT_BIG_ORDER_SEQUENCES_LIMIT: int
+    PARSED_COMMANDS_CACHE_SIZE: int
+    ORDER_LISTINGS_CACHE_SIZE: int
     MEMO_FOR_USERS: str
 
 
@@ -1,13 +1,82 @@
+import json
 from dataclasses import dataclass, field
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple, Sequence
 
 import vk.enums
 
 
+@dataclass
+class CommandButton:
+    """
+    Keyboard button, which runs the command with the pre-bound arguments. The
+    command is found by the payload, so the text isn't parsed.
+    """
+
+    label: str
+    # The first name of the command (names[0])
+    command_name: str
+    # Arguments as they would be written in the text of the command
+    arguments: Tuple[str, ...] = ()
+    # Callback buttons don't send a message, they are answered with a
+    # snackbar
+    callback: bool = False
+    color: vk.enums.ButtonColors = vk.enums.ButtonColors.SECONDARY
+
+    def get_payload(self) -> dict:
+        return {"command": self.command_name, "arguments": list(self.arguments)}
+
+    def to_dict(self) -> dict:
+        return {
+            "action": {
+                "type": "callback" if self.callback else "text",
+                "label": self.label,
+                "payload": json.dumps(
+                    self.get_payload(), ensure_ascii=False
+                )
+            },
+            "color": self.color.value
+        }
+
+
+@dataclass
+class Keyboard:
+    # VK doesn't show more buttons in the inline keyboard
+    MAX_INLINE_BUTTONS_AMOUNT = 10
+
+    # Rows of the buttons
+    buttons: List[List[CommandButton]]
+    inline: bool = True
+
+    @classmethod
+    def from_buttons(
+            cls, buttons: Sequence[CommandButton],
+            buttons_in_row: int = 2) -> "Keyboard":
+        """
+        Makes an inline keyboard, where buttons are placed in rows of the
+        specified length.
+        """
+        return cls([
+            list(buttons[row_start:row_start + buttons_in_row])
+            for row_start in range(0, len(buttons), buttons_in_row)
+        ])
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "inline": self.inline,
+                "buttons": [
+                    [button.to_dict() for button in row]
+                    for row in self.buttons
+                ]
+            }, ensure_ascii=False
+        )
+
+
 @dataclass
 class Message:
     text: str
     peer_id: int
+    keyboard: Optional[Keyboard] = None
 
 
 @dataclass
@@ -15,6 +84,8 @@ class Notification:
     text_for_employees: Optional[str] = None
     text_for_client: Optional[str] = None
     additional_messages: List[Message] = field(default_factory=list)
+    keyboard_for_employees: Optional[Keyboard] = None
+    keyboard_for_client: Optional[Keyboard] = None
 
     def to_messages(
             self, client_peer_id: int,
@@ -22,7 +93,10 @@ class Notification:
         messages = []
         if self.text_for_client is not None:
             messages.append(
-                Message(self.text_for_client, client_peer_id)
+                Message(
+                    self.text_for_client, client_peer_id,
+                    self.keyboard_for_client
+                )
             )
         if (
             self.text_for_employees is not None
@@ -32,7 +106,10 @@ class Notification:
             )
         ):
             messages.append(
-                Message(self.text_for_employees, employees_chat_peer_id)
+                Message(
+                    self.text_for_employees, employees_chat_peer_id,
+                    self.keyboard_for_employees
+                )
             )
         if self.additional_messages is not None:
             messages.extend(self.additional_messages)
@@ -1,4 +1,5 @@
 import asyncio
+import json
 import logging
 import random
 from typing import AsyncGenerator, Optional, Any, Union, List
@@ -12,6 +13,10 @@ from vk.vk_config import VkConfig
 from vk.vk_related_classes import Message, DoneReply
 
 
+# VK doesn't show longer texts in the snackbar
+SNACKBAR_TEXT_MAX_LENGTH = 90
+
+
 class VKWorker:
 
     def __init__(
@@ -21,7 +26,12 @@ class VKWorker:
         self.logger = logger
         self.vk_config = vk_config
 
-    async def listen_for_messages(self) -> AsyncGenerator[Any, None]:
+    async def listen_for_events(self) -> AsyncGenerator[dict, None]:
+        """
+        Yields new messages ("message_new") and presses of the callback
+        buttons ("message_event") as they are received from VK (with "type"
+        and "object" keys).
+        """
         async for event in self.vk.listen():
             if event["type"] == "message_new":
                 message_info = event["object"]["message"]
@@ -30,33 +40,77 @@ class VKWorker:
                         f"Новое сообщение из чата с peer_id "
                         f"{message_info['peer_id']}: {message_info['text']}"
                     )
-                yield message_info
+                yield event
+            elif event["type"] == "message_event":
+                if self.logger is not None:
+                    self.logger.debug(
+                        f"Нажата кнопка в чате с peer_id "
+                        f"{event['object']['peer_id']}: "
+                        f"{event['object'].get('payload')}"
+                    )
+                yield event
+
+    async def listen_for_messages(self) -> AsyncGenerator[Any, None]:
+        async for event in self.listen_for_events():
+            if event["type"] == "message_new":
+                yield event["object"]["message"]
 
     async def reply(self, message: Message) -> None:
-        text_parts = (
+        text_parts = [
             message.text[i:i + self.vk_config.SYMBOLS_PER_MESSAGE]
             for i in range(
                 0,
                 len(message.text),
                 self.vk_config.SYMBOLS_PER_MESSAGE
             )
-        )
-        for part in text_parts:
-            await self.vk.call_method(
-                "messages.send",
-                {
-                    "peer_id": message.peer_id,
-                    "message": part,
-                    "random_id": random.randint(-1_000_000, 1_000_000),
-                    "disable_mentions": 1
-                }
-            )
+        ]
+        for part_index, part in enumerate(text_parts):
+            params = {
+                "peer_id": message.peer_id,
+                "message": part,
+                "random_id": random.randint(-1_000_000, 1_000_000),
+                "disable_mentions": 1
+            }
+            # Keyboard is attached to the last part, so it is under the whole
+            # text
+            if (
+                message.keyboard is not None
+                and part_index == len(text_parts) - 1
+            ):
+                params["keyboard"] = message.keyboard.to_json()
+            await self.vk.call_method("messages.send", params)
         if self.logger is not None:
             self.logger.debug(
                 f"Отправлено сообщение в чат с peer_id {message.peer_id}: "
                 f"{message.text}"
             )
 
+    async def answer_message_event(
+            self, event_info: dict,
+            snackbar_text: Optional[str] = None) -> None:
+        """
+        Answers the press of the callback button (until it is answered, the
+        button is shown as loading). Nothing is sent to the chat.
+
+        Args:
+            event_info: "object" of the "message_event" event
+            snackbar_text:
+                text of the popup, which is shown to the user, who pressed the
+                button (not longer than SNACKBAR_TEXT_MAX_LENGTH); if None,
+                nothing is shown
+        """
+        params = {
+            "event_id": event_info["event_id"],
+            "user_id": event_info["user_id"],
+            "peer_id": event_info["peer_id"]
+        }
+        if snackbar_text is not None:
+            params["event_data"] = json.dumps(
+                {"type": "show_snackbar", "text": snackbar_text},
+                ensure_ascii=False
+            )
+        await self.vk.call_method("messages.sendMessageEventAnswer", params)
+
     async def multiple_reply(self, messages: List[Message]) -> List[DoneReply]:
         exceptions = await asyncio.gather(
             *(self.reply(message) for message in messages),